@@ -0,0 +1,110 @@
+"""
+Measure dependency bookkeeping on synthetic wide DAGs: one upstream task feeding N downstream tasks (fan-out) and one
+downstream task waiting on N upstream tasks (fan-in).  Compares the original dict of lists with all() re-evaluation
+against DependencyGraph with per-task pending counters.  Only the bookkeeping is timed, not the state database.
+
+Run from the project root:
+    python -m benchmarks.bench_dependencies
+"""
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+from core.task import Task
+from core.dependency_graph import DependencyGraph
+from benchmarks.common import load_temporary_config
+
+
+class LegacyTask(Task):
+    """Task with the original update_dependency_state, which re-checks every dependency on each update"""
+    def update_dependency_state(self, qualified_name, new_state):
+        self.dependencies[qualified_name] = new_state
+        if all([dep_state == 'Success' for dep_state in self.dependencies.values()]):
+            self.update_state('Ready')
+
+
+class LegacyDependencies:
+    """The original TaskManager.task_dependencies bookkeeping: upstream qualified name -> list of downstream names"""
+    def __init__(self):
+        self.task_dependencies = {}
+
+    def add(self, upstream, downstream):
+        self.task_dependencies.setdefault(upstream, []).append(downstream)
+
+    def dependants_of(self, upstream):
+        return self.task_dependencies.get(upstream, ())
+
+    def remove(self, task):
+        self.task_dependencies.pop(task.qualified_name, None)
+        for dependency in task.dependencies:
+            if dependency in self.task_dependencies:
+                if task.qualified_name in self.task_dependencies[dependency]:
+                    self.task_dependencies[dependency].remove(task.qualified_name)
+
+
+class GraphDependencies(DependencyGraph):
+    def remove(self, task):
+        super().remove(task.qualified_name)
+
+
+def fan_in(task_class, graph, width):
+    """width upstream tasks all succeed, then the downstream task is removed"""
+    start = datetime(2021, 9, 21)
+    upstream = [Task('up', 'up.py', start + timedelta(minutes=i)) for i in range(width)]
+    down = task_class('down', 'down.py', start, {k.qualified_name: None for k in upstream})
+    tasks = {down.qualified_name: down}
+    for task in upstream:
+        graph.add(task.qualified_name, down.qualified_name)
+
+    begin = time.perf_counter()
+    for task in upstream:
+        for name in list(graph.dependants_of(task.qualified_name)):
+            tasks[name].update_dependency_state(task.qualified_name, 'Success')
+        graph.remove(task)
+    graph.remove(down)
+    assert down.state == 'Ready'
+    return time.perf_counter() - begin
+
+
+def fan_out(task_class, graph, width):
+    """Half of the downstream tasks of one upstream task are removed one by one (e.g. by a registry reload), then it
+    succeeds"""
+    start = datetime(2021, 9, 21)
+    up = Task('up', 'up.py', start)
+    downstream = [task_class('down', 'down.py', start + timedelta(minutes=i), {up.qualified_name: None})
+                  for i in range(2 * width)]
+    tasks = {k.qualified_name: k for k in downstream}
+    for task in downstream:
+        graph.add(up.qualified_name, task.qualified_name)
+
+    begin = time.perf_counter()
+    for task in downstream[width:]:
+        graph.remove(task)
+    for name in list(graph.dependants_of(up.qualified_name)):
+        tasks[name].update_dependency_state(up.qualified_name, 'Success')
+    graph.remove(up)
+    assert all(task.state == 'Ready' for task in downstream[:width])
+    return time.perf_counter() - begin
+
+
+def run(width=2000):
+    with tempfile.TemporaryDirectory() as directory:
+        load_temporary_config(directory)
+        results = {'width': width}
+        for shape, function in [('fan_in', fan_in), ('fan_out', fan_out)]:
+            legacy = function(LegacyTask, LegacyDependencies(), width)
+            graph = function(Task, GraphDependencies(), width)
+            results[shape + '_legacy_ms'] = 1000 * legacy
+            results[shape + '_graph_ms'] = 1000 * graph
+            results[shape + '_speedup'] = legacy / graph
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark dependency bookkeeping on wide DAGs.')
+    parser.add_argument('--width', type=int, default=2000, help='Fan-in / fan-out width')
+    args = parser.parse_args()
+
+    for key, value in run(args.width).items():
+        print('{:<28}{:,.1f}'.format(key, value))
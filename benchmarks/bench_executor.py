@@ -0,0 +1,71 @@
+"""
+Compare task throughput of the one-process-per-task executor with the pre-forked worker pool.
+
+Run from the project root:
+    python -m benchmarks.bench_executor
+"""
+import os
+import time
+import argparse
+import tempfile
+import multiprocessing as mp
+from datetime import datetime, timedelta
+
+from core.task import Task
+from core.executor import ProcessExecutor, PoolExecutor
+from benchmarks.common import load_temporary_config
+
+
+SCRIPT = """
+import json
+import logging
+logging.getLogger(__name__).info(json.dumps({'work': sum(range(1000))}))
+"""
+
+
+def run_tasks(executor, script, count, result_queue):
+    """Returns tasks per second for running count tasks of script through executor"""
+    start_time = datetime(2021, 1, 1)
+    tasks = [Task('bench', script, start_time + timedelta(minutes=i), queue=result_queue) for i in range(count)]
+    start = time.perf_counter()
+    for task in tasks:
+        executor.submit(task)
+    for _ in range(count):
+        message = result_queue.get(timeout=60)
+        executor.task_finished(message)
+    return count / (time.perf_counter() - start)
+
+
+def run(count=200, pool_size=4, preload=''):
+    with tempfile.TemporaryDirectory() as directory:
+        load_temporary_config(directory)
+        script = os.path.join(directory, 'bench_task.py')
+        with open(script, 'w') as script_file:
+            script_file.write(SCRIPT)
+        result_queue = mp.Queue()
+
+        process_rate = run_tasks(ProcessExecutor(), script, count, result_queue)
+
+        preload = [k for k in preload.split(',') if k]
+        pool = PoolExecutor(result_queue, size=pool_size, preload=preload)
+        pool_rate = run_tasks(pool, script, count, result_queue)
+        pool.shutdown()
+
+    return {
+        'tasks': count,
+        'pool_size': pool_size,
+        'process_tasks_per_second': process_rate,
+        'pool_tasks_per_second': pool_rate,
+        'speedup': pool_rate / process_rate,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark task execution backends.')
+    parser.add_argument('--tasks', type=int, default=200, help='Number of tasks to run in each mode')
+    parser.add_argument('--pool_size', type=int, default=4, help='Number of pool workers')
+    parser.add_argument('--preload', default='', help='Comma separated modules to preload in pool workers')
+    args = parser.parse_args()
+
+    for key, value in run(args.tasks, args.pool_size, args.preload).items():
+        print('{:<28}{:,.1f}'.format(key, value))
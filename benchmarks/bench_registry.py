@@ -0,0 +1,82 @@
+"""
+Measure registry load time for a large generated registry: the original ElementTree.parse loader (two passes over the
+tree), streaming iterparse loading with validation, and a warm start restored from the compiled snapshot.
+
+Run from the project root:
+    python -m benchmarks.bench_registry
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import xml.etree.ElementTree as ET
+
+from core import schedule
+from core.routine import Routine
+from core.registry import Registry
+
+
+def registry_xml(jobs, seed=0):
+    """A registry of scheduled jobs, about a third of which also depend on up to three earlier jobs"""
+    rng = random.Random(seed)
+    lines = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>', '<registry>']
+    for i in range(jobs):
+        schedule = '{} {} * * {}'.format(rng.randint(0, 59), rng.choice(['*', '*/2', '1-20']), rng.choice(['*', '1-5']))
+        dependencies = rng.sample(range(i), min(i, rng.randint(1, 3))) if rng.random() < 0.3 else []
+        if dependencies:
+            lines.append('    <job name="job{}" script="task.py" schedule="{}">'.format(i, schedule))
+            lines += ['        <dependency name="job{}"/>'.format(k) for k in dependencies]
+            lines.append('    </job>')
+        else:
+            lines.append('    <job name="job{}" script="task.py" schedule="{}"/>'.format(i, schedule))
+    lines.append('</registry>')
+    return '\n'.join(lines) + '\n'
+
+
+def legacy_load(xml_source):
+    """The original loader: parse the whole tree, then iterate it once for routines and once for dependencies"""
+    routines = {}
+    root = ET.parse(xml_source).getroot()
+    for definition in root:
+        routines[definition.attrib['name']] = Routine(**definition.attrib)
+    for definition in root:
+        successor = definition.attrib.get('name')
+        for dependency in definition.iter('dependency'):
+            routines[successor].depends_on(routines[dependency.attrib.get('name')])
+    return routines
+
+
+def timed(function, *args):
+    # Start each measurement without compiled schedule fields, as a new scheduler process would
+    schedule.parse_fields.cache_clear()
+    schedule.weekday_day_masks.cache_clear()
+    start = time.perf_counter()
+    function(*args)
+    return 1000 * (time.perf_counter() - start)
+
+
+def run(jobs=10000):
+    with tempfile.TemporaryDirectory() as directory:
+        xml_source = os.path.join(directory, 'registry.xml')
+        with open(xml_source, 'w') as xml_file:
+            xml_file.write(registry_xml(jobs))
+        snapshots = os.path.join(directory, 'snapshots')
+        results = {
+            'jobs': jobs,
+            'legacy_ms': timed(legacy_load, xml_source),
+            'streaming_ms': timed(Registry, xml_source),
+            'cold_snapshot_ms': timed(Registry, xml_source, snapshots),
+            'warm_snapshot_ms': timed(Registry, xml_source, snapshots),
+        }
+    results['warm_speedup'] = results['legacy_ms'] / results['warm_snapshot_ms']
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark registry loading.')
+    parser.add_argument('--jobs', type=int, default=10000, help='Number of jobs in the generated registry')
+    args = parser.parse_args()
+
+    for key, value in run(args.jobs).items():
+        print('{:<28}{:,.1f}'.format(key, value))
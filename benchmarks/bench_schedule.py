@@ -0,0 +1,127 @@
+"""
+Compare the compiled cron engine in core.schedule against the original minute stepping loop.
+
+Run from the project root:
+    python -m benchmarks.bench_schedule
+"""
+import time
+import random
+import datetime
+import argparse
+
+from core.schedule import Schedule
+
+
+class SteppingSchedule:
+    """
+    The original Schedule implementation, kept here as a reference point.  It only understands '*' and single values.
+    """
+    def __init__(self, cron_string):
+        input_list = [int(k) if k != '*' else k for k in cron_string.split(' ')]
+        label_list = ['minute', 'hour', 'day', 'month', 'weekday']
+        self.specs = dict(zip(label_list, input_list))
+
+    def next(self, reference, inclusive=False):
+        next = reference.replace(second=0, microsecond=0)
+        if not inclusive:
+            next = next + datetime.timedelta(minutes=1)
+        while True:
+            if (self.specs['month'] != '*' and next.month != self.specs['month']):
+                next_year = next.year if next.month != 12 else next.year + 1
+                next_month = next.month + 1 if next.month != 12 else 1
+                next = next.replace(year=next_year, month=next_month, day=1, hour=0, minute=0)
+            elif (self.specs['day'] != '*' and next.day != self.specs['day']):
+                next = next.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif (self.specs['weekday'] != '*' and next.weekday() != self.specs['weekday']):
+                next = next.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif (self.specs['hour'] != '*' and next.hour != self.specs['hour']):
+                next = next.replace(minute=0) + datetime.timedelta(hours=1)
+            elif (self.specs['minute'] != '*' and next.minute != self.specs['minute']):
+                next = next + datetime.timedelta(minutes=1)
+            else:
+                return next
+
+    def previous(self, reference, inclusive=False):
+        previous = reference.replace(second=0, microsecond=0)
+        if not inclusive:
+            previous = previous - datetime.timedelta(minutes=1)
+        while True:
+            if (self.specs['month'] != '*' and previous.month != self.specs['month']):
+                previous = previous.replace(day=1, hour=23, minute=59) - datetime.timedelta(days=1)
+            elif (self.specs['day'] != '*' and previous.day != self.specs['day']):
+                previous = previous.replace(hour=23, minute=59) - datetime.timedelta(days=1)
+            elif (self.specs['weekday'] != '*' and previous.weekday() != self.specs['weekday']):
+                previous = previous.replace(hour=23, minute=59) - datetime.timedelta(days=1)
+            elif (self.specs['hour'] != '*' and previous.hour != self.specs['hour']):
+                previous = previous.replace(minute=59) - datetime.timedelta(hours=1)
+            elif (self.specs['minute'] != '*' and previous.minute != self.specs['minute']):
+                previous = previous - datetime.timedelta(minutes=1)
+            else:
+                return previous
+
+
+def random_expressions(count, seed=0):
+    """
+    Generate cron strings using only the syntax both implementations understand ('*' and single values).
+    Day of month is capped at 28 so that every expression can fire in every month.
+    """
+    rng = random.Random(seed)
+    fields = [(0, 59), (0, 23), (1, 28), (1, 12), (0, 6)]
+    expressions = []
+    for _ in range(count):
+        expression = []
+        for low, high in fields:
+            expression.append(str(rng.randint(low, high)) if rng.random() < 0.5 else '*')
+        expressions.append(' '.join(expression))
+    return expressions
+
+
+def random_references(count, seed=1):
+    rng = random.Random(seed)
+    origin = datetime.datetime(2021, 1, 1)
+    return [origin + datetime.timedelta(minutes=rng.randint(0, 3 * 365 * 24 * 60)) for _ in range(count)]
+
+
+def time_calls(schedules, references):
+    """Returns the number of next() + previous() calls per second"""
+    start = time.perf_counter()
+    for schedule in schedules:
+        for reference in references:
+            schedule.next(reference)
+            schedule.previous(reference)
+    elapsed = time.perf_counter() - start
+    return 2 * len(schedules) * len(references) / elapsed
+
+
+def run(expression_count=500, reference_count=20):
+    expressions = random_expressions(expression_count)
+    references = random_references(reference_count)
+
+    compiled = [Schedule(k) for k in expressions]
+    stepping = [SteppingSchedule(k) for k in expressions]
+
+    # Both implementations must agree before their speed is worth comparing
+    for new, old in zip(compiled, stepping):
+        for reference in references:
+            assert new.next(reference) == old.next(reference), new
+            assert new.previous(reference) == old.previous(reference), new
+
+    compiled_rate = time_calls(compiled, references)
+    stepping_rate = time_calls(stepping, references)
+    return {
+        'expressions': expression_count,
+        'references': reference_count,
+        'compiled_calls_per_second': compiled_rate,
+        'stepping_calls_per_second': stepping_rate,
+        'speedup': compiled_rate / stepping_rate,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark Schedule.next / Schedule.previous.')
+    parser.add_argument('--expressions', type=int, default=500, help='Number of random cron expressions')
+    parser.add_argument('--references', type=int, default=20, help='Reference datetimes per expression')
+    args = parser.parse_args()
+
+    for key, value in run(args.expressions, args.references).items():
+        print('{:<28}{:,.1f}'.format(key, value))
@@ -0,0 +1,88 @@
+"""
+Measure per-run start up cost of a large task script: re-reading and compiling it on every run (the original
+exec(open(script).read()) approach) versus the compiled script cache and module entry points.
+
+Run from the project root:
+    python -m benchmarks.bench_script_cache
+"""
+import gc
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+from core.script_cache import ScriptCache, load_entry_point
+
+
+def large_script(functions):
+    """A script defining many small functions followed by a trivial amount of actual work"""
+    lines = []
+    for i in range(functions):
+        lines += ['def function_{}(x):'.format(i),
+                  '    values = {{"a": x, "b": x * {0}, "c": [x, {0}, "{0}"]}}'.format(i),
+                  '    return sum(v for v in values.values() if isinstance(v, int))',
+                  '']
+    lines += ['def main():', '    return function_0(1)', '', "if __name__ == '__main__':", '    main()', '']
+    return '\n'.join(lines)
+
+
+def per_run(function, runs):
+    """Returns mean milliseconds per call"""
+    gc.collect()
+    start = time.perf_counter()
+    for _ in range(runs):
+        function()
+    return 1000 * (time.perf_counter() - start) / runs
+
+
+def run(functions=5000, runs=20):
+    with tempfile.TemporaryDirectory() as directory:
+        script = os.path.join(directory, 'bench_task_module.py')
+        with open(script, 'w') as script_file:
+            script_file.write(large_script(functions))
+        cache_directory = os.path.join(directory, 'cache')
+        namespace = lambda: {'__name__': '__main__', '__file__': script}
+
+        def uncached():
+            exec(open(script).read(), namespace())
+
+        memory_cache = ScriptCache()
+        memory_cache.load(script)
+
+        def memory_cached():
+            exec(memory_cache.load(script), namespace())
+
+        ScriptCache(cache_directory).load(script)
+
+        def disk_cached():
+            # A fresh cache each run, as in a newly started task process
+            exec(ScriptCache(cache_directory).load(script), namespace())
+
+        sys.path.insert(0, directory)
+        load_entry_point('bench_task_module:main')
+
+        def entry_point():
+            load_entry_point('bench_task_module:main')()
+
+        results = {
+            'script_lines': large_script(functions).count('\n'),
+            'uncached_ms': per_run(uncached, runs),
+            'disk_cached_ms': per_run(disk_cached, runs),
+            'memory_cached_ms': per_run(memory_cached, runs),
+            'entry_point_ms': per_run(entry_point, runs),
+        }
+        sys.path.remove(directory)
+        sys.modules.pop('bench_task_module', None)
+    results['memory_cached_speedup'] = results['uncached_ms'] / results['memory_cached_ms']
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark task script start up.')
+    parser.add_argument('--functions', type=int, default=5000, help='Number of functions in the generated script')
+    parser.add_argument('--runs', type=int, default=20, help='Runs per approach')
+    args = parser.parse_args()
+
+    for key, value in run(args.functions, args.runs).items():
+        print('{:<28}{:,.3f}'.format(key, value))
@@ -0,0 +1,93 @@
+"""
+Compare StateManager.update throughput with one transaction per update against write-behind group commit, and the
+cost of a status query against a large history using the current_state table versus aggregating the history.
+
+Run from the project root:
+    python -m benchmarks.bench_state
+"""
+import os
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+from core.state_manager import StateManager
+
+STATES = ['Waiting', 'Ready', 'Running', 'Success', 'Archived']
+
+# The status query used before the current_state table existed
+HISTORY_STATUS_QUERY = """
+    SELECT s.routine, s.instance, s.state, s.state_time_stamp
+    FROM (
+        SELECT routine, instance, MAX(state_time_stamp) as last
+        FROM state
+        GROUP BY routine, instance
+    ) m
+    INNER JOIN state s
+    ON s.routine = m.routine
+    AND s.instance = m.instance
+    AND s.state_time_stamp = m.last
+    WHERE s.state in ('Waiting', 'Ready', 'Queued', 'Failure', 'Cancelled', 'Running')
+    ORDER BY s.instance, s.state_time_stamp
+    """
+
+
+def write_rows(state_manager, count):
+    """Returns rows per second for count updates, including the final flush and close"""
+    start_time = datetime(2021, 1, 1)
+    start = time.perf_counter()
+    for i in range(count):
+        instance = start_time + timedelta(minutes=i // len(STATES))
+        state_manager.update('routine{}'.format(i % 50), instance, STATES[i % len(STATES)])
+    state_manager.close()
+    return count / (time.perf_counter() - start)
+
+
+def status_queries(database_path, history_tasks, live_tasks=100, repeat=5):
+    """Returns (current_state, history aggregation) milliseconds per status query"""
+    state_manager = StateManager(database_path, write_behind=True, flush_rows=10000)
+    start_time = datetime(2021, 1, 1)
+    for i in range(history_tasks + live_tasks):
+        instance = start_time + timedelta(minutes=i)
+        for state in STATES if i < history_tasks else STATES[:2]:
+            state_manager.update('routine{}'.format(i % 50), instance, state)
+    state_manager.flush()
+
+    timings = []
+    for query in [lambda: state_manager.get_current_status().fetchall(),
+                  lambda: state_manager.database.execute(HISTORY_STATUS_QUERY).fetchall()]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            assert len(query()) == live_tasks
+        timings.append(1000 * (time.perf_counter() - start) / repeat)
+    state_manager.close()
+    return timings
+
+
+def run(count=5000, flush_interval_ms=50, flush_rows=500, history_tasks=100000):
+    with tempfile.TemporaryDirectory() as directory:
+        synchronous_rate = write_rows(StateManager(os.path.join(directory, 'sync.db')), count)
+        write_behind_rate = write_rows(StateManager(os.path.join(directory, 'write_behind.db'), write_behind=True,
+                                                    flush_interval_ms=flush_interval_ms, flush_rows=flush_rows), count)
+        current_ms, history_ms = status_queries(os.path.join(directory, 'status.db'), history_tasks)
+    return {
+        'rows': count,
+        'synchronous_rows_per_second': synchronous_rate,
+        'write_behind_rows_per_second': write_behind_rate,
+        'speedup': write_behind_rate / synchronous_rate,
+        'history_tasks': history_tasks,
+        'current_state_status_ms': current_ms,
+        'history_status_ms': history_ms,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark StateManager.update throughput.')
+    parser.add_argument('--rows', type=int, default=5000, help='Number of state updates')
+    parser.add_argument('--flush_interval_ms', type=int, default=50, help='Write-behind flush interval')
+    parser.add_argument('--flush_rows', type=int, default=500, help='Write-behind flush size')
+    parser.add_argument('--history', type=int, default=100000, help='Archived tasks in the status query history')
+    args = parser.parse_args()
+
+    for key, value in run(args.rows, args.flush_interval_ms, args.flush_rows, args.history).items():
+        print('{:<32}{:,.1f}'.format(key, value))
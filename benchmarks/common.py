@@ -0,0 +1,32 @@
+"""
+Helpers shared by the benchmarks.
+"""
+import os
+
+import config
+
+
+def load_temporary_config(directory, registry_xml=None, **options):
+    """
+    Write and load a scheduler configuration rooted at directory, so that benchmarks can create Tasks, registries and
+    state databases without touching a real scheduler instance.
+    :param str directory: Scratch directory
+    :param str registry_xml: Registry contents, an empty registry if None
+    :param options: Extra options for the DEFAULT section
+    :return: ConfigParser
+    """
+    registry_path = os.path.join(directory, 'registry.xml')
+    with open(registry_path, 'w') as registry_file:
+        registry_file.write(registry_xml or '<registry>\n</registry>\n')
+    config_path = os.path.join(directory, 'config.cfg')
+    lines = ['[DEFAULT]',
+             'registry = {}'.format(registry_path),
+             'database = {}'.format(os.path.join(directory, 'state.db')),
+             'config_path = {}'.format(config_path),
+             'log_directory = {}'.format(os.path.join(directory, 'logs')),
+             'last_shutdown = ']
+    lines += ['{} = {}'.format(k, v) for k, v in options.items()]
+    lines += ['', '[SESSION]', 'port = ']
+    with open(config_path, 'w') as config_file:
+        config_file.write('\n'.join(lines) + '\n')
+    return config.load_config_file(config_path)
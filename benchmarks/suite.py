@@ -0,0 +1,301 @@
+"""
+Benchmark suite for the scheduler core on a large synthetic registry (see benchmarks/synthetic.py), with tasks sent to
+a fake executor that reports success straight away, so only the scheduler's own work is timed:
+
+    * registry_load_ms: Registry load time (no snapshot)
+    * schedule_next_per_second, schedule_previous_per_second: Schedule.next / previous calls
+    * schedule_next_task_per_second: TaskManager.schedule_next_task for every routine, as on launch
+    * dispatch_per_second: tasks dispatched, run and finished through the TaskManager's event loop
+    * state_update_per_second, state_update_write_behind_per_second, state_update_many_per_second: StateManager writes
+    * state_status_per_second, state_last_result_per_second: StateManager queries (last_result without its cache)
+
+Each measurement is the best of --repeat runs.  Results are written as JSON (by default to
+benchmarks/results/<git describe>.json) and, given --compare with an earlier results file, compared with it:
+measurements more than --threshold worse are reported as regressions and make the exit status 1.
+
+Run from the project root:
+    python -m benchmarks.suite
+    python -m benchmarks.suite --compare benchmarks/results/<earlier>.json
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+from core.message import Message
+from core.registry import Registry
+from core.state_manager import StateManager
+from task_manager import TaskManager
+from benchmarks.common import load_temporary_config
+from benchmarks.synthetic import synthetic_routines, registry_xml
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIRECTORY = os.path.join(PROJECT_ROOT, 'benchmarks', 'results')
+START = datetime(2021, 9, 21)
+
+
+class FakeExecutor:
+    """Runs nothing: every submitted task is reported as a Success on the event queue straight away"""
+    def __init__(self, result_queue):
+        self.result_queue = result_queue
+        self.submitted = 0
+
+    def submit(self, task):
+        self.submitted += 1
+        self.result_queue.put(Message(name=task.name, time=task.time, qualified_name=task.qualified_name,
+                                      state='Success', time_stamp=datetime.today()))
+
+    def task_finished(self, message):
+        pass
+
+    def reap(self):
+        return []
+
+    def cancel(self, qualified_name):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+def result(value, unit, higher_is_better=True):
+    return {'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def best_of(repeat, function):
+    """Returns the shortest of repeat timings of function(), which returns seconds"""
+    return min(function() for _ in range(repeat))
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def bench_registry(registry_path, repeat):
+    return {'registry_load_ms': result(1000 * best_of(repeat, lambda: timed(Registry, registry_path)), 'ms', False)}
+
+
+def bench_schedule(registry, calls, repeat):
+    schedules = [routine.schedule for _, routine in registry if routine.schedule]
+    rng = random.Random(0)
+    references = [START + timedelta(minutes=rng.randint(0, 60 * 24 * 365)) for _ in range(calls)]
+    pairs = [(schedules[i % len(schedules)], reference) for i, reference in enumerate(references)]
+
+    def run(method):
+        start = time.perf_counter()
+        for schedule, reference in pairs:
+            getattr(schedule, method)(reference)
+        return time.perf_counter() - start
+
+    return {
+        'schedule_next_per_second': result(calls / best_of(repeat, lambda: run('next')), 'calls/s'),
+        'schedule_previous_per_second': result(calls / best_of(repeat, lambda: run('previous')), 'calls/s'),
+    }
+
+
+def bench_task_manager(directory, configuration, registry_path, dispatches, repeat):
+    """Returns scheduling and dispatch results, each from a fresh TaskManager and state database"""
+    schedule_times, dispatch_rates = [], []
+    for attempt in range(repeat):
+        registry = Registry(registry_path)
+        events = queue.Queue()
+        state_manager = StateManager(os.path.join(directory, 'task_manager_{}.db'.format(attempt)), write_behind=True)
+        executor = FakeExecutor(events)
+        task_manager = TaskManager(events, state_manager, registry, configuration, executor=executor)
+
+        start = time.perf_counter()
+        for _, routine in registry:
+            task_manager.schedule_next_task(routine, START)
+        schedule_times.append(time.perf_counter() - start)
+        task_manager.wait_for_updates(0)
+
+        # Time advances a minute at a time; due tasks are dispatched and succeed, releasing their dependants, until
+        # enough have been dispatched
+        reference_time = START
+        start = time.perf_counter()
+        while executor.submitted < dispatches and task_manager.next_runtime() is not None:
+            reference_time = max(reference_time + timedelta(minutes=1), task_manager.next_runtime())
+            task_manager.run_pending_jobs(reference_time)
+            while task_manager.wait_for_updates(0):
+                task_manager.run_pending_jobs(reference_time)
+        dispatch_rates.append(executor.submitted / (time.perf_counter() - start))
+        state_manager.close()
+    return {
+        'schedule_next_task_per_second': result(len(registry.routines) / min(schedule_times), 'routines/s'),
+        'dispatch_per_second': result(max(dispatch_rates), 'tasks/s'),
+    }
+
+
+def synthetic_updates(count, routines=50):
+    return [('routine{}'.format(i % routines), START + timedelta(minutes=i), 'Waiting') for i in range(count)]
+
+
+def bench_state_manager(directory, rows, repeat):
+    counter = iter(range(1000000))
+
+    def database():
+        return os.path.join(directory, 'state_{}.db'.format(next(counter)))
+
+    def updates(write_behind, count):
+        state_manager = StateManager(database(), write_behind=write_behind)
+        start = time.perf_counter()
+        for row in synthetic_updates(count):
+            state_manager.update(*row)
+        state_manager.flush()
+        elapsed = time.perf_counter() - start
+        state_manager.close()
+        return elapsed
+
+    def update_many(count, batch=500):
+        state_manager = StateManager(database())
+        updates = synthetic_updates(count)
+        start = time.perf_counter()
+        for i in range(0, count, batch):
+            state_manager.update_many(updates[i:i + batch])
+        elapsed = time.perf_counter() - start
+        state_manager.close()
+        return elapsed
+
+    # Queries run against a database holding every row as a current task
+    state_manager = StateManager(database(), result_cache_size=0)
+    state_manager.update_many(synthetic_updates(rows))
+    keys = [row[:2] for row in synthetic_updates(rows)][::max(1, rows // 1000)]
+
+    def status(count=20):
+        start = time.perf_counter()
+        for i in range(count):
+            state_manager.get_current_status('routine{}'.format(i)).fetchall()
+        return (time.perf_counter() - start) / count
+
+    def last_result():
+        start = time.perf_counter()
+        for key in keys:
+            state_manager.last_result(*key)
+        return (time.perf_counter() - start) / len(keys)
+
+    synchronous_rows = max(1, rows // 10)  # one transaction each
+    results = {
+        'state_update_per_second': result(synchronous_rows / best_of(repeat, lambda: updates(False, synchronous_rows)),
+                                          'rows/s'),
+        'state_update_write_behind_per_second': result(rows / best_of(repeat, lambda: updates(True, rows)), 'rows/s'),
+        'state_update_many_per_second': result(rows / best_of(repeat, lambda: update_many(rows)), 'rows/s'),
+        'state_status_per_second': result(1 / best_of(repeat, status), 'queries/s'),
+        'state_last_result_per_second': result(1 / best_of(repeat, last_result), 'queries/s'),
+    }
+    state_manager.close()
+    return results
+
+
+def git_describe():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=PROJECT_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(routines=2000, chain_depth=20, fan_width=50, dispatches=20000, schedule_calls=20000, state_rows=20000,
+        repeat=3, seed=0):
+    """
+    Run every benchmark.
+    :return: dict of the run's description and its results, ready to be saved as JSON
+    """
+    parameters = {'routines': routines, 'chain_depth': chain_depth, 'fan_width': fan_width,
+                  'dispatches': dispatches, 'schedule_calls': schedule_calls, 'state_rows': state_rows,
+                  'repeat': repeat, 'seed': seed}
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        jobs = synthetic_routines(routines, chain_depth, fan_width, seed)
+        configuration = load_temporary_config(directory, registry_xml(jobs))
+        registry_path = configuration.get('DEFAULT', 'registry')
+        parameters['routines'] = len(jobs)
+
+        results.update(bench_registry(registry_path, repeat))
+        results.update(bench_schedule(Registry(registry_path), schedule_calls, repeat))
+        results.update(bench_task_manager(directory, configuration, registry_path, dispatches, repeat))
+        results.update(bench_state_manager(directory, state_rows, repeat))
+    return {
+        'commit': git_describe(),
+        'timestamp': datetime.today().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': parameters,
+        'results': results,
+    }
+
+
+def compare(previous, current, threshold):
+    """
+    Compare two suite runs.
+    :param dict previous: The earlier run
+    :param dict current: The later run
+    :param float threshold: Relative change beyond which a measurement counts as a regression, e.g. 0.1
+    :return: (rows of (name, previous value, current value, relative change, regressed), list of regressed names)
+    """
+    rows = []
+    for name, measurement in current['results'].items():
+        if name not in previous['results']:
+            continue
+        before, after = previous['results'][name]['value'], measurement['value']
+        change = (after - before) / before if before else 0.0
+        worse = -change if measurement['higher_is_better'] else change
+        rows.append((name, before, after, change, worse > threshold))
+    return rows, [row[0] for row in rows if row[4]]
+
+
+def print_results(suite):
+    print('commit {}, {} routines'.format(suite['commit'], suite['parameters']['routines']))
+    for name, measurement in suite['results'].items():
+        print('{:<40}{:>16,.1f} {}'.format(name, measurement['value'], measurement['unit']))
+
+
+def print_comparison(previous, current, rows):
+    print('\ncompared with commit {}'.format(previous['commit']))
+    if previous['parameters'] != current['parameters']:
+        print('(run with different parameters: {})'.format(previous['parameters']))
+    for name, before, after, change, regressed in rows:
+        print('{:<40}{:>16,.1f}{:>16,.1f}{:>+9.1%}{}'.format(name, before, after, change,
+                                                             '  REGRESSION' if regressed else ''))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the scheduler core on a synthetic registry.')
+    parser.add_argument('--routines', type=int, default=2000, help='Number of routines')
+    parser.add_argument('--chain_depth', type=int, default=20, help='Length of dependency chains')
+    parser.add_argument('--fan_width', type=int, default=50, help='Width of fan-outs and fan-ins')
+    parser.add_argument('--dispatches', type=int, default=20000, help='Tasks dispatched by the dispatch benchmark')
+    parser.add_argument('--schedule_calls', type=int, default=20000, help='Schedule.next / previous calls')
+    parser.add_argument('--state_rows', type=int, default=20000, help='Rows written by the StateManager benchmarks')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, the best is kept')
+    parser.add_argument('--seed', type=int, default=0, help='Synthetic registry random seed')
+    parser.add_argument('--output', help='Results JSON file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', help='Earlier results JSON file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative change reported as a regression')
+    args = parser.parse_args()
+
+    suite = run(args.routines, args.chain_depth, args.fan_width, args.dispatches, args.schedule_calls,
+                args.state_rows, args.repeat, args.seed)
+    print_results(suite)
+
+    output = args.output or os.path.join(RESULTS_DIRECTORY, '{}.json'.format(suite['commit'] or 'unknown'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as results_file:
+        json.dump(suite, results_file, indent=2)
+    print('\nresults written to {}'.format(output))
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous = json.load(previous_file)
+        rows, regressions = compare(previous, suite, args.threshold)
+        print_comparison(previous, suite, rows)
+        if regressions:
+            sys.exit(1)
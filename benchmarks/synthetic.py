@@ -0,0 +1,103 @@
+"""
+Generator of large synthetic registries for the benchmark suite.
+
+A synthetic registry mixes four shapes of routines:
+    * independent: scheduled routines with no dependencies
+    * chains: a scheduled head followed by chain_depth dependency-only routines, each depending on the one before
+    * fan-out: a scheduled hub with fan_width dependency-only routines depending on it
+    * fan-in: fan_width scheduled routines feeding one dependency-only sink
+Schedules are drawn from CRON_DENSITIES, from every minute to monthly, with randomised minutes and hours so triggers
+are spread out.
+
+Run from the project root to write one:
+    python -m benchmarks.synthetic --routines 5000 --output registry.xml
+"""
+import random
+import argparse
+from xml.sax.saxutils import quoteattr
+
+# (cron template, weight).  {m} is replaced by a random minute and {h} by a random hour.
+CRON_DENSITIES = [
+    ('* * * * *', 1),
+    ('*/5 * * * *', 2),
+    ('*/15 9-17 * * 1-5', 2),
+    ('{m} * * * *', 4),
+    ('{m} {h} * * *', 4),
+    ('{m} {h} * * 1-5', 2),
+    ('{m} {h} 1 * *', 1),
+]
+
+# Share of the routines in each dependency shape, the rest are independent
+SHAPES = {'chains': 0.2, 'fan_out': 0.2, 'fan_in': 0.2}
+
+
+def random_schedule(rng):
+    templates, weights = zip(*CRON_DENSITIES)
+    return rng.choices(templates, weights)[0].format(m=rng.randint(0, 59), h=rng.randint(0, 23))
+
+
+def synthetic_routines(routines=2000, chain_depth=20, fan_width=50, seed=0):
+    """
+    Describe a synthetic registry.
+    :param int routines: Number of routines (chains and fans are whole, the independent routines make up the rest)
+    :param int chain_depth: Dependency-only routines after the head of each chain
+    :param int fan_width: Routines on the wide side of each fan-out and fan-in
+    :param int seed: Random seed, so a registry can be regenerated identically
+    :return: list of (name, schedule or None, list of dependency names), every routine after its dependencies
+    """
+    rng = random.Random(seed)
+    jobs = []
+
+    def add(prefix, schedule, dependencies=()):
+        name = '{}{}'.format(prefix, len(jobs))
+        jobs.append((name, schedule, list(dependencies)))
+        return name
+
+    for _ in range(max(1, int(routines * SHAPES['chains']) // (chain_depth + 1))):
+        previous = add('chain', random_schedule(rng))
+        for _ in range(chain_depth):
+            previous = add('chain', None, [previous])
+    for _ in range(max(1, int(routines * SHAPES['fan_out']) // (fan_width + 1))):
+        hub = add('hub', random_schedule(rng))
+        for _ in range(fan_width):
+            add('spoke', None, [hub])
+    for _ in range(max(1, int(routines * SHAPES['fan_in']) // (fan_width + 1))):
+        sources = [add('source', random_schedule(rng)) for _ in range(fan_width)]
+        add('sink', None, sources)
+    # Independent routines make up the rest
+    for _ in range(routines - len(jobs)):
+        add('job', random_schedule(rng))
+    return jobs
+
+
+def registry_xml(jobs, script='task.py'):
+    """
+    Render routines from synthetic_routines() as registry xml.
+    """
+    lines = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>', '<registry>']
+    for name, schedule, dependencies in jobs:
+        attributes = 'name="{}" script={}'.format(name, quoteattr(script))
+        if schedule:
+            attributes += ' schedule="{}"'.format(schedule)
+        if dependencies:
+            lines.append('    <job {}>'.format(attributes))
+            lines += ['        <dependency name="{}"/>'.format(k) for k in dependencies]
+            lines.append('    </job>')
+        else:
+            lines.append('    <job {}/>'.format(attributes))
+    lines.append('</registry>')
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic registry.')
+    parser.add_argument('--routines', type=int, default=2000, help='Number of routines')
+    parser.add_argument('--chain_depth', type=int, default=20, help='Length of dependency chains')
+    parser.add_argument('--fan_width', type=int, default=50, help='Width of fan-outs and fan-ins')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--output', required=True, help='Registry xml file to write')
+    args = parser.parse_args()
+
+    with open(args.output, 'w') as registry_file:
+        registry_file.write(registry_xml(synthetic_routines(args.routines, args.chain_depth, args.fan_width,
+                                                            args.seed)))
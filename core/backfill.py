@@ -0,0 +1,120 @@
+import heapq
+from datetime import timedelta
+
+import config
+
+
+class Backfill:
+    """
+    A rerun of a routine, and every routine downstream of it, over a window of task times.
+
+    Task instances are generated lazily, in time order and, for equal times, upstream routines first, so a backfilled
+    instance is always created after the instances it depends on.  The TaskManager keeps at most 'window' instances
+    outstanding and runs at most 'max_running' at once.
+    """
+    def __init__(self, name, registry, routine_name, start, end, max_running=2, window=100):
+        """
+        Initialize object.
+        :param str name: Identifies the backfill (tasks refer to it by name)
+        :param Registry registry: The registry
+        :param str routine_name: The routine to rerun
+        :param datetime start: Earliest task time (inclusive)
+        :param datetime end: Latest task time (inclusive)
+        :param int max_running: Maximum number of backfill tasks running at once
+        :param int window: Maximum number of backfill tasks created but not yet finished
+        """
+        if routine_name not in registry.routines:
+            raise Exception('Unknown routine: {}'.format(routine_name))
+        self.name = name
+        self.routine_name = routine_name
+        self.start = start
+        self.end = end
+        self.max_running = max_running
+        self.window = window
+
+        names = {routine_name}
+        stack = [registry.get_routine(routine_name)]
+        while stack:
+            for dependant in stack.pop().dependants:
+                if dependant.name not in names:
+                    names.add(dependant.name)
+                    stack.append(dependant)
+        self.routines = registry.topological_order(names)
+        self.instances = heapq.merge(*[self.triggers(registry.get_routine(name), rank)
+                                       for rank, name in enumerate(self.routines)])
+        # Instances in the window, counted without creating them
+        self.total = sum(1 for name in self.routines for _ in self.triggers(registry.get_routine(name), 0))
+
+        self.outstanding = set()  # qualified names of created tasks that have not finished
+        self.running = set()
+        self.exhausted = False
+        self.last_time = None
+        self.counts = {'created': 0, 'skipped': 0, 'Success': 0, 'Failure': 0, 'Cancelled': 0}
+
+    def triggers(self, routine, rank):
+        """
+        Yields (time, rank, routine name) for every trigger of a routine in the window.
+        """
+        if routine.schedule:
+            for chunk in routine.schedule.iter_occurrences(self.start, self.end + timedelta(microseconds=1)):
+                for time in chunk.astype('datetime64[us]').tolist():
+                    yield time, rank, routine.name
+        elif routine.dependencies:
+            time = routine.next_trigger(self.start, inclusive=True)
+            while time <= self.end:
+                yield time, rank, routine.name
+                time = routine.next_trigger(time)
+
+    def next_instance(self):
+        """
+        Returns (routine name, time) of the next instance to create, or None once the window is exhausted.
+        """
+        instance = next(self.instances, None)
+        if instance is None:
+            self.exhausted = True
+            return None
+        time, _, name = instance
+        self.last_time = time
+        return name, time
+
+    def finished(self, qualified_name, state):
+        """
+        Record the end of one of the backfill's tasks.
+        :param str qualified_name: Task qualified name
+        :param str state: 'Success', 'Failure' or 'Cancelled'
+        """
+        self.outstanding.discard(qualified_name)
+        self.running.discard(qualified_name)
+        self.counts[state] += 1
+
+    def done(self):
+        return self.exhausted and not self.outstanding
+
+    def status(self):
+        """
+        Returns the backfill's progress: instances generated (created as tasks, or skipped as already scheduled), done
+        (succeeded), failed, cancelled and running, and those remaining, not yet finished or not yet generated.
+        """
+        finished = self.counts['Success'] + self.counts['Failure'] + self.counts['Cancelled']
+        return {'name': self.name, 'routine': self.routine_name, 'start': self.start.strftime(config.dt_format_str),
+                'end': self.end.strftime(config.dt_format_str), 'total': self.total,
+                'generated': self.counts['created'] + self.counts['skipped'], 'skipped': self.counts['skipped'],
+                'done': self.counts['Success'], 'failed': self.counts['Failure'],
+                'cancelled': self.counts['Cancelled'], 'running': len(self.running),
+                'remaining': self.total - self.counts['skipped'] - finished, 'finished': self.done()}
+
+    def progress(self):
+        """
+        Returns a one line summary of the backfill's progress.
+        """
+        if self.exhausted:
+            covered = 100.0
+        elif self.last_time is None or self.end <= self.start:
+            covered = 0.0
+        else:
+            covered = 100 * (self.last_time - self.start) / (self.end - self.start)
+        return '{} {} to {}: {} succeeded, {} failed, {} cancelled, {} outstanding ({} running), {:.0f}% of window ' \
+               'generated'.format(self.routine_name, self.start.strftime(config.dt_format_str),
+                                  self.end.strftime(config.dt_format_str), self.counts['Success'],
+                                  self.counts['Failure'], self.counts['Cancelled'], len(self.outstanding),
+                                  len(self.running), covered)
@@ -0,0 +1,32 @@
+from datetime import datetime
+
+
+class SystemClock:
+    """
+    The wall clock.
+    """
+    def now(self):
+        return datetime.today()
+
+
+class VirtualClock:
+    """
+    A clock that only moves when advanced, for driving a TaskManager through simulated time (or a fixed time in tests).
+    """
+    def __init__(self, start):
+        """
+        Initialize object.
+        :param datetime start: The initial time
+        """
+        self.time = start
+
+    def now(self):
+        return self.time
+
+    def advance(self, moment):
+        """
+        Move the clock forward to moment.  A moment in the past leaves the clock where it is.
+        :param datetime moment: The new time
+        """
+        if moment > self.time:
+            self.time = moment
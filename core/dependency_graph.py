@@ -0,0 +1,44 @@
+class DependencyGraph:
+    """
+    Which scheduled tasks wait on which, by qualified name, kept as adjacency sets in both directions.  An upstream
+    task may be registered before it is scheduled (a dependency that is due to run in the future).  Adding or removing
+    an edge is O(1) and removing a task is O(its number of edges), however wide the graph.
+    """
+    def __init__(self):
+        self.dependants = {}  # upstream qualified name -> set of downstream qualified names
+        self.dependencies = {}  # downstream qualified name -> set of upstream qualified names
+
+    def __contains__(self, upstream):
+        return upstream in self.dependants
+
+    def __len__(self):
+        return len(self.dependants)
+
+    def add(self, upstream, downstream):
+        """
+        Register that downstream waits on upstream.
+        :param str upstream: Qualified name of the task waited on
+        :param str downstream: Qualified name of the waiting task
+        """
+        self.dependants.setdefault(upstream, set()).add(downstream)
+        self.dependencies.setdefault(downstream, set()).add(upstream)
+
+    def dependants_of(self, upstream):
+        """
+        Returns the qualified names of the tasks waiting on upstream.
+        :param str upstream: Qualified name
+        :return: set (do not modify)
+        """
+        return self.dependants.get(upstream, ())
+
+    def remove(self, qualified_name):
+        """
+        Remove a task and all of its edges, both as an upstream and as a downstream task.
+        :param str qualified_name: Qualified name
+        """
+        for downstream in self.dependants.pop(qualified_name, ()):
+            self.dependencies[downstream].discard(qualified_name)
+        for upstream in self.dependencies.pop(qualified_name, ()):
+            dependants = self.dependants.get(upstream)
+            if dependants is not None:
+                dependants.discard(qualified_name)
@@ -0,0 +1,344 @@
+import os
+import sys
+import time
+import signal
+import logging
+import importlib
+import threading
+import subprocess
+import multiprocessing as mp
+from multiprocessing.connection import wait
+from datetime import datetime
+from collections import deque
+
+import config
+from core.message import Message
+from core.task import run_script, start_process_group
+from core.task_logs import task_log_path
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, where worker memory is not tracked
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+# A task process that exited cleanly is only reaped if its result has not arrived after this many seconds
+REAP_GRACE_SECONDS = 5
+
+
+def kill_process_tree(process):
+    """
+    Kill a task or worker process and the processes it started.
+    :param Process process: A started multiprocessing Process
+    """
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            # It has not made itself a group leader yet
+            process.kill()
+    else:
+        subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)], capture_output=True)
+        process.kill()
+    process.join()
+
+
+def create_executor(configuration, result_queue, log_queue=None):
+    """
+    Create the task execution backend selected by the 'executor' option of the DEFAULT config section.
+    :param ConfigParser configuration: The scheduler configuration
+    :param Queue result_queue: The queue task state messages are sent through
+    :param Queue log_queue: The LogWriter's queue, None for a log file per task
+    :return: ProcessExecutor or PoolExecutor
+    """
+    mode = configuration.get('DEFAULT', 'executor', fallback='process')
+    output = {'log_directory': configuration.get('DEFAULT', 'log_directory'),
+              'script_cache': configuration.get('DEFAULT', 'script_cache', fallback=None),
+              'log_queue': log_queue}
+    if mode == 'process':
+        return ProcessExecutor(**output)
+    elif mode == 'pool':
+        preload = configuration.get('DEFAULT', 'preload', fallback='')
+        return PoolExecutor(result_queue, **output,
+                            size=configuration.getint('DEFAULT', 'pool_size', fallback=os.cpu_count()),
+                            max_tasks=configuration.getint('DEFAULT', 'worker_max_tasks', fallback=0),
+                            max_memory=configuration.getint('DEFAULT', 'worker_max_memory', fallback=0),
+                            preload=[k.strip() for k in preload.split(',') if k.strip()])
+    else:
+        raise Exception('Unknown executor: {}'.format(mode))
+
+
+class Executor:
+    """
+    Settings shared by the executors: where tasks log to and where compiled scripts are cached.
+    """
+    def __init__(self, log_directory=None, script_cache=None, log_queue=None):
+        """
+        Initialize object.
+        :param str log_directory: Task log directory (default: from the loaded config)
+        :param str script_cache: Directory to persist compiled scripts in (optional)
+        :param Queue log_queue: The LogWriter's queue, None for a log file per task
+        """
+        self.log_directory = log_directory or config.get_config_file().get('DEFAULT', 'log_directory')
+        self.script_cache = script_cache
+        self.log_queue = log_queue
+
+    def prepare(self, task):
+        task.script_cache = self.script_cache
+        if self.log_queue is None:
+            task.log = task_log_path(self.log_directory, task.name, task.qualified_name)
+
+
+class ProcessExecutor(Executor):
+    """
+    Runs every task in a freshly started process of its own (the Task object itself).
+    """
+    def __init__(self, log_directory=None, script_cache=None, log_queue=None):
+        super().__init__(log_directory, script_cache, log_queue)
+        self.processes = {}  # qualified name -> running Task
+        self.exited = {}  # qualified name -> when its process was first seen to have exited cleanly
+
+    def submit(self, task):
+        self.prepare(task)
+        task.log_queue = self.log_queue
+        task.start()
+        self.processes[task.qualified_name] = task
+
+    def task_finished(self, message):
+        self.exited.pop(message.qualified_name, None)
+        task = self.processes.pop(message.qualified_name, None)
+        if task is not None:
+            task.join(0)
+
+    def reap(self):
+        """
+        Find tasks whose process has died without reporting a result (killed, crashed or exited early).  A clean exit
+        is given REAP_GRACE_SECONDS for its result, which may still be on its way, to arrive.
+        :return: list of (qualified name, exit code)
+        """
+        sentinels = {task.sentinel: name for name, task in self.processes.items()}
+        dead = []
+        now = time.monotonic()
+        for sentinel in wait(list(sentinels), timeout=0):
+            name = sentinels[sentinel]
+            task = self.processes[name]
+            task.join(0)
+            if task.exitcode == 0 and now - self.exited.setdefault(name, now) < REAP_GRACE_SECONDS:
+                continue
+            del self.processes[name]
+            self.exited.pop(name, None)
+            dead.append((name, task.exitcode))
+        return dead
+
+    def cancel(self, qualified_name):
+        """
+        Kill a running task's process.
+        :return: True if the task was running
+        """
+        self.exited.pop(qualified_name, None)
+        task = self.processes.pop(qualified_name, None)
+        if task is None:
+            return False
+        kill_process_tree(task)
+        return True
+
+    def shutdown(self):
+        pass
+
+
+def max_rss():
+    """Returns the peak resident memory of the current process in MB, or 0 if it cannot be measured"""
+    if resource is None:
+        return 0
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def worker_main(jobs, results, preload, logs=None):
+    """
+    Main function of a pool worker process: import the preload modules once, then run jobs until told to stop.
+    :param Connection jobs: Receiving end of the worker's job pipe.  None means exit.
+    :param Queue results: Queue for task state messages
+    :param list preload: Names of modules to import before running any job
+    :param Queue logs: Queue for task log lines, None to log to the file named by each job
+    """
+    start_process_group()
+    for module in preload:
+        importlib.import_module(module)
+    while True:
+        job = jobs.recv()
+        if job is None:
+            break
+        result = run_script(job['script'], job['qualified_name'], job['log'], job['entry_point'], job['script_cache'],
+                            logs)
+        results.put(Message(name=job['name'], time=job['time'], qualified_name=job['qualified_name'], state=result,
+                            time_stamp=datetime.today(), worker=os.getpid(), memory=max_rss()))
+
+
+class Worker:
+    """
+    Parent side handle on one pool worker process.
+    """
+    def __init__(self, context, results, preload, logs=None):
+        self.jobs, sender = context.Pipe(duplex=False)
+        self.sender = sender
+        # Not a daemon, so that tasks may start processes of their own.  shutdown() stops and joins every worker.
+        self.process = context.Process(target=worker_main, args=(self.jobs, results, preload, logs))
+        self.process.start()
+        self.task = None  # qualified name of the task being run
+        self.tasks_run = 0
+
+    def send(self, job):
+        self.task = job['qualified_name'] if job else None
+        self.sender.send(job)
+
+    def stop(self):
+        self.send(None)
+        self.sender.close()
+
+
+class PoolExecutor(Executor):
+    """
+    Runs tasks on a pool of long-lived worker processes, so that process start up, library imports and logging set up
+    are paid once per worker rather than once per task.  Workers are started through a forkserver (where available)
+    which imports the preload modules once, so every worker starts with them already loaded.  A worker is replaced
+    once it has run max_tasks tasks or its peak memory exceeds max_memory MB.
+    """
+    def __init__(self, result_queue, size, max_tasks=0, max_memory=0, preload=None, start_method=None,
+                 log_directory=None, script_cache=None, log_queue=None):
+        """
+        Initialize object.  log_directory, script_cache and log_queue are as for Executor.
+        :param Queue result_queue: The queue task state messages are sent through
+        :param int size: Number of worker processes
+        :param int max_tasks: Replace a worker after this many tasks (0 for never)
+        :param int max_memory: Replace a worker once its peak memory exceeds this many MB (0 for never)
+        :param list preload: Names of modules to import in every worker before it runs any job
+        :param str start_method: multiprocessing start method, by default forkserver if supported, else spawn
+        """
+        super().__init__(log_directory, script_cache, log_queue)
+        if start_method is None:
+            start_method = 'forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn'
+        self.context = mp.get_context(start_method)
+        self.preload = preload or []
+        if start_method == 'forkserver':
+            self.context.set_forkserver_preload(['core.executor'] + self.preload)
+        self.size = size
+        self.max_tasks = max_tasks
+        self.max_memory = max_memory
+        self.result_queue = result_queue
+
+        # Workers report (and log) through queues of their own multiprocessing context, which are forwarded
+        self.worker_results = self.context.Queue()
+        self.forwarder = threading.Thread(target=self.forward, args=(self.worker_results, result_queue), daemon=True)
+        self.forwarder.start()
+        self.worker_logs = None
+        if log_queue is not None:
+            self.worker_logs = self.context.Queue()
+            self.log_forwarder = threading.Thread(target=self.forward, args=(self.worker_logs, log_queue), daemon=True)
+            self.log_forwarder.start()
+
+        self.idle = deque()
+        self.busy = {}  # qualified name -> Worker
+        self.backlog = deque()  # jobs waiting for an idle worker
+        self.retired = []  # recycled workers that may still be exiting
+        logger.info('Starting %s pool workers (%s)', size, start_method)
+        for _ in range(size):
+            self.idle.append(self.start_worker())
+
+    def start_worker(self):
+        return Worker(self.context, self.worker_results, self.preload, self.worker_logs)
+
+    @staticmethod
+    def forward(source, destination):
+        while True:
+            item = source.get()
+            if item is None:
+                break
+            destination.put(item)
+
+    def submit(self, task):
+        self.prepare(task)
+        job = {'name': task.name, 'script': task.script, 'time': task.time, 'qualified_name': task.qualified_name,
+               'log': task.log, 'entry_point': task.entry_point, 'script_cache': task.script_cache}
+        if self.idle:
+            self.assign(self.idle.popleft(), job)
+        else:
+            self.backlog.append(job)
+
+    def assign(self, worker, job):
+        worker.send(job)
+        self.busy[job['qualified_name']] = worker
+
+    def task_finished(self, message):
+        worker = self.busy.pop(message.qualified_name, None)
+        if worker is None:
+            return
+        worker.task = None
+        worker.tasks_run += 1
+        memory = getattr(message, 'memory', 0)
+        if (self.max_tasks and worker.tasks_run >= self.max_tasks) or (self.max_memory and memory >= self.max_memory):
+            logger.info('Recycling worker %s after %s tasks (%.0f MB)', worker.process.pid, worker.tasks_run, memory)
+            worker.stop()
+            self.retired = [k for k in self.retired if k.process.is_alive()] + [worker]
+            worker = self.start_worker()
+        self.release(worker)
+
+    def release(self, worker):
+        if self.backlog:
+            self.assign(worker, self.backlog.popleft())
+        else:
+            self.idle.append(worker)
+
+    def cancel(self, qualified_name):
+        """
+        Drop a task waiting for a worker, or kill the worker running it and start a replacement.
+        :return: True if the task was waiting or running
+        """
+        for job in self.backlog:
+            if job['qualified_name'] == qualified_name:
+                self.backlog.remove(job)
+                return True
+        worker = self.busy.pop(qualified_name, None)
+        if worker is None:
+            return False
+        logger.info('Killing worker %s running %s', worker.process.pid, qualified_name)
+        kill_process_tree(worker.process)
+        worker.sender.close()
+        self.release(self.start_worker())
+        return True
+
+    def reap(self):
+        """
+        Replace workers that have died (killed, crashed or stopped by a task calling exit), reporting the tasks they
+        were running.
+        :return: list of (qualified name, exit code)
+        """
+        workers = {worker.process.sentinel: worker for worker in list(self.idle) + list(self.busy.values())}
+        dead = []
+        for sentinel in wait(list(workers), timeout=0):
+            worker = workers[sentinel]
+            worker.process.join(0)
+            logger.warning('Worker %s exited with code %s, replacing it', worker.process.pid, worker.process.exitcode)
+            if worker.task is None:
+                self.idle.remove(worker)
+            else:
+                del self.busy[worker.task]
+                dead.append((worker.task, worker.process.exitcode))
+            worker.sender.close()
+            self.release(self.start_worker())
+        return dead
+
+    def shutdown(self):
+        logger.info('Stopping pool workers')
+        for worker in list(self.idle) + list(self.busy.values()):
+            worker.stop()
+        for worker in list(self.idle) + list(self.busy.values()) + self.retired:
+            worker.process.join()
+        self.worker_results.put(None)
+        self.forwarder.join()
+        if self.worker_logs is not None:
+            self.worker_logs.put(None)
+            self.log_forwarder.join()
@@ -8,3 +8,10 @@ class Message:
     def __str__(self):
         element_list = [': '.join([str(k), str(v)]) for k, v in self.__dict__.items()]
         return str(element_list)
+
+
+class Request(Message):
+    """
+    An instruction received by the control server: request_id, command and arguments.  The TaskManager answers it
+    through its responder.
+    """
@@ -0,0 +1,267 @@
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger(__name__)
+
+"""
+Scheduler instrumentation: counters, histograms and gauges kept in process memory and rendered in the Prometheus text
+exposition format (version 0.0.4), served over HTTP by a MetricsServer.
+
+Recording is a dictionary lookup and a few additions on the caller's thread, with no locking.  Rendering copies what it
+reads, so a scrape from the server thread sees each series at some recent point, never a torn update.  With recording
+switched off, every metric is a NullMetric and recording does nothing.
+"""
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500, 1000)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join('{}="{}"'.format(k, v) for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """
+    A value that only goes up, per combination of label values.
+    """
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.series = {}  # label values -> value
+
+    def inc(self, *label_values, amount=1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self.series.get(label_values, 0)
+
+    def samples(self):
+        for label_values, value in list(self.series.items()):
+            yield self.name, format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    """
+    Counts of observations by bucket (upper bounds, inclusive), with their sum and largest value, per combination of
+    label values.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # label values -> [count per bucket (the last for +Inf), sum, max]
+
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, value]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        if value > series[2]:
+            series[2] = value
+
+    def count(self, *label_values):
+        series = self.series.get(label_values)
+        return sum(series[0]) if series else 0
+
+    def sum(self, *label_values):
+        series = self.series.get(label_values)
+        return series[1] if series else 0.0
+
+    def max(self, *label_values):
+        series = self.series.get(label_values)
+        return series[2] if series else 0.0
+
+    def samples(self):
+        for label_values, (counts, total, _) in list(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), list(counts)):
+                cumulative += count
+                yield self.name + '_bucket', format_labels(self.labels, label_values,
+                                                           [('le', format_value(bound))]), cumulative
+            yield self.name + '_sum', format_labels(self.labels, label_values), total
+            # Derived from the buckets, so _count always equals the +Inf bucket
+            yield self.name + '_count', format_labels(self.labels, label_values), cumulative
+
+
+class Gauge:
+    """
+    A value read when rendered, from a function returning a number, a {label values: number} dictionary, or None when
+    there is nothing to report.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.function = function
+
+    def samples(self):
+        value = self.function()
+        if value is None:
+            return
+        series = value if isinstance(value, dict) else {(): value}
+        for label_values, value in series.items():
+            yield self.name, format_labels(self.labels, label_values), value
+
+
+class NullMetric:
+    """
+    Stands in for every metric while recording is switched off.
+    """
+    def inc(self, *label_values, amount=1):
+        pass
+
+    def observe(self, value, *label_values):
+        pass
+
+    def value(self, *label_values):
+        return 0
+
+    def count(self, *label_values):
+        return 0
+
+    def sum(self, *label_values):
+        return 0.0
+
+    def max(self, *label_values):
+        return 0.0
+
+
+null_metric = NullMetric()
+
+
+class Metrics:
+    """
+    The set of metrics of one scheduler.  Asking for a metric that already exists returns it.
+    """
+    def __init__(self, enabled=True):
+        """
+        Initialize object.
+        :param bool enabled: If false, metrics record nothing and render() returns an empty exposition
+        """
+        self.enabled = enabled
+        self.metrics = {}  # name -> metric, in registration order
+
+    def register(self, metric_type, name, *args, **kwargs):
+        if not self.enabled:
+            return null_metric
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = metric_type(name, *args, **kwargs)
+        elif not isinstance(metric, metric_type):
+            raise Exception('Metric {} is already registered as a {}'.format(name, metric.kind))
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter, name, documentation, labels=labels)
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS, labels=()):
+        return self.register(Histogram, name, documentation, buckets=buckets, labels=labels)
+
+    def gauge(self, name, documentation, function, labels=()):
+        """
+        Register a gauge, replacing any earlier gauge of the same name, since the function is bound to its owner.
+        """
+        if not self.enabled:
+            return null_metric
+        self.metrics.pop(name, None)
+        return self.register(Gauge, name, documentation, function, labels=labels)
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text format.
+        """
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                samples = list(metric.samples())
+            except Exception:
+                logger.exception('Could not read metric: %s', metric.name)
+                continue
+            lines.append('# HELP {} {}'.format(metric.name, metric.documentation.replace('\\', '\\\\')))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            lines.extend('{}{} {}'.format(name, labels, format_value(value)) for name, labels, value in samples)
+        return '\n'.join(lines) + '\n' if lines else ''
+
+
+class MetricsServer:
+    """
+    Serves Metrics.render() at /metrics over HTTP, from a background thread.
+    """
+    def __init__(self, metrics, host='localhost', port=0):
+        """
+        Initialize object.
+        :param Metrics metrics: The metrics to serve
+        :param str host: Address to listen on
+        :param int port: Port to listen on (0 to pick a free one)
+        """
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        """
+        Start listening.
+        :return: The port listened on
+        """
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug('Metrics request: ' + format, *args)
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name='MetricsServer', daemon=True)
+        self.thread.start()
+        logger.info('Serving metrics on http://%s:%s/metrics', self.host, self.port)
+        return self.port
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
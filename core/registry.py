@@ -1,43 +1,148 @@
 import os
+import pickle
+import hashlib
 import logging
 import xml.etree.ElementTree as ET
 
 from core.routine import Routine
+from core.trigger_cache import TriggerCache
 
 
 logger = logging.getLogger(__name__)
 
 
+# Bump whenever Routine or Schedule change in a way that makes existing registry snapshots unusable
+snapshot_version = 4
+
+
 class Registry:
-    def __init__(self, xml_source):
+    def __init__(self, xml_source, snapshot_directory=None):
         """
         Parse a registry xml file describing the desired Routines and their dependencies.
         Create all the Routine objects and store into a dictionary.
 
+        If a snapshot directory is given, the loaded routines are also saved there, keyed by a hash of the xml content,
+        and later loads of identical xml restore the snapshot instead of parsing.
+
         Args:
             xml_source (str): File path to xml based registry file
+            snapshot_directory (str): Directory for compiled registry snapshots (optional)
         """
         if not os.path.isfile(xml_source):
             raise Exception('Could not find registry xml: {}'.format(xml_source))
 
         self.routines = {}
+        self.trigger_cache = TriggerCache()
         logger.info('Loading Registry File: %s', xml_source)
-        root = ET.parse(xml_source).getroot()
 
-        # Create Routines
-        for definition in root:
-            logger.debug('Loading Routine: %s', definition.attrib.get('name'))
-            self.add_routine(Routine(**definition.attrib))
+        snapshot_path = None
+        if snapshot_directory:
+            with open(xml_source, 'rb') as xml_file:
+                digest = hashlib.sha256(xml_file.read()).hexdigest()
+            snapshot_path = os.path.join(snapshot_directory, 'registry_{}_{}.pickle'.format(snapshot_version, digest))
+            if self.load_snapshot(snapshot_path):
+                logger.info('Loading Registry File: Restored from snapshot %s', snapshot_path)
+                return
+
+        edges = self.parse(xml_source)
+        self.validate(edges)
+        for predecessor, successor in edges:
+            logger.debug('Creating dependency: %s depends on %s', successor, predecessor)
+            self.add_dependency(predecessor, successor)
+
+        if snapshot_path:
+            self.save_snapshot(snapshot_path, edges)
+        logger.info('Loading Registry File: Finished')
 
-        # Add Routine dependencies
-        for definition in root:
-            successor = definition.attrib.get('name')
-            for dependency in definition.iter('dependency'):
-                predecessor = dependency.attrib.get('name')
-                logger.debug('Creating dependency: %s depends on %s', successor, predecessor)
-                self.add_dependency(predecessor, successor)
+    def parse(self, xml_source):
+        """
+        Stream the registry xml, creating each Routine as its definition is read and discarding the parsed elements
+        as it goes.
 
-        logger.info('Loading Registry File: Finished')
+        Args:
+            xml_source (str): File path to xml based registry file
+
+        Returns: list of (predecessor name, successor name) dependencies
+        """
+        edges = []
+        for _, element in ET.iterparse(xml_source):
+            if element.tag != 'job':
+                continue
+            logger.debug('Loading Routine: %s', element.attrib.get('name'))
+            self.add_routine(Routine(**element.attrib))
+            successor = element.attrib.get('name')
+            for dependency in element.iter('dependency'):
+                edges.append((dependency.attrib.get('name'), successor))
+            element.clear()
+        return edges
+
+    def validate(self, edges):
+        """
+        Check that every dependency names a known routine and that there are no dependency cycles (Kahn's algorithm:
+        routines left over once every routine without remaining dependencies has been removed are part of a cycle).
+
+        Args:
+            edges (list): (predecessor name, successor name) dependencies
+        """
+        in_degree = dict.fromkeys(self.routines, 0)
+        dependants = {}
+        for predecessor, successor in edges:
+            if predecessor not in self.routines:
+                raise Exception('Unknown dependency: {} depends on {}, which is not in the registry.'.format(
+                    successor, predecessor))
+            in_degree[successor] += 1
+            dependants.setdefault(predecessor, []).append(successor)
+
+        ready = [name for name, degree in in_degree.items() if degree == 0]
+        while ready:
+            for successor in dependants.get(ready.pop(), ()):
+                in_degree[successor] -= 1
+                if in_degree[successor] == 0:
+                    ready.append(successor)
+        cyclic = sorted(name for name, degree in in_degree.items() if degree > 0)
+        if cyclic:
+            raise Exception('Dependency cycle between routines: {}'.format(', '.join(cyclic)))
+
+    def load_snapshot(self, snapshot_path):
+        """
+        Restore the routines from a snapshot.
+
+        Args:
+            snapshot_path (str): Snapshot file path
+
+        Returns: True if the snapshot was restored
+        """
+        try:
+            with open(snapshot_path, 'rb') as snapshot_file:
+                routines, edges = pickle.load(snapshot_file)
+        except FileNotFoundError:
+            return False
+        except Exception:
+            logger.warning('Ignoring unreadable registry snapshot: %s', snapshot_path)
+            return False
+        for routine in routines:
+            self.add_routine(routine)
+        for predecessor, successor in edges:
+            self.add_dependency(predecessor, successor)
+        return True
+
+    def save_snapshot(self, snapshot_path, edges):
+        """
+        Save the routines and dependencies to a snapshot.  Written to a temporary file first, so readers never see
+        partial data.
+
+        Args:
+            snapshot_path (str): Snapshot file path
+            edges (list): (predecessor name, successor name) dependencies
+        """
+        temporary_file = '{}.{}'.format(snapshot_path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+            with open(temporary_file, 'wb') as snapshot_file:
+                pickle.dump((list(self.routines.values()), edges), snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_file, snapshot_path)
+        except OSError:
+            logger.warning('Could not write registry snapshot: %s', snapshot_path)
 
     def __iter__(self):
         return iter(self.routines.items())
@@ -51,6 +156,43 @@ class Registry:
         """
         return self.routines[routine_name]
 
+    def topological_order(self, names):
+        """
+        Order a set of routines so that every routine comes after the routines it depends on.
+
+        Args:
+            names (iterable): Names of the routines to order
+
+        Returns: list of routine names
+        """
+        in_degree = {name: sum(1 for k in self.routines[name].dependencies if k.name in names) for name in names}
+        ready = sorted((name for name, degree in in_degree.items() if degree == 0), reverse=True)
+        order = []
+        while ready:
+            name = ready.pop()
+            order.append(name)
+            for dependant in self.routines[name].dependants:
+                if dependant.name in in_degree:
+                    in_degree[dependant.name] -= 1
+                    if in_degree[dependant.name] == 0:
+                        ready.append(dependant.name)
+        return order
+
+    def diff(self, other):
+        """
+        Compare this registry with a newer version of it.
+
+        Args:
+            other (Registry): The newer registry
+
+        Returns: (added, removed, changed) lists of routine names
+        """
+        added = [name for name in other.routines if name not in self.routines]
+        removed = [name for name in self.routines if name not in other.routines]
+        changed = [name for name, routine in other.routines.items()
+                   if name in self.routines and routine.definition() != self.routines[name].definition()]
+        return added, removed, changed
+
     def add_routine(self, routine):
         """
         Add a routine object to the registry
@@ -62,6 +204,8 @@ class Registry:
         if self.routines.get(new_routine_name):
             raise Exception('Name conflict: %s already exists in registry.' % new_routine_name)
         self.routines[new_routine_name] = routine
+        routine.trigger_cache = self.trigger_cache
+        self.trigger_cache.clear()
 
     def add_dependency(self, predecessor_name, successor_name):
         """
@@ -0,0 +1,203 @@
+import os
+import glob
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+
+
+logger = logging.getLogger(__name__)
+
+partition_schema = """
+CREATE TABLE IF NOT EXISTS state (
+    routine VARCHAR(250),
+    instance TIMESTAMP,
+    state VARCHAR(250),
+    state_time_stamp TIMESTAMP,
+    UNIQUE (routine, instance, state, state_time_stamp)
+);
+"""
+
+
+class StateArchiver:
+    """
+    Moves the history of Archived tasks older than a retention period out of the hot state database and into monthly
+    partition databases (archive_directory/state_YYYY_MM.db, by task instance), so the hot database stays small.
+
+    Tasks are moved in batches from a background thread with its own connection.  Each batch is copied into its
+    partitions before it is deleted from the hot database, all while holding the database's write lock, and copies are
+    idempotent, so an interrupted batch is simply repeated.  Tasks still in 'current_state' (not Archived) are never
+    moved.  Expired tasks are found through the state_archived_instance index, and a StateManager given the archiver
+    finds their results in the partitions.
+    """
+    def __init__(self, database_path, archive_directory, retention_days, batch_size=1000, interval=3600):
+        """
+        Initialize object.
+        :param str database_path: File path of the hot state database
+        :param str archive_directory: Directory for the monthly partition databases
+        :param float retention_days: Archived tasks whose instance is older than this are moved
+        :param int batch_size: Maximum number of tasks moved per transaction
+        :param float interval: Seconds between background runs once the backlog has been cleared
+        """
+        self.database_path = database_path
+        self.archive_directory = archive_directory
+        self.retention = timedelta(days=retention_days)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = None
+        if not os.path.exists(self.archive_directory):
+            os.makedirs(self.archive_directory)
+
+    def partition_path(self, instance):
+        """Returns the partition database path for a task instance"""
+        return os.path.join(self.archive_directory, 'state_{}.db'.format(instance.strftime('%Y_%m')))
+
+    def partitions(self, start=None, end=None):
+        """
+        Returns the partition database paths, optionally only those whose month overlaps [start, end].
+        """
+        paths = sorted(glob.glob(os.path.join(self.archive_directory, 'state_????_??.db')))
+        if start is not None:
+            paths = [k for k in paths if k >= self.partition_path(start)]
+        if end is not None:
+            paths = [k for k in paths if k <= self.partition_path(end)]
+        return paths
+
+    def archive_batch(self, now=None):
+        """
+        Move one batch of expired Archived tasks into the partitions.  The batch is read, copied and deleted inside
+        one immediate transaction, so no task can be re-created (by an execute or a backfill of an old instance)
+        between the copy and the delete and lose its new rows.
+        :param datetime now: Reference time for the retention period (default: now)
+        :return: Number of tasks moved
+        """
+        cutoff = (now or datetime.today()) - self.retention
+        database = sqlite3.connect(self.database_path, detect_types=sqlite3.PARSE_DECLTYPES, timeout=30,
+                                   isolation_level=None)
+        try:
+            database.execute('BEGIN IMMEDIATE')
+            try:
+                tasks = database.execute("""
+                    SELECT DISTINCT routine, instance FROM state s
+                    WHERE instance < ?
+                    AND state = 'Archived'
+                    AND NOT EXISTS (
+                        SELECT 1 FROM current_state c WHERE c.routine = s.routine AND c.instance = s.instance
+                    )
+                    LIMIT ?
+                    """, (cutoff, self.batch_size)).fetchall()
+                if tasks:
+                    # Copy the full history of each task into the partition for its month, then remove it
+                    by_partition = {}
+                    for routine, instance in tasks:
+                        rows = database.execute('SELECT * FROM state WHERE routine = ? AND instance = ?',
+                                                (routine, instance))
+                        by_partition.setdefault(self.partition_path(instance), []).extend(rows)
+                    self.copy_to_partitions(by_partition)
+                    database.executemany('DELETE FROM state WHERE routine = ? AND instance = ?', tasks)
+                database.execute('COMMIT')
+            except BaseException:
+                database.execute('ROLLBACK')
+                raise
+            if not tasks:
+                return 0
+            database.execute('PRAGMA incremental_vacuum')
+            logger.info('Archived history of %s tasks older than %s', len(tasks), cutoff)
+            return len(tasks)
+        finally:
+            database.close()
+
+    def copy_to_partitions(self, by_partition):
+        """
+        Insert rows into partition databases, skipping any already there.
+        :param dict by_partition: partition database path -> list of state rows
+        """
+        for path, rows in by_partition.items():
+            partition = sqlite3.connect(path)
+            try:
+                with partition as conn:
+                    conn.executescript(partition_schema)
+                    conn.executemany('INSERT OR IGNORE INTO state VALUES (?, ?, ?, ?)', rows)
+            finally:
+                partition.close()
+
+    def run(self):
+        """
+        Background loop: clear the backlog one batch at a time, then wait for the next interval.
+        """
+        while not self.stopping.is_set():
+            try:
+                moved = self.archive_batch()
+            except sqlite3.Error:
+                logger.exception('State history archiving failed')
+                moved = 0
+            if moved < self.batch_size:
+                self.stopping.wait(self.interval)
+
+    def start(self):
+        logger.info('Starting state history archiver: %s', self.archive_directory)
+        self.thread = threading.Thread(target=self.run, name='StateArchiver', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def last_result(self, routine, instance):
+        """
+        Returns the latest non-Archived state of an archived task, so tasks depending on it still see its result.
+        :param str routine: The routine name
+        :param datetime instance: The task instance
+        :return: str state, or None if the task is not in the archive
+        """
+        path = self.partition_path(instance)
+        if not os.path.exists(path):
+            return None
+        database = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, timeout=30)
+        try:
+            row = database.execute("""
+                SELECT state FROM state
+                WHERE routine = ?
+                AND instance = ?
+                AND state != 'Archived'
+                ORDER BY state_time_stamp DESC
+                LIMIT 1
+                """, (routine, instance)).fetchone()
+        finally:
+            database.close()
+        return row[0] if row is not None else None
+
+    def task_history(self, routine, instance):
+        """
+        Returns every recorded state transition of a task, whether it is still in the hot database or archived.
+        :param str routine: The routine name
+        :param datetime instance: The task instance
+        :return: list of (routine, instance, state, state_time_stamp) tuples ordered by state_time_stamp
+        """
+        return self.query_history(routine, instance, instance)
+
+    def query_history(self, routine=None, start=None, end=None):
+        """
+        Returns state transitions across the hot database and the archive, for tasks with instance in [start, end].
+        :param str routine: Only this routine (optional)
+        :param datetime start: Earliest task instance (optional)
+        :param datetime end: Latest task instance (optional)
+        :return: list of (routine, instance, state, state_time_stamp) tuples ordered by instance and state_time_stamp
+        """
+        conditions, parameters = [], []
+        for condition, value in [('routine = ?', routine), ('instance >= ?', start), ('instance <= ?', end)]:
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        query = 'SELECT * FROM state' + (' WHERE ' + ' AND '.join(conditions) if conditions else '')
+
+        rows = set()
+        for path in self.partitions(start, end) + [self.database_path]:
+            database = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, timeout=30)
+            try:
+                rows.update(database.execute(query, parameters))
+            finally:
+                database.close()
+        return sorted(rows, key=lambda row: (row[1], row[3]))
@@ -1,4 +1,5 @@
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timedelta
 
 import config
 from core.schedule import Schedule
@@ -6,18 +7,52 @@ from core.task import Task, qualified_task_name
 
 
 class Routine:
-    def __init__(self, name, script=None, schedule=None):
+    def __init__(self, name, script=None, schedule=None, max_running=None, entry_point=None, catchup='all',
+                 timeout=None, duration=None):
         """
         Args:
             name (str): Name of the routine
             script (str): Path of script to be run by the routine
             schedule (str): a cron-like string
+            max_running (int): Maximum number of instances of this routine allowed to run at once (optional)
+            entry_point (str): 'package.module:function' to call instead of running a script (optional)
+            catchup (str): Runs missed while the scheduler was down to make up on resume: 'all', 'latest' or 'none'
+            timeout (float): Seconds a task may run before it is killed and recorded as a Failure (optional)
+            duration (float): Expected run time in seconds, used by simulations (optional)
         """
+        if catchup not in ['all', 'latest', 'none']:
+            raise ValueError('Unknown catchup policy for {}: {}'.format(name, catchup))
         self.dependants = set()  # routines that depend on this routine
         self.dependencies = set()  # routines that this routine depends on
         self.name = name
         self.script = script
+        self.entry_point = entry_point
         self.schedule = Schedule(schedule) if schedule else schedule
+        self.max_running = int(max_running) if max_running else None
+        self.catchup = catchup
+        self.timeout = float(timeout) if timeout else None
+        self.duration = float(duration) if duration else None
+        self.trigger_cache = None  # shared TriggerCache, assigned when added to a Registry
+
+    def __getstate__(self):
+        # Links to other routines are left out (the registry restores them) so that pickling a long dependency chain
+        # does not recurse through every routine in it
+        state = self.__dict__.copy()
+        state.update(dependants=set(), dependencies=set(), trigger_cache=None)
+        return state
+
+    def definition(self):
+        """
+        Returns everything that defines this routine (its attributes, schedule and the names of its dependencies), for
+        telling whether a routine changed between two loads of the registry.
+
+        Returns: dict
+        """
+        definition = {k: v for k, v in self.__dict__.items()
+                      if k not in ['dependants', 'dependencies', 'trigger_cache', 'schedule']}
+        definition['schedule'] = self.schedule.cron_string if self.schedule else None
+        definition['dependencies'] = sorted(k.name for k in self.dependencies)
+        return definition
 
     def next_trigger(self, reference_point, inclusive=False):
         """
@@ -34,7 +69,7 @@ class Routine:
             return self.schedule.next(reference_point, inclusive)
         # If the task has no schedule, but simply runs after its dependencies, then use their last next runtime
         elif self.dependencies:
-            return max([k.next_trigger(reference_point, inclusive) for k in self.dependencies])
+            return self.dependency_trigger('next', reference_point, inclusive)
         # Otherwise, this is really only manually triggered
         else:
             return datetime(9999, 12, 31)
@@ -54,11 +89,63 @@ class Routine:
             return self.schedule.previous(reference_point, inclusive)
         # If the task has no schedule, but simply runs after its dependencies, then use their last previous runtime
         elif self.dependencies:
-            return max([k.previous_trigger(reference_point, inclusive) for k in self.dependencies])
+            return self.dependency_trigger('previous', reference_point, inclusive)
         # Otherwise, this is really only manually triggered
         else:
             return datetime(9999, 12, 31)
 
+    def dependency_trigger(self, direction, reference_point, inclusive):
+        """
+        Return the latest next or previous trigger across all dependencies, memoized in the shared trigger cache.
+
+        Args:
+            direction (str): 'next' or 'previous'
+            reference_point (datetime): The reference datetime
+            inclusive (bool): if True, include the reference_point as a valid trigger
+
+        Returns: datetime
+        """
+        key = (self.name, direction, reference_point, inclusive)
+        if self.trigger_cache is not None:
+            trigger = self.trigger_cache.get(key)
+            if trigger is not None:
+                return trigger
+        if direction == 'next':
+            trigger = max([k.next_trigger(reference_point, inclusive) for k in self.dependencies])
+        else:
+            trigger = max([k.previous_trigger(reference_point, inclusive) for k in self.dependencies])
+        if self.trigger_cache is not None:
+            self.trigger_cache.put(key, trigger)
+        return trigger
+
+    def missed_triggers(self, start, end, limit=None):
+        """
+        Return the trigger times after start and up to and including end, e.g. the runs missed while the scheduler was
+        down.
+
+        Args:
+            start (datetime): Start of the window (exclusive)
+            end (datetime): End of the window (inclusive)
+            limit (int): Only return the latest limit triggers (optional)
+
+        Returns: list of datetime
+        """
+        epsilon = timedelta(microseconds=1)
+        if self.schedule:
+            triggers = self.schedule.occurrences(start + epsilon, end + epsilon)
+            if limit:
+                triggers = triggers[-limit:]
+            return triggers.astype('datetime64[us]').tolist()
+        elif self.dependencies:
+            triggers = deque(maxlen=limit)
+            trigger = self.next_trigger(start)
+            while trigger <= end:
+                triggers.append(trigger)
+                trigger = self.next_trigger(trigger)
+            return list(triggers)
+        else:
+            return []
+
     def depends_on(self, other):
         """
         Register a dependency between routines
@@ -68,6 +155,8 @@ class Routine:
         """
         self.dependencies.add(other)
         other.dependants.add(self)
+        if self.trigger_cache is not None:
+            self.trigger_cache.clear()
 
     def next_task(self, reference_point, queue=None):
         """
@@ -79,10 +168,21 @@ class Routine:
 
         Returns: Task
         """
-        time = self.next_trigger(reference_point)
+        return self.task_at(self.next_trigger(reference_point), queue)
+
+    def task_at(self, time, queue=None):
+        """
+        Returns a task object representing the instance at a given trigger time
+
+        Args:
+            time (datetime): The task time
+            queue (Queue): The queue the task should provide updates through
+
+        Returns: Task
+        """
         dependencies = {}
         for dep in self.dependencies:
             dep_time = dep.previous_trigger(time, inclusive=True)
             dependencies[qualified_task_name(dep.name, dep_time)] = None
-        return Task(self.name, self.script, time, dependencies, queue=queue)
+        return Task(self.name, self.script, time, dependencies, queue=queue, entry_point=self.entry_point)
 
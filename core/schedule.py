@@ -1,24 +1,257 @@
+import calendar
 import datetime
+import functools
+
+import numpy as np
+
+
+# Cron fields in order: (label, lowest value, highest value, names accepted in place of numbers)
+# Weekdays follow the python convention (datetime.weekday) where Monday is 0 and Sunday is 6.
+FIELDS = (
+    ('minute', 0, 59, {}),
+    ('hour', 0, 23, {}),
+    ('day', 1, 31, {}),
+    ('month', 1, 12, {name.lower(): i for i, name in enumerate(calendar.month_abbr) if name}),
+    ('weekday', 0, 6, {name.lower(): i for i, name in enumerate(calendar.day_abbr)}),
+)
+
+# Give up searching for a matching moment after this many years
+SEARCH_LIMIT_YEARS = 400
+
+# Default number of days materialized at a time by Schedule.iter_occurrences
+CHUNK_DAYS = 31
+
+
+def parse_field(text, low, high, names=None):
+    """
+    Parse a single cron field into a bitset of allowed values (bit n set means value n is allowed).
+    Supports '*', single values, ranges (a-b), lists (a,b,c), steps (*/n, a-b/n, a/n) and names (jan, mon).
+    :param str text: The cron field text
+    :param int low: Lowest valid value for the field
+    :param int high: Highest valid value for the field
+    :param dict names: Optional mapping of lower case names to values
+    :return: int
+    """
+    names = names or {}
+
+    def to_value(token):
+        token = token.lower()
+        value = names[token] if token in names else int(token)
+        if not low <= value <= high:
+            raise ValueError('Cron value {} out of range [{}, {}]'.format(token, low, high))
+        return value
+
+    mask = 0
+    for item in text.split(','):
+        base, _, step = item.partition('/')
+        step = int(step) if step else 1
+        if step < 1:
+            raise ValueError('Invalid cron step: {}'.format(item))
+        if base == '*':
+            start, end = low, high
+        elif '-' in base:
+            start, end = [to_value(k) for k in base.split('-', 1)]
+            if start > end:
+                raise ValueError('Invalid cron range: {}'.format(item))
+        else:
+            start = to_value(base)
+            end = high if '/' in item else start
+        for value in range(start, end + 1, step):
+            mask |= 1 << value
+    return mask
+
+
+def next_bit(mask, value):
+    """Returns the smallest set bit position in mask that is >= value, or None"""
+    if value < 0:
+        value = 0
+    remaining = mask >> value
+    if not remaining:
+        return None
+    return value + (remaining & -remaining).bit_length() - 1
+
+
+def previous_bit(mask, value):
+    """Returns the largest set bit position in mask that is <= value, or None"""
+    if value < 0:
+        return None
+    remaining = mask & ((2 << value) - 1)
+    if not remaining:
+        return None
+    return remaining.bit_length() - 1
+
+
+def ceil_minute(moment):
+    """Returns the first whole minute at or after moment as a numpy datetime64[m]"""
+    moment = np.datetime64(moment, 'us')
+    minute = moment.astype('datetime64[m]')
+    return minute if minute == moment else minute + 1
+
+
+def mask_table(mask, size):
+    """Expands a bitset into a boolean lookup array indexed by value"""
+    return np.array([mask >> value & 1 for value in range(size)], dtype=bool)
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_fields(texts):
+    """
+    Parse the fields of a cron string.  Large registries repeat the same few schedules many times, so results are
+    cached.
+    :param tuple texts: The five field strings
+    :return: tuple of (field label, bitmask of allowed values)
+    """
+    specs = tuple((label, parse_field(text, low, high, names))
+                  for (label, low, high, names), text in zip(FIELDS, texts))
+
+    # Reject schedules that can never fire (e.g. 31st of February), otherwise searches would never end.
+    months, days = specs[3][1], specs[2][1]
+    if not any(days & ((2 << calendar.monthrange(2000, month)[1]) - 1)
+               for month in range(1, 13) if months >> month & 1):
+        raise ValueError('Cron string never matches a valid date: {}'.format(' '.join(texts)))
+    return specs
+
+
+@functools.lru_cache(maxsize=None)
+def weekday_day_masks(weekday_mask):
+    """
+    For each weekday of the 1st of a month, the bitmask of days of month whose weekday is allowed.  There are only 128
+    weekday masks, so these are computed once and shared between schedules.
+    :param int weekday_mask: Bitmask of allowed weekdays (Monday = bit 0)
+    :return: tuple of 7 ints
+    """
+    masks = []
+    for first_weekday in range(7):
+        mask = 0
+        for day in range(1, 32):
+            if weekday_mask >> ((first_weekday + day - 1) % 7) & 1:
+                mask |= 1 << day
+        masks.append(mask)
+    return tuple(masks)
+
 
 class Schedule:
     """
     Object representing a series of moments as defined by standard cron text
     * * * * * = > [minute] [hour] [day of month] [month] [day of week]
+
+    The cron string is compiled once into a bitset of allowed values per field.  Finding the next or previous moment
+    then jumps field by field (month, day, hour, minute) rather than stepping through time, so the cost of a call is
+    bounded regardless of how sparse the schedule is.  Day of month and day of week restrictions must both hold.
     """
     def __init__(self, cron_string):
         """
         Initialize object.
         :param str cron_string: a cron like string
         """
-        input_list = [int(k) if k != '*' else k for k in cron_string.split(' ')]
-        label_list = ['minute', 'hour', 'day', 'month', 'weekday']
+        input_list = cron_string.split()
+        if len(input_list) != len(FIELDS):
+            raise ValueError('Cron string must have {} fields: {}'.format(len(FIELDS), cron_string))
+
+        self.cron_string = cron_string
+        self.specs = dict(parse_fields(tuple(input_list)))
+        self.tables = None
+        self.weekday_day_masks = weekday_day_masks(self.specs['weekday'])
+
+    def __repr__(self):
+        return 'Schedule({!r})'.format(self.cron_string)
+
+    def allowed_days(self, year, month):
+        """
+        Returns a bitset of the days in the given month satisfying both the day of month and day of week fields.
+        :param int year: Year
+        :param int month: Month
+        :return: int
+        """
+        first_weekday, days_in_month = calendar.monthrange(year, month)
+        return self.specs['day'] & self.weekday_day_masks[first_weekday] & ((2 << days_in_month) - 1)
 
-        self.specs = dict(zip(label_list, input_list))
-        assert(self.specs['minute'] == '*' or 0 <= self.specs['minute'] <= 59)
-        assert(self.specs['hour'] == '*' or 0 <= self.specs['hour'] <= 23)
-        assert(self.specs['day'] == '*' or 1 <= self.specs['day'] <= 31)
-        assert(self.specs['month'] == '*' or 1 <= self.specs['month'] <= 12)
-        assert(self.specs['weekday'] == '*' or 0 <= self.specs['weekday'] <= 6)
+    def field_tables(self):
+        """
+        Returns the lookup arrays used for vectorized evaluation, building them on first use.
+        :return: (month table, day table, weekday table, minute of day offsets)
+        """
+        if self.tables is None:
+            hours = [k for k in range(24) if self.specs['hour'] >> k & 1]
+            minutes = [k for k in range(60) if self.specs['minute'] >> k & 1]
+            offsets = np.array([60 * h + m for h in hours for m in minutes], dtype=np.int64)
+            self.tables = (mask_table(self.specs['month'], 13), mask_table(self.specs['day'], 32),
+                           mask_table(self.specs['weekday'], 7), offsets)
+        return self.tables
+
+    def matching_days(self, start, end):
+        """
+        Returns the days in [start, end) satisfying the month, day of month and day of week fields.
+        :param numpy.datetime64 start: First day (datetime64[D])
+        :param numpy.datetime64 end: Day after the last day (datetime64[D])
+        :return: numpy array of datetime64[D]
+        """
+        month_table, day_table, weekday_table, _ = self.field_tables()
+        days = np.arange(start, end, dtype='datetime64[D]')
+        month_start = days.astype('datetime64[M]')
+        months = month_start.astype(np.int64) % 12 + 1
+        month_days = (days - month_start.astype('datetime64[D]')).astype(np.int64) + 1
+        # 1970-01-01 was a Thursday, which is weekday 3 when Monday is 0
+        weekdays = (days.astype(np.int64) + 3) % 7
+        return days[month_table[months] & day_table[month_days] & weekday_table[weekdays]]
+
+    def occurrences(self, start, end):
+        """
+        Returns every moment in [start, end) matching the schedule.  The series is built from day and minute of day
+        masks, so the cost grows with the number of matching moments rather than the number of minutes in the window.
+        :param datetime start: Start of the window (inclusive)
+        :param datetime end: End of the window (exclusive)
+        :return: sorted numpy array of datetime64[m]
+        """
+        start, end = ceil_minute(start), ceil_minute(end)
+        if end <= start:
+            return np.array([], dtype='datetime64[m]')
+        offsets = self.field_tables()[3]
+        first_day = start.astype('datetime64[D]')
+        last_day = (end - 1).astype('datetime64[D]')
+        days = self.matching_days(first_day, last_day + 1)
+        moments = (days.astype('datetime64[m]')[:, None] + offsets[None, :]).ravel()
+        # Only the first and last day can contain moments outside the window
+        return moments[np.searchsorted(moments, start):np.searchsorted(moments, end)]
+
+    def iter_occurrences(self, start, end, chunk_days=CHUNK_DAYS):
+        """
+        Yields the moments in [start, end) matching the schedule as a series of arrays, each covering at most
+        chunk_days days, so that long windows never have to be materialized at once.
+        :param datetime start: Start of the window (inclusive)
+        :param datetime end: End of the window (exclusive)
+        :param int chunk_days: Number of days covered by each chunk
+        :return: generator of numpy arrays of datetime64[m]
+        """
+        chunk_start, end = ceil_minute(start), ceil_minute(end)
+        step = np.timedelta64(chunk_days, 'D')
+        while chunk_start < end:
+            chunk_end = min(chunk_start.astype('datetime64[D]') + step, end)
+            chunk = self.occurrences(chunk_start, chunk_end)
+            if len(chunk):
+                yield chunk
+            chunk_start = chunk_end
+
+    def count_between(self, start, end):
+        """
+        Returns the number of moments in [start, end) matching the schedule without building the series.
+        :param datetime start: Start of the window (inclusive)
+        :param datetime end: End of the window (exclusive)
+        :return: int
+        """
+        start, end = ceil_minute(start), ceil_minute(end)
+        if end <= start:
+            return 0
+        offsets = self.field_tables()[3]
+        first_day = start.astype('datetime64[D]')
+        last_day = (end - 1).astype('datetime64[D]')
+        days = self.matching_days(first_day, last_day + 1)
+        count = len(days) * len(offsets)
+        if len(days) and days[0] == first_day:
+            count -= np.searchsorted(offsets, (start - first_day).astype(np.int64))
+        if len(days) and days[-1] == last_day:
+            count -= len(offsets) - np.searchsorted(offsets, (end - last_day).astype(np.int64))
+        return int(count)
 
     def next(self, reference=None, inclusive=False):
         """
@@ -30,24 +263,38 @@ class Schedule:
         if reference is None:
             reference = datetime.datetime.today()
 
-        next = reference.replace(second=0, microsecond=0)
+        start = reference.replace(second=0, microsecond=0)
         if not inclusive:
-            next = next + datetime.timedelta(minutes=1)
-        while True:
-            if (self.specs['month'] != '*' and next.month != self.specs['month']):
-                next_year = next.year if next.month != 12 else next.year + 1
-                next_month = next.month + 1 if next.month != 12 else 1
-                next = next.replace(year=next_year, month=next_month, day=1, hour=0, minute=0)
-            elif (self.specs['day'] != '*' and next.day != self.specs['day']):
-                next = next.replace(hour=0, minute=0) + datetime.timedelta(days=1)
-            elif (self.specs['weekday'] != '*' and next.weekday() != self.specs['weekday']):
-                next = next.replace(hour=0, minute=0) + datetime.timedelta(days=1)
-            elif (self.specs['hour'] != '*' and next.hour != self.specs['hour']):
-                next = next.replace(minute=0) + datetime.timedelta(hours=1)
-            elif (self.specs['minute'] != '*' and next.minute != self.specs['minute']):
-                next = next + datetime.timedelta(minutes=1)
-            else:
-                return next
+            start = start + datetime.timedelta(minutes=1)
+        year, month, day, hour, minute = start.year, start.month, start.day, start.hour, start.minute
+        while year <= start.year + SEARCH_LIMIT_YEARS:
+            next_month = next_bit(self.specs['month'], month)
+            if next_month is None:
+                year, month, day, hour, minute = year + 1, 1, 1, 0, 0
+                continue
+            if next_month != month:
+                month, day, hour, minute = next_month, 1, 0, 0
+
+            next_day = next_bit(self.allowed_days(year, month), day)
+            if next_day is None:
+                month, day, hour, minute = month + 1, 1, 0, 0
+                continue
+            if next_day != day:
+                day, hour, minute = next_day, 0, 0
+
+            next_hour = next_bit(self.specs['hour'], hour)
+            if next_hour is None:
+                day, hour, minute = day + 1, 0, 0
+                continue
+            if next_hour != hour:
+                hour, minute = next_hour, 0
+
+            next_minute = next_bit(self.specs['minute'], minute)
+            if next_minute is None:
+                hour, minute = hour + 1, 0
+                continue
+            return datetime.datetime(year, month, day, hour, next_minute)
+        raise ValueError('No moment matching {} found after {}'.format(self.cron_string, reference))
 
     def previous(self, reference=None, inclusive=False):
         """
@@ -59,19 +306,35 @@ class Schedule:
         if reference is None:
             reference = datetime.datetime.today()
 
-        previous = reference.replace(second=0, microsecond=0)
+        start = reference.replace(second=0, microsecond=0)
         if not inclusive:
-            previous = previous - datetime.timedelta(minutes=1)
-        while True:
-            if (self.specs['month'] != '*' and previous.month != self.specs['month']):
-                previous = previous.replace(day=1, hour=23, minute=59) - datetime.timedelta(days=1)
-            elif (self.specs['day'] != '*' and previous.day != self.specs['day']):
-                previous = previous.replace(hour=23, minute=59) - datetime.timedelta(days=1)
-            elif (self.specs['weekday'] != '*' and previous.weekday() != self.specs['weekday']):
-                previous = previous.replace(hour=23, minute=59) - datetime.timedelta(days=1)
-            elif (self.specs['hour'] != '*' and previous.hour != self.specs['hour']):
-                previous = previous.replace(minute=59) - datetime.timedelta(hours=1)
-            elif (self.specs['minute'] != '*' and previous.minute != self.specs['minute']):
-                previous = previous - datetime.timedelta(minutes=1)
-            else:
-                return previous
+            start = start - datetime.timedelta(minutes=1)
+        year, month, day, hour, minute = start.year, start.month, start.day, start.hour, start.minute
+        while year >= start.year - SEARCH_LIMIT_YEARS:
+            previous_month = previous_bit(self.specs['month'], month)
+            if previous_month is None:
+                year, month, day, hour, minute = year - 1, 12, 31, 23, 59
+                continue
+            if previous_month != month:
+                month, day, hour, minute = previous_month, 31, 23, 59
+
+            previous_day = previous_bit(self.allowed_days(year, month), day)
+            if previous_day is None:
+                month, day, hour, minute = month - 1, 31, 23, 59
+                continue
+            if previous_day != day:
+                day, hour, minute = previous_day, 23, 59
+
+            previous_hour = previous_bit(self.specs['hour'], hour)
+            if previous_hour is None:
+                day, hour, minute = day - 1, 23, 59
+                continue
+            if previous_hour != hour:
+                hour, minute = previous_hour, 59
+
+            previous_minute = previous_bit(self.specs['minute'], minute)
+            if previous_minute is None:
+                hour, minute = hour - 1, 59
+                continue
+            return datetime.datetime(year, month, day, hour, previous_minute)
+        raise ValueError('No moment matching {} found before {}'.format(self.cron_string, reference))
@@ -0,0 +1,119 @@
+import os
+import struct
+import marshal
+import hashlib
+import logging
+import importlib.util
+
+
+logger = logging.getLogger(__name__)
+
+# Header of a cached code file: python bytecode magic number, script modification time (ns) and script size
+header = struct.Struct('<4sQQ')
+
+
+class ScriptCache:
+    """
+    Compiled code objects for task scripts, so a script is parsed and compiled once rather than on every run.  Entries
+    are keyed by script path and validated against the script's modification time and size.  If a cache directory is
+    given, compiled code is also persisted there (marshal format, as in .pyc files) so that new processes can skip
+    compilation too.
+    """
+    def __init__(self, directory=None):
+        """
+        Initialize object.
+        :param str directory: Directory to persist compiled code in (optional)
+        """
+        self.directory = directory
+        self.code = {}  # script path -> (modification time, size, code object)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.directory and not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+    def cache_file(self, path):
+        """Returns the path of the persisted code for a script"""
+        digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, '{}.{}.pyc'.format(digest, importlib.util.MAGIC_NUMBER.hex()))
+
+    def load(self, path):
+        """
+        Returns the compiled code object for a script, compiling it only if it is not cached or has changed.
+        :param str path: Path of the python script
+        :return: code
+        """
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        entry = self.code.get(path)
+        if entry is not None and entry[:2] == key:
+            self.hits += 1
+            return entry[2]
+
+        code = self.read(path, key) if self.directory else None
+        if code is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            with open(path, 'rb') as script:
+                code = compile(script.read(), path, 'exec')
+            if self.directory:
+                self.write(path, key, code)
+        self.code[path] = key + (code,)
+        return code
+
+    def read(self, path, key):
+        """Returns the persisted code for a script if it matches key, otherwise None"""
+        try:
+            with open(self.cache_file(path), 'rb') as cache_file:
+                data = cache_file.read()
+        except OSError:
+            return None
+        if len(data) < header.size or header.unpack_from(data) != (importlib.util.MAGIC_NUMBER,) + key:
+            return None
+        try:
+            return marshal.loads(data[header.size:])
+        except (EOFError, ValueError, TypeError):
+            return None
+
+    def write(self, path, key, code):
+        """Persist compiled code for a script.  Written to a temporary file first, so readers never see partial data"""
+        cache_file = self.cache_file(path)
+        temporary_file = '{}.{}'.format(cache_file, os.getpid())
+        try:
+            with open(temporary_file, 'wb') as output:
+                output.write(header.pack(importlib.util.MAGIC_NUMBER, *key))
+                output.write(marshal.dumps(code))
+            os.replace(temporary_file, cache_file)
+        except OSError:
+            logger.warning('Could not write script cache file: %s', cache_file)
+
+
+script_caches = {}
+
+
+def get_script_cache(directory=None):
+    """
+    Returns the process-wide ScriptCache for a cache directory (None for an in-memory only cache).
+    :param str directory: Directory to persist compiled code in
+    :return: ScriptCache
+    """
+    if directory not in script_caches:
+        script_caches[directory] = ScriptCache(directory)
+    return script_caches[directory]
+
+
+def load_entry_point(entry_point):
+    """
+    Import and return the function named by a 'package.module:function' entry point.  Modules are imported once per
+    process and then reused from sys.modules.
+    :param str entry_point: 'package.module:function' (the function part may be dotted, e.g. 'module:Class.method')
+    :return: callable
+    """
+    module_name, _, attribute = entry_point.partition(':')
+    if not module_name or not attribute:
+        raise ValueError('Entry point must be of the form module:function: {}'.format(entry_point))
+    target = importlib.import_module(module_name)
+    for part in attribute.split('.'):
+        target = getattr(target, part)
+    return target
@@ -1,25 +1,46 @@
 import os
+import time
 import sqlite3
 import logging
+import threading
 from datetime import datetime
+from collections import OrderedDict
 
 import config
 
 
 logger = logging.getLogger(__name__)
 
+# Version of the database layout created by statics/state.sql.  Older databases are migrated on connection.
+schema_version = 2
+
 
 class StateManager:
     """
     Interface for sqlite database which houses the records of all task-level state transitions.
+
+    In write-behind mode, update() only appends to an in-memory buffer.  A writer thread flushes the buffer in a single
+    transaction every flush_interval_ms milliseconds, or as soon as flush_rows rows are waiting.  Reads and close()
+    flush first, so callers always see their own writes.
+
+    The latest non-Archived state of recently seen tasks is kept in a bounded least-recently-used cache, warmed with
+    one query on connection and kept current by update(), so last_result() rarely needs the database.
     """
-    def __init__(self, database_path, clean_start=False):
+    def __init__(self, database_path, clean_start=False, write_behind=False, flush_interval_ms=50, flush_rows=500,
+                 result_cache_size=10000, metrics=None, archive=None):
         """
         Initialize object.
         :param database_path: File path to sqlite database file (existing or desired location)
         :param clean_start: If true, delete all existing records from the database before beginning.
+        :param write_behind: If true, buffer updates and write them from a background thread
+        :param flush_interval_ms: Write-behind only, maximum time an update waits in the buffer
+        :param flush_rows: Write-behind only, number of buffered updates that triggers an immediate flush
+        :param result_cache_size: Maximum number of tasks whose last result is cached (0 to disable the cache)
+        :param metrics: Metrics to record the time taken by updates in (optional)
+        :param archive: StateArchiver holding history moved out of the database, consulted by last_result (optional)
         """
         self.database_path = database_path
+        self.archive = archive
         # If database doesn't exist, create it.
         if not os.path.exists(self.database_path):
             logger.info('Database does not exist, creating: %s', self.database_path)
@@ -27,40 +48,244 @@ class StateManager:
         # Store database connection
         logger.info('Connecting to database: %s', self.database_path)
         self.database = sqlite3.connect(database_path, detect_types=sqlite3.PARSE_DECLTYPES)
+        # WAL journal mode, so that readers (see StateReader) and the writer never block each other
+        self.database.execute('PRAGMA journal_mode=WAL')
+        self.migrate()
+
+        # Last result cache: (routine, instance) -> latest non-Archived state, or None if the task has no record
+        self.result_cache_size = result_cache_size
+        self.results = OrderedDict()
+        self.result_hits = 0
+        self.result_misses = 0
+
+        # Set up write-behind buffering
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_rows = flush_rows
+        self.buffer = []
+        self.write_lock = threading.Lock()  # held while rows are written, so flushes never interleave
+        self.buffer_ready = threading.Condition()
+        self.writer = None
+        self.write_database = self.database  # connection used for writes
+        if self.write_behind:
+            # Writes come from the writer thread (or a flush in the caller's thread) through their own connection
+            self.write_database = sqlite3.connect(database_path, check_same_thread=False)
+            self.write_database.execute('PRAGMA synchronous=NORMAL')
+            self.writer = threading.Thread(target=self.write_loop, name='StateWriter', daemon=True)
+            self.writer.start()
+
         # Delete records from database, if requested
         if clean_start:
             logger.warning('Deleting existing database records.')
             self.delete_all_records()
 
+        self.update_seconds = None
+        if metrics is not None:
+            self.update_seconds = metrics.histogram('scheduler_state_update_seconds',
+                                                    'Seconds spent recording task state transitions',
+                                                    labels=('method',))
+
+        self.warm_result_cache()
+
     def create_database(self):
         """
         Create a new database file having a 'state' table which will be used to record task-level state transitions.
         """
         # Get 'state' table definition and create it
-        setup_file = os.path.join(config.project_path, '../statics', 'state.sql')
+        setup_file = os.path.join(config.project_path, 'statics', 'state.sql')
         with sqlite3.connect(self.database_path) as conn:
             with open(setup_file) as setup_file:
                 conn.executescript(setup_file.read())
 
-    def delete_all_records(self):
+    def migrate(self):
         """
-        Delete all records in the 'state' table.
+        Bring a database created by an older version up to date: add the history index and build the 'current_state'
+        table from the existing history (version 1), then index Archived history by instance (version 2).
         """
+        version = self.database.execute('PRAGMA user_version').fetchone()[0]
+        if version >= schema_version:
+            return
+        logger.info('Migrating database from version %s to %s: %s', version, schema_version, self.database_path)
+        if version < 1:
+            self.migrate_current_state()
+        with self.database as conn:
+            conn.execute('''CREATE INDEX IF NOT EXISTS state_archived_instance
+                            ON state (instance, routine) WHERE state = 'Archived' ''')
+        self.database.execute('PRAGMA user_version = {}'.format(schema_version))
+
+    def migrate_current_state(self):
         with self.database as conn:
-            conn.executescript('DELETE FROM state')
+            conn.execute('''CREATE INDEX IF NOT EXISTS state_task_history
+                            ON state (routine, instance, state_time_stamp, state)''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS current_state (
+                                routine VARCHAR(250),
+                                instance TIMESTAMP,
+                                state VARCHAR(250),
+                                state_time_stamp TIMESTAMP,
+                                PRIMARY KEY (routine, instance))''')
+            conn.execute('DELETE FROM current_state')
+            conn.execute('''INSERT OR REPLACE INTO current_state
+                            SELECT s.routine, s.instance, s.state, s.state_time_stamp
+                            FROM (
+                                SELECT routine, instance, MAX(state_time_stamp) as last
+                                FROM state
+                                GROUP BY routine, instance
+                            ) m
+                            INNER JOIN state s
+                            ON s.routine = m.routine
+                            AND s.instance = m.instance
+                            AND s.state_time_stamp = m.last
+                            WHERE s.state != 'Archived'
+                            ORDER BY s.state_time_stamp''')
+
+    def delete_all_records(self):
+        """
+        Delete all records in the 'state' and 'current_state' tables.
+        """
+        self.flush()
+        with self.write_lock, self.write_database as conn:
+            conn.executescript('DELETE FROM state; DELETE FROM current_state;')
+        self.results.clear()
+
+    def warm_result_cache(self):
+        """
+        Fill the last result cache with the most recent tasks, in a single query over the history index.
+        """
+        if not self.result_cache_size:
+            return
+        query = """
+                SELECT routine, instance, state FROM state
+                WHERE rowid IN (
+                    SELECT MAX(rowid) FROM state
+                    WHERE state != 'Archived'
+                    GROUP BY routine, instance
+                )
+                ORDER BY instance DESC
+                LIMIT ?
+                """
+        rows = self.database.execute(query, (self.result_cache_size,)).fetchall()
+        for routine, instance, state in reversed(rows):
+            self.results[(routine, instance)] = state
+        logger.debug('Cached the last result of %s tasks', len(rows))
+
+    def cache_result(self, key, state):
+        if not self.result_cache_size:
+            return
+        self.results[key] = state
+        self.results.move_to_end(key)
+        if len(self.results) > self.result_cache_size:
+            self.results.popitem(last=False)
+
+    def last_result(self, task_name, task_instance):
+        """
+        Returns the latest non-Archived state of a task, from the cache where possible, or from the archive if its
+        history has been moved there.
+        :param str task_name: The name of the task (same as routine name)
+        :param datetime task_instance: The task datetime
+        :return: str state, or None if the task has no record
+        """
+        key = (task_name, task_instance)
+        if key in self.results:
+            self.result_hits += 1
+            self.results.move_to_end(key)
+            return self.results[key]
+        self.result_misses += 1
+        row = self.task_result(task_name, task_instance).fetchone()
+        state = row[2] if row is not None else None
+        if state is None and self.archive is not None:
+            state = self.archive.last_result(task_name, task_instance)
+        self.cache_result(key, state)
+        return state
 
     def update(self, task_name, task_instance, state):
         """
         Record a new task-level state transition.
         :param str task_name: The name of the task (same as routine name)
         :param datetime task_instance: The task datetime, which distinguishes this task from others of the same routine
-        :param str state: New task state ['Ready', 'Waiting', 'Failure', 'Success', 'Archived', 'Cancelled']
+        :param str state: New task state ['Ready', 'Waiting', 'Queued', 'Running', 'Failure', 'Success', 'Archived',
+                          'Cancelled']
         """
-        query = 'INSERT INTO state VALUES (?, ?, ?, ?)'
+        start = time.perf_counter()
         timestamp = datetime.today()
         new_row = (task_name, task_instance, state) + (timestamp,)
-        with self.database as conn:
-            conn.execute(query, new_row)
+        if state != 'Archived':
+            self.cache_result((task_name, task_instance), state)
+        if self.write_behind:
+            with self.buffer_ready:
+                self.buffer.append(new_row)
+                if len(self.buffer) >= self.flush_rows:
+                    self.buffer_ready.notify()
+        else:
+            with self.write_lock:
+                self.write_rows([new_row])
+        if self.update_seconds is not None:
+            self.update_seconds.observe(time.perf_counter() - start, 'update')
+
+    def update_many(self, updates):
+        """
+        Record many task-level state transitions at once, in a single transaction.
+        :param list updates: (task name, task instance, state) tuples, in the order they happened
+        """
+        start = time.perf_counter()
+        timestamp = datetime.today()
+        new_rows = [update + (timestamp,) for update in updates]
+        for task_name, task_instance, state, _ in new_rows:
+            if state != 'Archived':
+                self.cache_result((task_name, task_instance), state)
+        if self.write_behind:
+            with self.buffer_ready:
+                self.buffer.extend(new_rows)
+                if len(self.buffer) >= self.flush_rows:
+                    self.buffer_ready.notify()
+        elif new_rows:
+            with self.write_lock:
+                self.write_rows(new_rows)
+        if self.update_seconds is not None:
+            self.update_seconds.observe(time.perf_counter() - start, 'update_many')
+
+    def write_rows(self, rows):
+        """
+        Write state transitions to the database in a single transaction: append them to the 'state' history and
+        apply the latest transition of each task to 'current_state', where Archived tasks are removed.
+        Callers must hold write_lock.
+        :param list rows: (routine, instance, state, state_time_stamp) tuples
+        """
+        latest = {}
+        for row in rows:
+            latest[row[:2]] = row
+        live = [row for row in latest.values() if row[2] != 'Archived']
+        archived = [row[:2] for row in latest.values() if row[2] == 'Archived']
+        with self.write_database as conn:
+            conn.executemany('INSERT INTO state VALUES (?, ?, ?, ?)', rows)
+            if live:
+                conn.executemany('INSERT OR REPLACE INTO current_state VALUES (?, ?, ?, ?)', live)
+            if archived:
+                conn.executemany('DELETE FROM current_state WHERE routine = ? AND instance = ?', archived)
+
+    def flush(self):
+        """
+        Write any buffered updates to the database now.
+        """
+        if not self.write_behind:
+            return
+        with self.write_lock:
+            with self.buffer_ready:
+                rows, self.buffer = self.buffer, []
+            if rows:
+                self.write_rows(rows)
+
+    def write_loop(self):
+        """
+        Write-behind thread: flush the buffer whenever it fills up or flush_interval has passed, until closed.
+        """
+        while self.write_behind:
+            with self.buffer_ready:
+                if len(self.buffer) < self.flush_rows:
+                    self.buffer_ready.wait(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error:
+                logger.exception('Failed to write buffered state updates')
 
     def get_current_status(self, routine_name=None):
         """
@@ -69,24 +294,17 @@ class StateManager:
         :return: iterable of tuples
         """
         query = """
-                SELECT s.routine, s.instance, s.state, s.state_time_stamp
-                FROM (
-                    SELECT routine, instance, MAX(state_time_stamp) as last
-                    FROM state
-                    GROUP BY routine, instance
-                ) m
-                INNER JOIN state s
-                ON s.routine = m.routine
-                AND s.instance = m.instance
-                AND s.state_time_stamp = m.last
-                WHERE s.state in ('Waiting', 'Ready', 'Failure', 'Cancelled', 'Running')
+                SELECT routine, instance, state, state_time_stamp
+                FROM current_state
+                WHERE state in ('Waiting', 'Ready', 'Queued', 'Failure', 'Cancelled', 'Running')
                 {}
-                ORDER BY s.instance, s.state_time_stamp
+                ORDER BY instance, state_time_stamp
                 """
-        name_filter = "AND s.routine == '{}'".format(routine_name) if routine_name else ''
+        name_filter = 'AND routine = ?' if routine_name else ''
         query = query.format(name_filter)
+        self.flush()
         with self.database as conn:
-            results = conn.execute(query)
+            results = conn.execute(query, (routine_name,) if routine_name else ())
         return results
 
     def task_result(self, task_name, task_instance):
@@ -98,19 +316,26 @@ class StateManager:
         """
         query = """
                 SELECT * FROM state
-                WHERE routine = '{}'
-                AND instance = '{}'
+                WHERE routine = ?
+                AND instance = ?
                 AND state != 'Archived'
                 ORDER BY state_time_stamp DESC
                 """
-        query = query.format(task_name, task_instance)
+        self.flush()
         with self.database as conn:
-            results = conn.execute(query)
+            results = conn.execute(query, (task_name, task_instance))
         return results
 
     def close(self):
         """
-        Close the cached database connection.
+        Write any buffered updates and close the cached database connection.
         """
+        if self.write_behind:
+            self.flush()
+            self.write_behind = False
+            with self.buffer_ready:
+                self.buffer_ready.notify()
+            self.writer.join()
+            self.write_database.close()
         logger.info('Closing database connection: %s', self.database_path)
-        self.database.close()
\ No newline at end of file
+        self.database.close()
@@ -0,0 +1,150 @@
+import os
+import queue
+import sqlite3
+import logging
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+
+logger = logging.getLogger(__name__)
+
+# Queries are kept constant so that each pooled connection prepares them once and reuses them from its statement cache
+current_status_query = """
+    SELECT routine, instance, state, state_time_stamp
+    FROM current_state
+    WHERE state in ('Waiting', 'Ready', 'Queued', 'Failure', 'Cancelled', 'Running')
+    ORDER BY instance, state_time_stamp
+    """
+routine_status_query = """
+    SELECT routine, instance, state, state_time_stamp
+    FROM current_state
+    WHERE state in ('Waiting', 'Ready', 'Queued', 'Failure', 'Cancelled', 'Running')
+    AND routine = ?
+    ORDER BY instance, state_time_stamp
+    """
+task_result_query = """
+    SELECT * FROM state
+    WHERE routine = ?
+    AND instance = ?
+    AND state != 'Archived'
+    ORDER BY state_time_stamp DESC
+    """
+
+# Seconds from each Success or Failure back to the task's latest Running state before it
+run_durations_query = """
+    SELECT f.routine, (julianday(f.state_time_stamp) - julianday(MAX(r.state_time_stamp))) * 86400
+    FROM state f
+    INNER JOIN state r
+    ON r.routine = f.routine
+    AND r.instance = f.instance
+    AND r.state = 'Running'
+    AND r.state_time_stamp <= f.state_time_stamp
+    WHERE f.state in ('Success', 'Failure')
+    GROUP BY f.routine, f.instance, f.state_time_stamp
+    """
+
+
+class StateReader:
+    """
+    Read-only access to a scheduler's state database, for the status and execute commands and the web UI.
+
+    The database is opened with a mode=ro URI, so a reader can never create or modify it, and each query runs in its
+    own read transaction.  With the database in WAL journal mode that transaction reads a consistent snapshot without
+    blocking, or being blocked by, the scheduler's writes.  Idle connections are kept in a small pool and reused.
+    """
+    def __init__(self, database_path, pool_size=4, timeout=5):
+        """
+        Initialize object.
+        :param str database_path: File path of an existing state database
+        :param int pool_size: Maximum number of idle connections kept open for reuse
+        :param float timeout: Seconds to wait if the database is locked
+        """
+        if not os.path.exists(database_path):
+            raise Exception('State database does not exist: {}'.format(database_path))
+        self.database_path = database_path
+        self.uri = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(database_path)))
+        self.timeout = timeout
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+
+    def connect(self):
+        # Autocommit, so no transaction (and so no old snapshot) is ever left open on a pooled connection
+        connection = sqlite3.connect(self.uri, uri=True, timeout=self.timeout, check_same_thread=False,
+                                     detect_types=sqlite3.PARSE_DECLTYPES, isolation_level=None)
+        connection.execute('PRAGMA query_only = 1')
+        return connection
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection from the pool (or open a new one) for the duration of the with block.
+        """
+        try:
+            connection = self.pool.get_nowait()
+        except queue.Empty:
+            connection = self.connect()
+        try:
+            yield connection
+        finally:
+            try:
+                self.pool.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+
+    def query(self, sql, parameters=()):
+        """
+        Run a read query and return all of its rows, read from a single snapshot.
+        :param str sql: The query
+        :param tuple parameters: Query parameters
+        :return: list of tuples
+        """
+        with self.connection() as connection:
+            return connection.execute(sql, parameters).fetchall()
+
+    def get_current_status(self, routine_name=None):
+        """
+        Returns the last state for all non-Archived tasks.
+        :param str routine_name: The name of the routine (optional, if you want to filter results)
+        :return: list of tuples
+        """
+        if routine_name:
+            return self.query(routine_status_query, (routine_name,))
+        return self.query(current_status_query)
+
+    def task_result(self, task_name, task_instance):
+        """
+        Returns all non-Archived state information for a particular task, latest first.
+        :param str task_name: The name of the task (same as routine name)
+        :param datetime task_instance: The task datetime
+        :return: list of tuples
+        """
+        return self.query(task_result_query, (task_name, task_instance))
+
+    def last_result(self, task_name, task_instance):
+        """
+        Returns the latest non-Archived state of a task, or None if it has no record.
+        :param str task_name: The name of the task (same as routine name)
+        :param datetime task_instance: The task datetime
+        :return: str
+        """
+        rows = self.task_result(task_name, task_instance)
+        return rows[0][2] if rows else None
+
+    def run_durations(self):
+        """
+        Returns how long every recorded run took, by routine.
+        :return: dict of routine name -> list of seconds
+        """
+        durations = {}
+        for routine, seconds in self.query(run_durations_query):
+            durations.setdefault(routine, []).append(seconds)
+        return durations
+
+    def close(self):
+        """
+        Close the pooled connections.
+        """
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
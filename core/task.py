@@ -5,9 +5,12 @@ from multiprocessing import Process
 
 import config
 from core.message import Message
+from core.script_cache import get_script_cache, load_entry_point
+from core.task_logs import TaskLogHandler
 
 
 logger = logging.getLogger(__name__)
+log_format = '%(asctime)s | %(name)s | %(levelname)s | %(message)s'
 
 
 def qualified_task_name(task_name, time):
@@ -15,8 +18,65 @@ def qualified_task_name(task_name, time):
     return '.'.join([task_name, time_str])
 
 
+def start_process_group():
+    """
+    Called first thing in a task or pool worker process: lead a process group of its own, so that a timeout or cancel
+    also kills any processes its scripts start.
+    """
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+
+
+def run_script(script, qualified_name, log, entry_point=None, script_cache=None, log_queue=None):
+    """
+    Execute a task script, or call its entry point function.  While it runs, all logging is sent to the scheduler's
+    log writer (or, without one, to the task's own log file), so that the logging of individual tasks is separate from
+    the main program (and from other tasks run by the same worker process).
+
+    Scripts are compiled once per process (and optionally persisted in script_cache) and run as __main__ in a fresh
+    namespace, holding only __name__, __file__ and the builtins.  Entry point modules are imported once per process and
+    only their function is called per run.
+
+    Args:
+        script (str): Full path to python executable
+        qualified_name (str): The task qualified name
+        log (str): Path of the task log file, used without a log_queue
+        entry_point (str): 'package.module:function' to call instead of running script (optional)
+        script_cache (str): Directory to persist compiled scripts in (optional)
+        log_queue (Queue): The LogWriter's queue (optional)
+
+    Returns: 'Success' or 'Failure'
+    """
+    handler = TaskLogHandler(log_queue, qualified_name) if log_queue is not None else logging.FileHandler(log)
+    handler.setFormatter(logging.Formatter(log_format, datefmt=config.dt_format_str))
+    root_logger = logging.getLogger()
+    saved_handlers, saved_level = root_logger.handlers[:], root_logger.level
+    root_logger.handlers = [handler]
+    root_logger.setLevel(logging.DEBUG)
+    task_logger = logging.getLogger(__name__)
+
+    task_logger.info('Running %s', qualified_name)
+    try:
+        if entry_point:
+            load_entry_point(entry_point)()
+        else:
+            code = get_script_cache(script_cache).load(script)
+            exec(code, {'__name__': '__main__', '__file__': script, '__builtins__': __builtins__})
+        result = 'Success'
+        task_logger.info('Success')
+    except Exception as e:
+        result = 'Failure'
+        task_logger.exception('Encountered an error running: %s', entry_point or script)
+        task_logger.exception(e)
+    finally:
+        root_logger.handlers = saved_handlers
+        root_logger.setLevel(saved_level)
+        handler.close()
+    return result
+
+
 class Task(Process):
-    def __init__(self, name, script, time, dependencies={}, queue=None):
+    def __init__(self, name, script, time, dependencies={}, queue=None, entry_point=None):
         """
         Args:
             name (str): Routine name
@@ -24,23 +84,25 @@ class Task(Process):
             time (datetime): The time at which the task is supposed to run
             dependencies (dict): A dictionary of dependencies. Keys are qualified names, values are state information
             queue (Queue): A queue object. Used to communicate results.
+            entry_point (str): 'package.module:function' to call instead of running script (optional)
         """
         super().__init__(name=name)
         self.script = script
+        self.entry_point = entry_point
         self.time = time
         self.qualified_name = qualified_task_name(self.name, self.time)
         self.dependencies = dependencies
+        # Number of dependencies that have not (yet) succeeded
+        self.pending_dependencies = sum(1 for state in self.dependencies.values() if state != 'Success')
         self.result_queue = queue
         self.state = 'Waiting' if self.dependencies else 'Ready'
-
-        # Identify routine log directory and set log file path
-        log_directory = config.get_config_file().get('DEFAULT', 'log_directory')
-        routine_directory = os.path.join(log_directory, self.name)
-        if not os.path.exists(routine_directory):
-            os.makedirs(routine_directory)
-        # Standard time format uses :, but that cannot be used in a file name so replace.
-        log_file_name = '.'.join([self.qualified_name.replace(':', '-'), 'log'])
-        self.log = os.path.join(routine_directory, log_file_name)
+        self.catchup = False  # a run missed while the scheduler was down, made up on resume
+        self.backfill = None  # name of the backfill that created this task, if any
+        self.timeout = None  # seconds the task may run, taken from its routine when it is run
+        # Where the task logs to, and the compiled script cache, are set by the executor that runs it
+        self.log = None
+        self.log_queue = None
+        self.script_cache = None
 
     def __lt__(self, other):
         """Order tasks based on time parameter"""
@@ -81,31 +143,22 @@ class Task(Process):
             qualified_name (str): The dependency qualified name
             new_state (str): The new state of the dependency
         """
-        # Update dependency state information
+        # Update dependency state information, counting dependencies still to succeed rather than re-checking them all
+        old_state = self.dependencies.get(qualified_name)
         self.dependencies[qualified_name] = new_state
+        if (old_state == 'Success') == (new_state == 'Success'):
+            return
+        self.pending_dependencies += 1 if old_state == 'Success' else -1
         # If all dependencies are now successful, this task is ready to be executed.
-        if all([dep_state == 'Success' for dep_state in self.dependencies.values()]):
+        if self.pending_dependencies == 0:
             self.update_state('Ready')
 
     def run(self):
         """
         Execute the script in a separate process
         """
-        # We want the logging of the individual tasks to be separate from the main program.  So that logging
-        # configuration is handled here.
-        logging.basicConfig(filename=self.log, level=logging.DEBUG,
-                            format='%(asctime)s | %(name)s | %(levelname)s | %(message)s',
-                            datefmt=config.dt_format_str)
-        task_logger = logging.getLogger(__name__)
-
-        task_logger.info('Running %s', self.qualified_name)
-        try:
-            exec(open(self.script).read())
-            result = 'Success'
-            task_logger.info('Success')
-        except Exception as e:
-            result = 'Failure'
-            task_logger.exception('Encountered an error running: ' + self.script)
-            task_logger.exception(e)
+        start_process_group()
+        result = run_script(self.script, self.qualified_name, self.log, self.entry_point, self.script_cache,
+                            self.log_queue)
         # Send the result to the queue for processing by the main program
         self.update_state(result)
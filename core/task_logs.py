@@ -0,0 +1,228 @@
+import os
+import re
+import gzip
+import time
+import queue
+import sqlite3
+import logging
+import threading
+import multiprocessing as mp
+from logging.handlers import QueueHandler
+from urllib.request import pathname2url
+
+
+logger = logging.getLogger(__name__)
+
+index_schema = """
+CREATE TABLE IF NOT EXISTS task_log (
+    qualified_name VARCHAR(250),
+    routine VARCHAR(250),
+    segment VARCHAR(250),
+    offset INTEGER,
+    length INTEGER
+);
+CREATE INDEX IF NOT EXISTS task_log_qualified_name ON task_log (qualified_name);
+"""
+
+INDEX_FILE = 'task_logs.db'
+segment_pattern = re.compile(r'^segment_(\d+)\.log\.gz$')
+
+
+def task_log_path(log_directory, routine, qualified_name):
+    """
+    Returns the path of a task's own log file, as used when task logs are not sent to a LogWriter.
+    """
+    routine_directory = os.path.join(log_directory, routine)
+    os.makedirs(routine_directory, exist_ok=True)
+    # Standard time format uses :, but that cannot be used in a file name so replace.
+    return os.path.join(routine_directory, '.'.join([qualified_name.replace(':', '-'), 'log']))
+
+
+class TaskLogHandler(QueueHandler):
+    """
+    Sends the formatted log lines of one task run to the LogWriter's queue as (routine, qualified name, line) tuples.
+    """
+    def __init__(self, log_queue, qualified_name):
+        super().__init__(log_queue)
+        self.qualified_name = qualified_name
+        self.routine = qualified_name.split('.')[0]
+
+    def enqueue(self, record):
+        # prepare() has already formatted the record, traceback included, into record.msg
+        self.queue.put((self.routine, self.qualified_name, record.msg))
+
+    def close(self):
+        # Marks the end of the run, so its lines are written without waiting
+        self.queue.put((self.routine, self.qualified_name, None))
+        super().close()
+
+
+class LogWriter:
+    """
+    The single writer of task logs.  Task processes send their log lines over a queue, and this thread buffers each
+    run's lines and appends them, as one gzip member, to the current segment file of the routine
+    (log_directory/<routine>/segment_NNNNNN.log.gz, a valid multi-member gzip file).  Segments are rotated once they
+    reach segment_bytes.  An index (log_directory/task_logs.db) records the segment, offset and length of every chunk,
+    so reading one run's log is a lookup and a seek.
+
+    A run's lines are written when it ends, once chunk_bytes of them are buffered, or after flush_seconds, whichever
+    comes first, so runs whose process dies are still written.
+    """
+    def __init__(self, log_directory, log_queue=None, segment_bytes=64 * 1024 * 1024, chunk_bytes=256 * 1024,
+                 flush_seconds=5):
+        """
+        Initialize object.
+        :param str log_directory: Root of the segment files and the index
+        :param Queue log_queue: Queue to read log lines from (default: a new multiprocessing queue)
+        :param int segment_bytes: Size at which a segment is closed and a new one started
+        :param int chunk_bytes: Buffered size at which a run's lines are written before it ends
+        :param float flush_seconds: Longest a run's lines are buffered before being written
+        """
+        self.log_directory = log_directory
+        self.queue = log_queue if log_queue is not None else mp.Queue()
+        self.segment_bytes = segment_bytes
+        self.chunk_bytes = chunk_bytes
+        self.flush_seconds = flush_seconds
+        self.buffers = {}  # qualified name -> [routine, lines, size, monotonic time of first line]
+        self.segments = {}  # routine -> [open file, relative path]
+        self.index = None
+        self.thread = None
+        os.makedirs(log_directory, exist_ok=True)
+
+    def start(self):
+        logger.info('Starting task log writer: %s', self.log_directory)
+        self.thread = threading.Thread(target=self.run, name='LogWriter', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Write everything received so far and stop"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def write(self, qualified_name, line):
+        """
+        Add a line to a task's log from within the scheduler process.
+        """
+        self.queue.put((qualified_name.split('.')[0], qualified_name, line))
+
+    def run(self):
+        self.index = sqlite3.connect(os.path.join(self.log_directory, INDEX_FILE))
+        self.index.executescript(index_schema)
+        try:
+            stopping = False
+            while not stopping:
+                try:
+                    items = [self.queue.get(timeout=self.flush_seconds)]
+                except queue.Empty:
+                    items = []
+                while items and len(items) < 10000:
+                    try:
+                        items.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                rows = []
+                for item in items:
+                    if item is None:
+                        stopping = True
+                    else:
+                        self.receive(*item, rows=rows)
+                self.flush_aged(rows, flush_all=stopping)
+                self.commit(rows)
+        finally:
+            for segment, _ in self.segments.values():
+                segment.close()
+            self.segments = {}
+            self.index.close()
+
+    def receive(self, routine, qualified_name, line, rows):
+        buffer = self.buffers.get(qualified_name)
+        if line is None:
+            if buffer is not None:
+                self.write_chunk(qualified_name, rows)
+            return
+        if buffer is None:
+            buffer = self.buffers[qualified_name] = [routine, [], 0, time.monotonic()]
+        buffer[1].append(line)
+        buffer[2] += len(line) + 1
+        if buffer[2] >= self.chunk_bytes:
+            self.write_chunk(qualified_name, rows)
+
+    def flush_aged(self, rows, flush_all=False):
+        cutoff = time.monotonic() - self.flush_seconds
+        for qualified_name in [k for k, v in self.buffers.items() if flush_all or v[3] <= cutoff]:
+            self.write_chunk(qualified_name, rows)
+
+    def write_chunk(self, qualified_name, rows):
+        routine, lines, _, _ = self.buffers.pop(qualified_name)
+        data = gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'), compresslevel=6)
+        segment, path = self.segment(routine)
+        offset = segment.tell()
+        segment.write(data)
+        rows.append((qualified_name, routine, path, offset, len(data)))
+        if offset + len(data) >= self.segment_bytes:
+            segment.close()
+            del self.segments[routine]
+
+    def segment(self, routine):
+        """
+        Returns [open file, path relative to log_directory] of the routine's current segment, opening the latest
+        existing segment if it still has room, else starting a new one.
+        """
+        if routine not in self.segments:
+            directory = os.path.join(self.log_directory, routine)
+            os.makedirs(directory, exist_ok=True)
+            numbers = [int(match.group(1)) for match in map(segment_pattern.match, os.listdir(directory)) if match]
+            number = max(numbers, default=1)
+            path = os.path.join(directory, 'segment_{:06d}.log.gz'.format(number))
+            if os.path.exists(path) and os.path.getsize(path) >= self.segment_bytes:
+                path = os.path.join(directory, 'segment_{:06d}.log.gz'.format(number + 1))
+            self.segments[routine] = [open(path, 'ab'), os.path.relpath(path, self.log_directory)]
+        return self.segments[routine]
+
+    def commit(self, rows):
+        """
+        Make the written chunks durable in the segments, then index them, so the index never points past the data.
+        """
+        if not rows:
+            return
+        for segment, _ in self.segments.values():
+            segment.flush()
+        with self.index as conn:
+            conn.executemany('INSERT INTO task_log VALUES (?, ?, ?, ?, ?)', rows)
+
+
+class LogStore:
+    """
+    Reads task logs written by a LogWriter, falling back to the per-task log files written without one.
+    """
+    def __init__(self, log_directory):
+        self.log_directory = log_directory
+
+    def read(self, qualified_name):
+        """
+        Returns the full log of a task (every run of it, oldest first), or None if there is none.
+        :param str qualified_name: Task qualified name
+        """
+        chunks = []
+        index_path = os.path.join(self.log_directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            index = sqlite3.connect('file:{}?mode=ro'.format(pathname2url(os.path.abspath(index_path))), uri=True)
+            try:
+                rows = index.execute('SELECT segment, offset, length FROM task_log WHERE qualified_name = ? '
+                                     'ORDER BY rowid', (qualified_name,)).fetchall()
+            finally:
+                index.close()
+            for segment, offset, length in rows:
+                with open(os.path.join(self.log_directory, segment), 'rb') as segment_file:
+                    segment_file.seek(offset)
+                    chunks.append(gzip.decompress(segment_file.read(length)).decode('utf-8'))
+        if not chunks:
+            path = os.path.join(self.log_directory, qualified_name.split('.')[0],
+                                '.'.join([qualified_name.replace(':', '-'), 'log']))
+            if not os.path.exists(path):
+                return None
+            with open(path) as log_file:
+                chunks.append(log_file.read())
+        return ''.join(chunks)
@@ -0,0 +1,164 @@
+class IndexedHeap:
+    """
+    A binary min-heap of keyed items.  A position index allows any item to be removed or re-prioritized in O(log n)
+    rather than searching the heap for it.
+    """
+    def __init__(self):
+        self.heap = []  # list of [priority, key]
+        self.position = {}  # key -> index of its entry in heap
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, key):
+        return key in self.position
+
+    def push(self, key, priority):
+        """
+        Add an item, or change its priority if it is already in the heap.
+        :param key: Hashable item identifier
+        :param priority: Any orderable value, smallest comes first
+        """
+        index = self.position.get(key)
+        if index is None:
+            self.heap.append([priority, key])
+            self.position[key] = len(self.heap) - 1
+            self.sift_up(len(self.heap) - 1)
+        else:
+            old_priority = self.heap[index][0]
+            self.heap[index][0] = priority
+            if priority < old_priority:
+                self.sift_up(index)
+            else:
+                self.sift_down(index)
+
+    def remove(self, key):
+        """
+        Remove an item if present.
+        :param key: Item identifier
+        """
+        index = self.position.pop(key, None)
+        if index is None:
+            return
+        last = self.heap.pop()
+        if index < len(self.heap):
+            self.heap[index] = last
+            self.position[last[1]] = index
+            self.sift_up(index)
+            self.sift_down(self.position[last[1]])
+
+    def peek(self):
+        """
+        Returns (priority, key) of the smallest item without removing it, or None if the heap is empty.
+        """
+        if not self.heap:
+            return None
+        priority, key = self.heap[0]
+        return priority, key
+
+    def pop(self):
+        """
+        Remove and return (priority, key) of the smallest item.
+        """
+        priority, key = self.heap[0]
+        self.remove(key)
+        return priority, key
+
+    def swap(self, i, j):
+        heap = self.heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self.position[heap[i][1]] = i
+        self.position[heap[j][1]] = j
+
+    def sift_up(self, index):
+        heap = self.heap
+        while index > 0:
+            parent = (index - 1) >> 1
+            if heap[index][0] < heap[parent][0]:
+                self.swap(index, parent)
+                index = parent
+            else:
+                break
+
+    def sift_down(self, index):
+        heap = self.heap
+        size = len(heap)
+        while True:
+            smallest = index
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < size and heap[child][0] < heap[smallest][0]:
+                    smallest = child
+            if smallest == index:
+                break
+            self.swap(index, smallest)
+            index = smallest
+
+
+class TaskQueue:
+    """
+    Tracks the scheduled tasks that are still to be run, ordered by task time.
+
+    Every pending (Ready or Waiting) task is held, and the Ready ones are kept in a heap from which due tasks are
+    dispatched.  Waiting tasks are not in it: they only become Ready on an event, so an overdue Waiting task (say
+    behind a failed dependency) never makes the next runtime look due.  Ready backfill tasks have a heap of their own,
+    drained only once no live task is due, since their past times would otherwise put them ahead of live work.  Tasks
+    in any other state are not queued.  Callers must call update() whenever a task changes state so that it moves into
+    or out of the right heaps.
+    """
+    def __init__(self):
+        self.tasks = {}  # qualified name -> Task, for every queued task
+        self.ready = IndexedHeap()
+        self.ready_backfill = IndexedHeap()
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __contains__(self, qualified_name):
+        return qualified_name in self.tasks
+
+    def update(self, task):
+        """
+        Queue, re-queue or dequeue a task according to its current state.
+        :param Task task: The task (possibly a replacement object for an already queued task)
+        """
+        priority = (task.time, task.qualified_name)
+        if task.state in ['Ready', 'Waiting']:
+            self.tasks[task.qualified_name] = task
+            ready = self.ready_backfill if task.backfill else self.ready
+            if task.state == 'Ready':
+                ready.push(task.qualified_name, priority)
+            else:
+                ready.remove(task.qualified_name)
+        else:
+            self.remove(task.qualified_name)
+
+    def remove(self, qualified_name):
+        """
+        Dequeue a task, if it is queued.
+        :param str qualified_name: The task qualified name
+        """
+        self.tasks.pop(qualified_name, None)
+        self.ready.remove(qualified_name)
+        self.ready_backfill.remove(qualified_name)
+
+    def next_ready_time(self):
+        """
+        Returns the time of the earliest Ready task, or None if there are none: when the main loop next has work to do
+        without an event.
+        :return: datetime
+        """
+        heads = [head for head in (self.ready.peek(), self.ready_backfill.peek()) if head is not None]
+        return min(heads)[0][0] if heads else None
+
+    def next_due(self, reference_time):
+        """
+        Returns the earliest Ready live task whose time is at or before reference_time, or failing that the earliest
+        such backfill task, or None.
+        :param datetime reference_time: The current time
+        :return: Task
+        """
+        for ready in (self.ready, self.ready_backfill):
+            head = ready.peek()
+            if head is not None and head[0][0] <= reference_time:
+                return self.tasks[head[1]]
+        return None
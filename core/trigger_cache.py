@@ -0,0 +1,52 @@
+from collections import OrderedDict
+
+
+class TriggerCache:
+    """
+    A bounded least-recently-used cache of resolved trigger times.  Routines without a schedule derive their triggers
+    from their dependencies, so in a deep or diamond-shaped registry the same upstream routine would otherwise be
+    re-evaluated once for every path leading to it.
+    """
+    def __init__(self, max_size=65536):
+        """
+        Initialize object.
+        :param int max_size: Maximum number of cached triggers before the least recently used are evicted
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Returns the cached trigger for key, or None if it is not cached.
+        :param tuple key: (routine name, direction, reference time, inclusive)
+        :return: datetime
+        """
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """
+        Cache a resolved trigger, evicting the least recently used entry if the cache is full.
+        :param tuple key: (routine name, direction, reference time, inclusive)
+        :param datetime value: The resolved trigger
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Discard all cached triggers.  Called whenever the routines or their dependencies change.
+        """
+        self.entries.clear()
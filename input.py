@@ -1,48 +1,263 @@
+"""
+Control protocol
+
+Every message, in either direction, is a frame: a 4 byte big-endian length followed by that many bytes of UTF-8 JSON.
+A request is {"id": ..., "command": ..., "arguments": {...}} and is answered by {"id": ..., "ok": true, "result": ...}
+or {"id": ..., "ok": false, "error": "..."}.  A frame may also hold a list of requests (a batch), answered by one frame
+holding the list of responses.  Any number of frames may be sent on one connection without waiting for the responses
+(pipelining); responses come back in request order.
+"""
+import json
 import socket
+import struct
+import asyncio
 import logging
-import socketserver
+import itertools
+import threading
+import concurrent.futures
 import multiprocessing as mp
 
+from core.message import Request
+
 
 message_queue = mp.Queue()
 HOST = "localhost"
 logger = logging.getLogger(__name__)
 
+frame_header = struct.Struct('>I')
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+
+
+def encode_frame(payload):
+    data = json.dumps(payload).encode('utf-8')
+    return frame_header.pack(len(data)) + data
 
-class UserInputHandler(socketserver.BaseRequestHandler):
+
+async def read_frame(reader):
+    size, = frame_header.unpack(await reader.readexactly(frame_header.size))
+    if size > MAX_FRAME_BYTES:
+        raise ValueError('Frame of {} bytes exceeds the {} byte limit'.format(size, MAX_FRAME_BYTES))
+    return json.loads((await reader.readexactly(size)).decode('utf-8'))
+
+
+class ControlServer:
     """
-    The request handler class for our user input server.
+    Accepts control connections on an asyncio event loop in a background thread.  Each request is put on the event
+    queue as a Request and answered once the TaskManager, from its own thread, passes the response to respond().
     """
-    message_queue = message_queue
+    def __init__(self, event_queue, host=HOST, port=0):
+        """
+        Initialize object.
+        :param Queue event_queue: The TaskManager's event queue
+        :param str host: Address to listen on
+        :param int port: Port to listen on (0 to pick a free one)
+        """
+        self.event_queue = event_queue
+        self.host = host
+        self.port = port
+        self.pending = {}  # request id -> concurrent.futures.Future, resolved by respond()
+        self.request_ids = itertools.count(1)
+        self.connections = set()
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.error = None
+        self.started = threading.Event()
+
+    def start(self):
+        """
+        Start listening.
+        :return: The port listened on
+        """
+        logger.info('Launching Control Server')
+        self.thread = threading.Thread(target=self.run, name='ControlServer', daemon=True)
+        self.thread.start()
+        self.started.wait()
+        if self.error is not None:
+            raise self.error
+        return self.port
 
-    def handle(self):
-        # self.request is the TCP socket connected to the client
-        self.data = self.request.recv(1024)
-        # Echo request to acknowledge
-        self.request.sendall(self.data)
-        message_queue.put(self.data.decode('utf-8'))
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self.handle_connection, self.host, self.port))
+            self.port = self.server.sockets[0].getsockname()[1]
+        except OSError as e:
+            self.error = e
+            self.started.set()
+            self.loop.close()
+            return
+        self.started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
 
-def initialize_ui_listener():
-    logger.info('Creating UI Listener')
-    server = socketserver.TCPServer((HOST, 0), UserInputHandler)
-    port = server.server_address[1]
-    return server, port
+    def stop(self, timeout=5):
+        """
+        Stop accepting connections, give open connections up to timeout seconds to receive their responses, then stop.
+        """
+        if self.thread is None or self.error is not None:
+            return
+        asyncio.run_coroutine_threadsafe(self.close(timeout), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
 
-def launch_ui_listener(server):
-    logger.info('Launching UI Listener')
-    with server:
-        server.serve_forever()
+    async def close(self, timeout):
+        self.server.close()
+        if self.connections:
+            await asyncio.wait(self.connections, timeout=timeout)
+        for connection in self.connections:
+            connection.cancel()
 
-def send_user_input(data, port):
+    def respond(self, request_id, response):
+        """
+        Deliver the response to a request.  Called from the TaskManager thread.
+        :param int request_id: Request.request_id
+        :param dict response: {'ok': True, 'result': ...} or {'ok': False, 'error': ...}
+        """
+        future = self.pending.pop(request_id, None)
+        if future is not None:
+            future.set_result(response)
 
+    async def handle_connection(self, reader, writer):
+        connection = asyncio.current_task()
+        self.connections.add(connection)
+        responses = asyncio.Queue()
+        sender = self.loop.create_task(self.send_responses(writer, responses))
+        try:
+            while True:
+                try:
+                    payload = await read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except ValueError as e:
+                    # The stream cannot be trusted after a bad frame, answer and hang up
+                    await responses.put(self.loop.create_task(self.error_response(None, str(e))))
+                    break
+                # Submitted straight away, so pipelined requests do not wait for earlier responses
+                await responses.put(self.loop.create_task(self.handle_payload(payload)))
+        finally:
+            await responses.put(None)
+            await sender
+            writer.close()
+            self.connections.discard(connection)
+
+    async def send_responses(self, writer, responses):
+        while True:
+            response = await responses.get()
+            if response is None:
+                return
+            try:
+                writer.write(encode_frame(await response))
+                await writer.drain()
+            except ConnectionError:
+                logger.warning('Control connection closed before its responses were sent')
+
+    async def handle_payload(self, payload):
+        if isinstance(payload, list):
+            return await asyncio.gather(*[self.submit(k) for k in payload])
+        return await self.submit(payload)
+
+    async def submit(self, request):
+        if not isinstance(request, dict) or not isinstance(request.get('command'), str):
+            return await self.error_response(None, 'Malformed request: {}'.format(request))
+        request_id = next(self.request_ids)
+        future = concurrent.futures.Future()
+        self.pending[request_id] = future
+        self.event_queue.put(Request(request_id=request_id, command=request['command'],
+                                     arguments=request.get('arguments') or {}))
+        response = dict(await asyncio.wrap_future(future))
+        response['id'] = request.get('id')
+        return response
+
+    @staticmethod
+    async def error_response(client_id, error):
+        return {'id': client_id, 'ok': False, 'error': error}
+
+
+class ControlClient:
+    """
+    Client side of the control protocol.
+    """
+    def __init__(self, port, host=HOST, timeout=None):
+        """
+        Initialize object.
+        :param int port: The scheduler's control port
+        :param str host: The scheduler's host
+        :param float timeout: Socket timeout in seconds (None to wait forever)
+        """
+        self.socket = socket.create_connection((host, port), timeout=timeout)
+        self.request_ids = itertools.count(1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.socket.close()
+
+    def send(self, payload):
+        self.socket.sendall(encode_frame(payload))
+
+    def receive(self):
+        size, = frame_header.unpack(self.receive_exactly(frame_header.size))
+        return json.loads(self.receive_exactly(size).decode('utf-8'))
+
+    def receive_exactly(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.socket.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('Control connection closed by the scheduler')
+            data += chunk
+        return bytes(data)
+
+    def make_request(self, command, arguments=None):
+        return {'id': next(self.request_ids), 'command': command, 'arguments': arguments or {}}
+
+    def request(self, command, **arguments):
+        """
+        Send one request and wait for its result.
+        :return: The result
+        """
+        self.send(self.make_request(command, arguments))
+        return self.result(self.receive())
+
+    def batch(self, requests):
+        """
+        Send a list of (command, arguments) requests in one frame.
+        :return: list of responses, in request order
+        """
+        self.send([self.make_request(command, arguments) for command, arguments in requests])
+        return self.receive()
+
+    def pipeline(self, requests):
+        """
+        Send a list of (command, arguments) requests, one frame each, before reading any response.
+        :return: list of responses, in request order
+        """
+        for command, arguments in requests:
+            self.send(self.make_request(command, arguments))
+        return [self.receive() for _ in requests]
+
+    @staticmethod
+    def result(response):
+        if not response['ok']:
+            raise Exception(response['error'])
+        return response['result']
+
+
+def send_command(port, command, **arguments):
+    """
+    Send one command to a running scheduler and return its result.
+    """
     logging.basicConfig(level=logging.DEBUG, format='%(asctime)s |> %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-    # Create a socket (SOCK_STREAM means a TCP socket)
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        # Connect to server and send data
-        sock.connect((HOST, port))
-        data = data.encode('utf-8')
-        sock.sendall(data)
-
-        # Receive data from the server and shut down
-        received = sock.recv(1024).decode('utf-8')
-    logger.info('Instruction Sent: [%s]', received)
+    with ControlClient(port) as client:
+        result = client.request(command, **arguments)
+    logger.info('Instruction Sent: [%s]', command)
+    return result
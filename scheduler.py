@@ -1,15 +1,20 @@
 import os
 import logging
+import json
 import argparse
-import threading
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # Internal imports
 import input
 import config
+from core.metrics import Metrics, MetricsServer
 from core.registry import Registry
+from core.retention import StateArchiver
 from core.state_manager import StateManager
+from core.state_reader import StateReader
+from core.task_logs import LogStore, LogWriter
 from task_manager import TaskManager
+from simulation import Simulation, historical_durations
 
 
 logger = logging.getLogger(__name__)
@@ -38,30 +43,75 @@ def start_func(args):
     try:
         # Load registry
         registry_file_path = configuration.get('DEFAULT', 'registry')
-        registry = Registry(registry_file_path)
+        registry = Registry(registry_file_path, configuration.get('DEFAULT', 'registry_snapshots', fallback=None))
 
-        # Load state data
+        # Scheduler metrics, recorded unless switched off
+        metrics = Metrics(configuration.getboolean('DEFAULT', 'metrics', fallback=True))
+
+        # Load state data.  Old Archived history is moved out of the state database in the background, where the
+        # StateManager can still find it.
         database_path = configuration.get('DEFAULT', 'database')
-        state_manager = StateManager(database_path, args.wipe)
+        archiver = None
+        retention_days = configuration.getfloat('DEFAULT', 'retention_days', fallback=0)
+        if retention_days > 0:
+            archive_directory = configuration.get('DEFAULT', 'archive_directory',
+                                                  fallback=os.path.join(os.path.dirname(database_path), 'archive'))
+            archiver = StateArchiver(database_path, archive_directory, retention_days,
+                                     batch_size=configuration.getint('DEFAULT', 'retention_batch', fallback=1000),
+                                     interval=configuration.getfloat('DEFAULT', 'retention_interval', fallback=3600))
+
+        state_manager = StateManager(
+            database_path, args.wipe,
+            write_behind=configuration.getboolean('DEFAULT', 'write_behind', fallback=False),
+            flush_interval_ms=configuration.getint('DEFAULT', 'flush_interval_ms', fallback=50),
+            flush_rows=configuration.getint('DEFAULT', 'flush_rows', fallback=500),
+            metrics=metrics, archive=archiver)
+        if archiver is not None:
+            archiver.start()
+
+        # Task logs are sent to a single writer, unless each task is to keep a log file of its own
+        log_writer = None
+        if configuration.get('DEFAULT', 'task_logs', fallback='store') == 'store':
+            segment_mb = configuration.getfloat('DEFAULT', 'task_log_segment_mb', fallback=64)
+            log_writer = LogWriter(configuration.get('DEFAULT', 'log_directory'),
+                                   segment_bytes=int(segment_mb * 1024 * 1024))
+            log_writer.start()
+
+        # Launch the control server
+        event_queue = input.message_queue
+        server = input.ControlServer(event_queue)
+        port = server.start()
 
-        # Setup the UI listener
-        server, port = input.initialize_ui_listener()
+        # Serve the metrics over HTTP
+        metrics_server = None
+        if metrics.enabled:
+            metrics_server = MetricsServer(metrics, configuration.get('DEFAULT', 'metrics_host', fallback='localhost'),
+                                           configuration.getint('DEFAULT', 'metrics_port', fallback=0))
+            configuration['SESSION']['metrics_port'] = str(metrics_server.start())
 
-        # Record the lister port
+        # Record the control port
         configuration['SESSION']['port'] = str(port)
         with open(configuration.get('DEFAULT', 'config_path'), 'w') as config_file:
             configuration.write(config_file)
-
-        # Launch UI listener
-        ui_thread = threading.Thread(target=input.launch_ui_listener, args=(server,), daemon=True)
-        ui_thread.start()
-        event_queue = input.message_queue
         logger.info('<< Initial Setup Complete >>')
 
         # Initialize the Task Manager
         logger.info('<< Launching Task Manager >>')
-        task_manager = TaskManager(event_queue, state_manager, registry, configuration)
-        task_manager.launch(args.resume)
+        task_manager = TaskManager(event_queue, state_manager, registry, configuration, responder=server.respond,
+                                   log_writer=log_writer, metrics=metrics)
+        try:
+            task_manager.launch(args.resume)
+        finally:
+            # Lets the stop instruction's response reach the client
+            server.stop()
+            if metrics_server is not None:
+                metrics_server.stop()
+            if archiver is not None:
+                archiver.stop()
+            if log_writer is not None:
+                log_writer.stop()
+            # Guarantees buffered state updates are written
+            state_manager.close()
 
     finally:
         logger.debug('Clean Up Instance File')
@@ -70,19 +120,23 @@ def start_func(args):
 
 def status_func(args):
     configuration = config.load_config_file(config.get_instance_config_location(args.scheduler_name))
-    state_manager = StateManager(configuration.get('DEFAULT', 'database'))
+    try:
+        # Served from the scheduler's memory
+        rows = input.send_command(configuration.getint('SESSION', 'port'), 'status', routine_name=args.routine_name)
+        columns = ['Name', 'Instance', 'Status']
+    except (OSError, ValueError):
+        logger.warning('Scheduler is not answering, reading the state database')
+        state_reader = StateReader(configuration.get('DEFAULT', 'database'))
+        rows = state_reader.get_current_status(args.routine_name)
+        columns = ['Name', 'Instance', 'Status', 'TimeStamp']
     results_list = []
-    max_length = [0, 0, 0, 0]
-    for row in state_manager.get_current_status(args.routine_name):
+    max_length = [len(k) for k in columns]
+    for row in rows:
         results_list.append(row)
-        for i in range(4):
-            #if i in [1,3]:
-            #    this_length = len(str(row[i]))
-            #else:
-            #    this_length = len(row[i])
+        for i in range(len(columns)):
             max_length[i] = max(max_length[i], len(str(row[i])))
 
-    header = [value.ljust(length) for value, length in zip(['Name', 'Instance', 'Status', 'TimeStamp'], max_length)]
+    header = [value.ljust(length) for value, length in zip(columns, max_length)]
     header = '|' + '|'.join(header)
     print('-' * len(header))
     print(header)
@@ -95,22 +149,87 @@ def status_func(args):
 
 def execute_func(args):
     configuration = config.load_config_file(config.get_instance_config_location(args.scheduler_name))
-    state_manager = StateManager(configuration.get('DEFAULT', 'database'))
+    with input.ControlClient(configuration.getint('SESSION', 'port')) as client:
+        # Every task on one connection, answered in order
+        for task_name, response in zip(args.task_name, client.pipeline([('execute', {'task_name': k})
+                                                                         for k in args.task_name])):
+            if response['ok']:
+                print('{}: {}'.format(task_name, response['result']))
+            else:
+                logger.error('Could not execute %s: %s', task_name, response['error'])
+
+
+def cancel_func(args):
+    configuration = config.load_config_file(config.get_instance_config_location(args.scheduler_name))
+    with input.ControlClient(configuration.getint('SESSION', 'port')) as client:
+        for task_name, response in zip(args.task_name, client.pipeline([('cancel', {'task_name': k})
+                                                                         for k in args.task_name])):
+            if response['ok']:
+                print('{}: {}'.format(task_name, response['result']))
+            else:
+                logger.error('Could not cancel %s: %s', task_name, response['error'])
 
-    routine, instance = args.task_name.split('.')
-    instance = datetime.strptime(instance, config.dt_format_str)
 
-    task_info = state_manager.task_result(routine, instance)
-    last_result = task_info.fetchone()
-    if last_result is None:
-        logger.error('Could not find %s. Check input.', args.task_name)
+def log_func(args):
+    configuration = config.load_config_file(config.get_instance_config_location(args.scheduler_name))
+    log = LogStore(configuration.get('DEFAULT', 'log_directory')).read(args.task_name)
+    if log is None:
+        logger.error('No log found for %s', args.task_name)
+    else:
+        print(log, end='')
+
+
+def reload_func(args):
+    configuration = config.load_config_file(config.get_instance_config_location(args.scheduler_name))
+    print(input.send_command(configuration.getint('SESSION', 'port'), 'reload'))
+
 
-    input.send_user_input(args.task_name, configuration.getint('SESSION', 'port'))
+def backfill_func(args):
+    configuration = config.load_config_file(config.get_instance_config_location(args.scheduler_name))
+    if args.status:
+        for backfill in input.send_command(configuration.getint('SESSION', 'port'), 'backfill_status'):
+            print('{name} {routine} {start} to {end}{finished}: {generated} of {total} generated ({skipped} skipped), '
+                  '{done} done, {failed} failed, {cancelled} cancelled, {running} running, {remaining} remaining'
+                  .format(**dict(backfill, finished=' (finished)' if backfill['finished'] else '')))
+        return
+    if not (args.routine and args.start and args.end):
+        logger.error('--routine, --start and --end are required to start a backfill')
+        return
+    for value in [args.start, args.end]:
+        # Fail here rather than in the scheduler
+        datetime.strptime(value, config.dt_format_str)
+    backfill = input.send_command(configuration.getint('SESSION', 'port'), 'backfill', routine=args.routine,
+                                  start=args.start, end=args.end, max_running=args.max_running)
+    print('Started {name}: {progress}'.format(**backfill))
+
+
+def simulate_func(args):
+    logging.basicConfig(level=args.log_level, format='%(asctime)s |> %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    configuration = config.load_config_file(args.config_file)
+    start = datetime.strptime(args.start, config.dt_format_str)
+    end = datetime.strptime(args.end, config.dt_format_str)
+    registry = Registry(configuration.get('DEFAULT', 'registry'))
+
+    # Routines without a declared duration take the median of their past runs, if there is a state database
+    durations = {}
+    database_path = configuration.get('DEFAULT', 'database', fallback=None)
+    if not args.ignore_history and database_path and os.path.exists(database_path):
+        reader = StateReader(database_path)
+        durations = historical_durations(reader)
+        reader.close()
+        logger.info('Run times of %s routines taken from %s', len(durations), database_path)
+
+    report = Simulation(registry, configuration, start, end, durations, args.default_duration).run()
+    resolution = timedelta(minutes=args.resolution)
+    print(report.format(resolution))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report.as_dict(resolution), output_file, indent=2)
 
 
 def end_func(args):
     configuration = config.load_config_file(config.get_instance_config_location(args.scheduler_name))
-    input.send_user_input('stop', configuration.getint('SESSION', 'port'))
+    input.send_command(configuration.getint('SESSION', 'port'), 'stop')
 
 
 if __name__ == '__main__':
@@ -145,9 +264,58 @@ if __name__ == '__main__':
     # Parser for Execute Instruction
     execute_parser = subparsers.add_parser('execute', help='execute help')
     execute_parser.add_argument('--scheduler_name', required=True, help='scheduler name')
-    execute_parser.add_argument('--task_name', help='Execute specific task: [Routine].[Date]T[Time]')
+    execute_parser.add_argument('--task_name', required=True, nargs='+',
+                                help='Execute specific tasks: [Routine].[Date]T[Time]')
     execute_parser.add_argument('--log_level', default='INFO', help='Log Level')
     execute_parser.set_defaults(func=execute_func)
 
+    # Parser for Cancel Instruction
+    cancel_parser = subparsers.add_parser('cancel', help='Cancel tasks and everything downstream of them, killing '
+                                                         'those that are running')
+    cancel_parser.add_argument('--scheduler_name', required=True, help='scheduler name')
+    cancel_parser.add_argument('--task_name', required=True, nargs='+',
+                               help='Cancel specific tasks: [Routine].[Date]T[Time]')
+    cancel_parser.add_argument('--log_level', default='INFO', help='Log Level')
+    cancel_parser.set_defaults(func=cancel_func)
+
+    # Parser for Log Instruction
+    log_parser = subparsers.add_parser('log', help='Print the log of a task')
+    log_parser.add_argument('--scheduler_name', required=True, help='scheduler name')
+    log_parser.add_argument('--task_name', required=True, help='Task: [Routine].[Date]T[Time]')
+    log_parser.add_argument('--log_level', default='INFO', help='Log Level')
+    log_parser.set_defaults(func=log_func)
+
+    # Parser for Reload Instruction
+    reload_parser = subparsers.add_parser('reload', help='Re-read the registry and apply any changes')
+    reload_parser.add_argument('--scheduler_name', required=True, help='scheduler name')
+    reload_parser.add_argument('--log_level', default='INFO', help='Log Level')
+    reload_parser.set_defaults(func=reload_func)
+
+    # Parser for Backfill Instruction
+    backfill_parser = subparsers.add_parser('backfill', help='Rerun a routine and its dependants over a time window')
+    backfill_parser.add_argument('--scheduler_name', required=True, help='scheduler name')
+    backfill_parser.add_argument('--routine', help='Routine to rerun')
+    backfill_parser.add_argument('--start', help='Earliest task time: [Date]T[Time]')
+    backfill_parser.add_argument('--end', help='Latest task time: [Date]T[Time]')
+    backfill_parser.add_argument('--max_running', type=int, help='Backfill tasks running at once')
+    backfill_parser.add_argument('--status', action='store_true',
+                                 help='Show the progress of running and recently finished backfills instead')
+    backfill_parser.add_argument('--log_level', default='INFO', help='Log Level')
+    backfill_parser.set_defaults(func=backfill_func)
+
+    # Parser for Simulate Instruction
+    simulate_parser = subparsers.add_parser('simulate', help='Replay the scheduling of a registry in simulated time')
+    simulate_parser.add_argument('--config_file', required=True, help='Path of the config file')
+    simulate_parser.add_argument('--start', required=True, help='Simulate from: [Date]T[Time]')
+    simulate_parser.add_argument('--end', required=True, help='Simulate until: [Date]T[Time]')
+    simulate_parser.add_argument('--default_duration', type=float, default=60,
+                                 help='Seconds taken by tasks of routines without a declared or past run time')
+    simulate_parser.add_argument('--ignore_history', action='store_true',
+                                 help='Do not take run times from the state database')
+    simulate_parser.add_argument('--resolution', type=int, default=60, help='Minutes per concurrency profile period')
+    simulate_parser.add_argument('--output', help='Also write the report to this JSON file')
+    simulate_parser.add_argument('--log_level', default='WARNING', help='Log Level')
+    simulate_parser.set_defaults(func=simulate_func)
+
     args = parser.parse_args()
     args.func(args)
@@ -0,0 +1,303 @@
+"""
+Dry runs of a registry.  A TaskManager is driven through simulated time by a VirtualClock, and its tasks are sent to
+a SimulatedExecutor, where each takes its routine's expected duration instead of running.  The clock jumps straight
+from one event (a task falling due, finishing or timing out) to the next, so a day is replayed in seconds.  The result
+is a SimulationReport: the predicted number of tasks running over time, its peak, and the critical path of each day.
+"""
+import os
+import heapq
+import queue
+import logging
+import tempfile
+import statistics
+from datetime import timedelta
+
+from core.clock import VirtualClock
+from core.message import Message
+from core.metrics import Metrics
+from core.state_manager import StateManager
+from task_manager import TaskManager
+
+
+logger = logging.getLogger(__name__)
+
+
+class SimulatedExecutor:
+    """
+    Runs nothing: a submitted task succeeds once its duration has passed on the virtual clock.
+    """
+    def __init__(self, clock, result_queue, durations):
+        """
+        Initialize object.
+        :param VirtualClock clock: The simulation clock
+        :param Queue result_queue: The TaskManager's event queue
+        :param function durations: Returns the run time in seconds of a routine, given its name
+        """
+        self.clock = clock
+        self.result_queue = result_queue
+        self.durations = durations
+        self.finishing = []  # heap of (finish time, qualified name, task)
+        self.runs = {}  # qualified name -> run record, see SimulationReport
+
+    def submit(self, task):
+        start = self.clock.now()
+        end = start + timedelta(seconds=self.durations(task.name))
+        self.runs[task.qualified_name] = {'task': task.qualified_name, 'routine': task.name, 'time': task.time,
+                                          'start': start, 'end': end, 'state': 'Running',
+                                          'dependencies': sorted(task.dependencies)}
+        heapq.heappush(self.finishing, (end, task.qualified_name, task))
+
+    def next_finish(self):
+        """
+        Returns when the next running task finishes, or None if none are running.
+        """
+        while self.finishing and self.runs[self.finishing[0][1]]['state'] != 'Running':
+            heapq.heappop(self.finishing)
+        return self.finishing[0][0] if self.finishing else None
+
+    def finish_due(self):
+        """
+        Report every task whose duration has passed as a Success.
+        """
+        while self.next_finish() is not None and self.finishing[0][0] <= self.clock.now():
+            end, qualified_name, task = heapq.heappop(self.finishing)
+            self.runs[qualified_name]['state'] = 'Success'
+            self.result_queue.put(Message(name=task.name, time=task.time, qualified_name=qualified_name,
+                                          state='Success', time_stamp=end))
+
+    def cancel(self, qualified_name):
+        run = self.runs.get(qualified_name)
+        if run is None or run['state'] != 'Running':
+            return False
+        run['state'], run['end'] = 'Killed', self.clock.now()
+        return True
+
+    def task_finished(self, message):
+        pass
+
+    def reap(self):
+        return []
+
+    def shutdown(self):
+        pass
+
+
+class Simulation:
+    """
+    Replays the scheduling of a registry over a window of time.
+    """
+    def __init__(self, registry, configuration, start, end, durations=None, default_duration=60):
+        """
+        Initialize object.
+        :param Registry registry: The registry to simulate
+        :param ConfigParser configuration: Scheduler configuration, for the concurrency limits
+        :param datetime start: Tasks are scheduled from just after this time
+        :param datetime end: Tasks due after this time are not run
+        :param dict durations: Routine name -> seconds, e.g. past run times.  A routine's declared duration overrides
+                               them.
+        :param float default_duration: Seconds taken by routines with neither a declared nor a given duration
+        """
+        self.registry = registry
+        self.configuration = configuration
+        self.start = start
+        self.end = end
+        self.durations = durations or {}
+        self.default_duration = default_duration
+
+    def duration(self, routine_name):
+        routine = self.registry.routines.get(routine_name)
+        if routine is not None and routine.duration:
+            return routine.duration
+        return self.durations.get(routine_name, self.default_duration)
+
+    def run(self):
+        """
+        Run the simulation.
+        :return: SimulationReport
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            state_manager = StateManager(os.path.join(directory, 'state.db'), write_behind=True)
+            try:
+                return self.replay(state_manager)
+            finally:
+                state_manager.close()
+
+    def replay(self, state_manager):
+        clock = VirtualClock(self.start)
+        events = queue.Queue()
+        executor = SimulatedExecutor(clock, events, self.duration)
+        task_manager = TaskManager(events, state_manager, self.registry, self.configuration, executor=executor,
+                                   metrics=Metrics(enabled=False), clock=clock)
+        for _, routine in self.registry:
+            task_manager.schedule_next_task(routine, self.start)
+
+        samples = [(self.start, 0)]  # (time, number of tasks running from then on)
+        while True:
+            now = clock.now()
+            executor.finish_due()
+            task_manager.supervise(now)
+            reference_time = min(now, self.end)
+            task_manager.run_pending_jobs(reference_time)
+            while task_manager.wait_for_updates(0):
+                task_manager.run_pending_jobs(reference_time)
+            if len(task_manager.running_tasks) != samples[-1][1]:
+                samples.append((now, len(task_manager.running_tasks)))
+
+            # Jump to the next event: a task falling due (within the window), finishing or timing out
+            upcoming = [executor.next_finish()]
+            if len(task_manager.deadlines):
+                upcoming.append(task_manager.deadlines.peek()[0])
+            next_runtime = task_manager.next_runtime()
+            if next_runtime is not None and next_runtime <= self.end:
+                upcoming.append(next_runtime)
+            upcoming = [k for k in upcoming if k is not None]
+            if not upcoming:
+                break
+            clock.advance(min(upcoming))
+        logger.info('Simulated %s tasks', len(executor.runs))
+        return SimulationReport(self.start, self.end, samples, list(executor.runs.values()))
+
+
+class SimulationReport:
+    """
+    The predicted concurrency profile and critical paths of a simulation.
+
+    Each run is a dict of 'task' (qualified name), 'routine', 'time' (task time), 'start', 'end', 'state' ('Success',
+    or 'Killed' on timeout) and 'dependencies' (qualified names).
+    """
+    def __init__(self, start, end, samples, runs):
+        """
+        Initialize object.
+        :param datetime start: Simulation start
+        :param datetime end: Simulation end
+        :param list samples: (time, number of tasks running from then on), in time order
+        :param list runs: Run records, in dispatch order
+        """
+        self.start = start
+        self.end = end
+        self.samples = samples
+        self.runs = runs
+
+    def peak(self):
+        """
+        Returns (most tasks running at once, when first reached).
+        """
+        peak_time, peak = self.samples[0]
+        for moment, running in self.samples:
+            if running > peak:
+                peak_time, peak = moment, running
+        return peak, peak_time
+
+    def profile(self, resolution=timedelta(hours=1)):
+        """
+        Summarise concurrency per period.
+        :param timedelta resolution: Period length
+        :return: list of (period start, peak running, average running, tasks started)
+        """
+        last_moment = max([self.end] + [run['end'] for run in self.runs])
+        periods = []
+        period_start = self.start
+        while period_start < last_moment:
+            periods.append([period_start, 0, 0.0, 0])
+            period_start += resolution
+        # Walk the step function of running tasks, spreading each step over the periods it covers
+        steps = self.samples + [(last_moment, 0)]
+        for (moment, running), (next_moment, _) in zip(steps, steps[1:]):
+            index = int((moment - self.start) / resolution)
+            while moment < next_moment and index < len(periods):
+                period_end = min(next_moment, periods[index][0] + resolution)
+                periods[index][1] = max(periods[index][1], running)
+                periods[index][2] += running * (period_end - moment) / resolution
+                moment = period_end
+                index += 1
+        for run in self.runs:
+            periods[min(len(periods) - 1, int((run['start'] - self.start) / resolution))][3] += 1
+        return [tuple(k) for k in periods]
+
+    def critical_paths(self):
+        """
+        For each day, the longest chain of dependent runs, from the start of its first run to the end of its last.
+        A run's chain goes back through the dependency that finished last before it started (the one that released
+        it), and so on.  Chains are assigned to the day of their last run's task time.
+        :return: list of (date, list of runs, earliest first)
+        """
+        runs = {run['task']: run for run in self.runs}
+        releasing = {}  # qualified name -> run of the dependency that released it
+        for run in self.runs:
+            finished = [runs[k] for k in run['dependencies'] if k in runs and runs[k]['end'] <= run['start']]
+            if finished:
+                releasing[run['task']] = max(finished, key=lambda k: k['end'])
+        # Runs are in dispatch order, so a run's releasing dependency always comes before it
+        first = {}  # qualified name -> first run of its chain
+        longest = {}  # date -> last run of the day's longest chain
+        for run in self.runs:
+            previous = releasing.get(run['task'])
+            first[run['task']] = first[previous['task']] if previous else run
+            day = run['time'].date()
+            best = longest.get(day)
+            if best is None or run['end'] - first[run['task']]['start'] > best['end'] - first[best['task']]['start']:
+                longest[day] = run
+        paths = []
+        for day, run in sorted(longest.items()):
+            path = [run]
+            while path[-1]['task'] in releasing:
+                path.append(releasing[path[-1]['task']])
+            paths.append((day, path[::-1]))
+        return paths
+
+    def as_dict(self, resolution=timedelta(hours=1)):
+        """
+        Returns the report as JSON-serialisable data.
+        """
+        def iso(moment):
+            return moment.isoformat()
+
+        peak, peak_time = self.peak()
+        return {
+            'start': iso(self.start),
+            'end': iso(self.end),
+            'tasks': len(self.runs),
+            'peak_running': peak,
+            'peak_time': iso(peak_time),
+            'profile': [{'period': iso(period), 'peak': peak, 'average': average, 'started': started}
+                        for period, peak, average, started in self.profile(resolution)],
+            'critical_paths': [{'date': day.isoformat(),
+                                'start': iso(path[0]['start']),
+                                'end': iso(path[-1]['end']),
+                                'tasks': [dict(run, time=iso(run['time']), start=iso(run['start']),
+                                               end=iso(run['end'])) for run in path]}
+                               for day, path in self.critical_paths()],
+        }
+
+    def format(self, resolution=timedelta(hours=1)):
+        """
+        Returns the report as text.
+        """
+        peak, peak_time = self.peak()
+        lines = ['Simulated {} to {}: {} tasks run'.format(self.start.isoformat(), self.end.isoformat(),
+                                                           len(self.runs)),
+                 'Peak concurrency: {} tasks at {}'.format(peak, peak_time.isoformat()),
+                 '',
+                 'Concurrency profile (per {})'.format(resolution),
+                 '{:<22}{:>8}{:>10}{:>10}'.format('period', 'peak', 'average', 'started')]
+        for period, period_peak, average, started in self.profile(resolution):
+            lines.append('{:<22}{:>8}{:>10.2f}{:>10}'.format(period.isoformat(), period_peak, average, started))
+        for day, path in self.critical_paths():
+            lines += ['', 'Critical path {}: {} tasks, {} to {} ({})'.format(
+                day.isoformat(), len(path), path[0]['start'].isoformat(), path[-1]['end'].isoformat(),
+                path[-1]['end'] - path[0]['start'])]
+            lines += ['    {:<40}{}  {}'.format(run['task'], run['start'].time().isoformat(),
+                                                run['end'].time().isoformat()) for run in path]
+        killed = sum(run['state'] == 'Killed' for run in self.runs)
+        if killed:
+            lines += ['', '{} tasks would be killed by their routine\'s timeout'.format(killed)]
+        return '\n'.join(lines)
+
+
+def historical_durations(state_reader):
+    """
+    Median past run time of each routine, from a state database.
+    :param StateReader state_reader: Reader of the state database
+    :return: dict of routine name -> seconds
+    """
+    return {routine: statistics.median(seconds) for routine, seconds in state_reader.run_durations().items()}
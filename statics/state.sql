@@ -1,7 +1,24 @@
+-- Lets space freed by archiving old history be returned to the file system (only applies to new databases)
+PRAGMA auto_vacuum = INCREMENTAL;
 DROP TABLE IF EXISTS state;
 CREATE TABLE state (
     routine VARCHAR(250),
     instance TIMESTAMP,
     state VARCHAR(250),
     state_time_stamp TIMESTAMP
-);
\ No newline at end of file
+);
+CREATE INDEX state_task_history ON state (routine, instance, state_time_stamp, state);
+-- Archived history by instance, where the archiver looks for expired tasks (see core/retention.py)
+CREATE INDEX state_archived_instance ON state (instance, routine) WHERE state = 'Archived';
+
+-- Latest state of every task that has not been Archived, maintained alongside each insert into state
+DROP TABLE IF EXISTS current_state;
+CREATE TABLE current_state (
+    routine VARCHAR(250),
+    instance TIMESTAMP,
+    state VARCHAR(250),
+    state_time_stamp TIMESTAMP,
+    PRIMARY KEY (routine, instance)
+);
+
+PRAGMA user_version = 2;
@@ -1,86 +1,259 @@
 # Standard library imports
 import time
-import bisect
+import queue
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
+from collections import Counter, deque
 
 # Internal imports
 import config
 from core.task import Task
-from core.message import Message
+from core.message import Message, Request
+from core.registry import Registry
+from core.backfill import Backfill
+from core.clock import SystemClock
+from core.metrics import Metrics, LAG_BUCKETS, DURATION_BUCKETS, SIZE_BUCKETS
+from core.dependency_graph import DependencyGraph
+from core.executor import create_executor
+from core.task_queue import IndexedHeap, TaskQueue
 
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on how long the main loop blocks waiting for events, so that clock adjustments are noticed.
+MAX_WAIT_SECONDS = 60
+# While tasks are running, how often to look for task processes that died without reporting a result.
+REAP_INTERVAL_SECONDS = 1
+# How many finished backfills are still reported by backfill_status.
+FINISHED_BACKFILLS = 10
+
 
 class TaskManager:
-    def __init__(self, event_queue, state_manager, registry, config):
+    def __init__(self, event_queue, state_manager, registry, config, executor=None, responder=None, log_writer=None,
+                 metrics=None, clock=None):
         self.registry = registry
+        self.clock = clock or SystemClock()  # every reading of the current time goes through the clock
+        self.responder = responder  # called with (request id, response) to answer control server requests
         self.event_queue = event_queue
         self.state_manager = state_manager
         self.config = config
+        self.log_writer = log_writer  # LogWriter task logs are sent to, None for a log file per task
+        self.executor = executor or create_executor(config, event_queue, log_writer.queue if log_writer else None)
         self.running_tasks = []
         self.scheduled_tasks_dict = {}
-        self.scheduled_tasks_list = []
-        self.task_dependencies = {}
+        self.scheduled_tasks_queue = TaskQueue()
+        self.task_dependencies = DependencyGraph()
+        self.routine_tasks = {}  # routine name -> qualified names of its tasks in scheduled_tasks_dict
         self.keep_running = True
+        # Concurrency limits.  Ready tasks beyond the limits wait in the dispatch queue, ordered by task time.
+        self.max_running = self.config.getint('DEFAULT', 'max_running', fallback=0)  # 0 means no limit
+        self.running_per_routine = Counter()
+        self.deadlines = IndexedHeap()  # running tasks of routines with a timeout, by when they must have finished
+        self.dispatch_queue = IndexedHeap()
+        # Catch-up on resume: cap on missed runs per routine, and on catch-up tasks running at once (0 for no cap).
+        # Queued catch-up tasks wait in a queue of their own, released only after queued live tasks.
+        self.catchup_max_instances = self.config.getint('DEFAULT', 'catchup_max_instances', fallback=1000)
+        self.catchup_max_running = self.config.getint('DEFAULT', 'catchup_max_running', fallback=4)
+        self.running_catchup = set()
+        self.catchup_queue = IndexedHeap()
+        # Backfills: tasks generated lazily over a window of past times, at most backfill_max_running at once (per
+        # backfill) and backfill_window created but unfinished.  Due backfill tasks are dispatched after due live tasks
+        # (see TaskQueue), and queued ones released after all others.
+        self.backfill_max_running = self.config.getint('DEFAULT', 'backfill_max_running', fallback=2)
+        self.backfill_window = self.config.getint('DEFAULT', 'backfill_window', fallback=100)
+        self.backfills = {}  # name -> Backfill
+        self.finished_backfills = deque(maxlen=FINISHED_BACKFILLS)  # most recent last, for backfill_status
+        self.backfill_count = 0
+        self.backfill_queue = IndexedHeap()
+        self.metrics = metrics or Metrics(self.config.getboolean('DEFAULT', 'metrics', fallback=True))
+        self.register_metrics()
+        self.run_started = {}  # qualified name -> time.perf_counter() when dispatched, for run durations
 
     def launch(self, resume):
+        now = self.clock.now()
         if resume:
             last_shutdown = self.config.get('DEFAULT', 'last_shutdown')
-            reference_time = datetime.strptime(last_shutdown, config.dt_format_str)
-            logger.info('Resuming as of last shutdown: %s', last_shutdown)
+            if last_shutdown:
+                logger.info('Resuming as of last shutdown: %s', last_shutdown)
+                self.catch_up(datetime.strptime(last_shutdown, config.dt_format_str), now)
+            else:
+                logger.warning('No last shutdown recorded, nothing to catch up')
         else:
             self.config['DEFAULT']['last_shutdown'] = ''
-            reference_time = datetime.today()
         logger.info('Scheduling All Jobs')
-        if resume:
-            # Retrieve previously scheduled tasks
-            last_instance = {}
-            for row in self.state_manager.get_current_status():
-                routine, instance, state, state_time_stamp = row
-                if state in ['READY', 'WAITING']:
-                    last_instance[routine] = instance
         for name, routine in self.registry:
-            if resume:
-                resume_instance = last_instance.get(name)
-                if resume_instance:
-                    self.schedule_next_task(routine, resume_instance)
-                    continue
-            self.schedule_next_task(routine, reference_time)
+            self.schedule_next_task(routine, now)
         self.main_loop()
 
+    def catch_up(self, last_shutdown, now):
+        """
+        Recreate the tasks that were pending at shutdown and the runs that were missed while the scheduler was down,
+        as allowed by each routine's catchup policy ('all', 'latest' or 'none'), recording them in one transaction.
+        Missed runs are flagged as catch-up tasks, of which at most catchup_max_running run at once.
+        :param datetime last_shutdown: When the scheduler was stopped
+        :param datetime now: The current time
+        """
+        pending = {}  # routine name -> instances left Ready, Waiting or Queued at shutdown
+        for routine_name, instance, state, _ in self.state_manager.get_current_status():
+            if state in ['Ready', 'Waiting', 'Queued']:
+                pending.setdefault(routine_name, []).append(instance)
+
+        tasks = []
+        updates = []
+        for name, routine in self.registry:
+            previous = pending.pop(name, [])
+            missed = set(routine.missed_triggers(last_shutdown, now, self.catchup_max_instances))
+            missed.update(k for k in previous if k <= now)
+            missed = sorted(missed)
+            if routine.catchup == 'none':
+                missed = []
+            elif routine.catchup == 'latest':
+                missed = missed[-1:]
+            else:
+                missed = missed[-self.catchup_max_instances:]
+            for instance in previous:
+                if instance <= now and instance not in missed:
+                    updates += [(name, instance, 'Cancelled'), (name, instance, 'Archived')]
+            for instance in missed + [k for k in previous if k > now]:
+                task = routine.task_at(instance, self.event_queue)
+                task.catchup = instance <= now
+                if task.qualified_name not in self.scheduled_tasks_dict:
+                    self.scheduled_tasks_dict[task.qualified_name] = task
+                    self.routine_tasks.setdefault(name, set()).add(task.qualified_name)
+                    tasks.append(task)
+                    updates.append((task.name, task.time, task.state))
+        for name, instances in pending.items():
+            logger.info('Routine %s is no longer in the registry, cancelling %s pending tasks', name, len(instances))
+            for instance in instances:
+                updates += [(name, instance, 'Cancelled'), (name, instance, 'Archived')]
+        self.state_manager.update_many(updates)
+
+        # Every task is in place before any registers its dependencies, so catch-up tasks can depend on each other
+        for task in tasks:
+            self.register_dependencies(task, now)
+            self.scheduled_tasks_queue.update(task)
+        logger.info('Catching up %s tasks missed since %s', sum(task.catchup for task in tasks), last_shutdown)
+
     def schedule_next_task(self, routine, reference_time):
         task = routine.next_task(reference_time, self.event_queue)
         logger.info('Scheduling Next: %s', task.qualified_name)
         if task.qualified_name in self.scheduled_tasks_dict.keys():
             logger.info('Already scheduled, skipping: %s', task.qualified_name)
             return
+        self.add_task(task, reference_time)
+
+    def add_task(self, task, reference_time, updates=None):
+        """
+        Start tracking a new task.  Its state is recorded right away, or appended to updates to be recorded by the
+        caller in one transaction.
+        """
         self.scheduled_tasks_dict[task.qualified_name] = task
-        bisect.insort(self.scheduled_tasks_list, task)
-        self.state_manager.update(task.name, task.time, task.state)
+        self.routine_tasks.setdefault(task.name, set()).add(task.qualified_name)
+        if updates is None:
+            self.state_manager.update(task.name, task.time, task.state)
+        else:
+            updates.append((task.name, task.time, task.state))
         self.register_dependencies(task, reference_time)
+        self.scheduled_tasks_queue.update(task)
+
+    def schedule_next_instance(self, routine_name, reference_time):
+        # The routine may have been removed by a registry reload while its task was queued or running
+        routine = self.registry.routines.get(routine_name)
+        if routine is not None:
+            self.schedule_next_task(routine, reference_time)
+
+    def start_backfill(self, routine_name, start, end, max_running=None):
+        """
+        Rerun a routine, and every routine downstream of it, for each of its triggers in [start, end].  Tasks are
+        created lazily, upstream instances before the instances that depend on them, and run at a lower priority than
+        live and catch-up work.
+        :param str routine_name: The routine to backfill
+        :param datetime start: Earliest task time (inclusive)
+        :param datetime end: Latest task time (inclusive)
+        :param int max_running: Most backfill tasks running at once (default: backfill_max_running)
+        :return: The Backfill
+        """
+        self.backfill_count += 1
+        backfill = Backfill('backfill-{}'.format(self.backfill_count), self.registry, routine_name, start, end,
+                            max_running or self.backfill_max_running, self.backfill_window)
+        self.backfills[backfill.name] = backfill
+        logger.info('Starting %s: %s (%s)', backfill.name, backfill.progress(), ', '.join(backfill.routines))
+        self.fill_backfill(backfill)
+        return backfill
+
+    def fill_backfill(self, backfill):
+        """
+        Create the backfill's next tasks, until backfill.window of them are outstanding or the window is exhausted.
+        """
+        now = self.clock.now()
+        while len(backfill.outstanding) < backfill.window:
+            instance = backfill.next_instance()
+            if instance is None:
+                break
+            routine = self.registry.routines.get(instance[0])
+            if routine is None:
+                continue
+            task = routine.task_at(instance[1], self.event_queue)
+            if task.qualified_name in self.scheduled_tasks_dict:
+                logger.info('%s: already scheduled, skipping %s', backfill.name, task.qualified_name)
+                backfill.counts['skipped'] += 1
+                continue
+            task.backfill = backfill.name
+            backfill.outstanding.add(task.qualified_name)
+            backfill.counts['created'] += 1
+            self.add_task(task, now)
+            # Do not wait on an upstream instance that already failed or was cancelled
+            if task.state == 'Waiting' and any(k in ['Failure', 'Cancelled'] for k in task.dependencies.values()):
+                task.update_state('Cancelled')
+        if backfill.done():
+            logger.info('Finished %s: %s', backfill.name, backfill.progress())
+            del self.backfills[backfill.name]
+            self.finished_backfills.append(backfill)
+
+    def backfill_finished(self, task, state):
+        backfill = self.backfills.get(task.backfill)
+        if backfill is None or task.qualified_name not in backfill.outstanding:
+            return
+        backfill.finished(task.qualified_name, state)
+        logger.info('%s: %s', backfill.name, backfill.progress())
+        self.fill_backfill(backfill)
+
+    def missing_dependency(self, task, reference_time):
+        """
+        Returns the first upstream task of task that is neither scheduled nor recorded, and is not due after
+        reference_time, so will never run; None if there is none.
+        """
+        for dependency in task.dependencies:
+            if dependency in self.scheduled_tasks_dict or dependency in self.task_dependencies:
+                continue
+            routine, instance = dependency.split('.')
+            instance = datetime.strptime(instance, config.dt_format_str)
+            if instance <= reference_time and self.state_manager.last_result(routine, instance) is None:
+                return dependency
+        return None
 
     def register_dependencies(self, task, reference_time):
         cancel = False
         for dependency in task.dependencies:
-            if dependency in self.task_dependencies:
-                self.task_dependencies[dependency].append(task.qualified_name)
+            if dependency in self.scheduled_tasks_dict:
+                # Scheduled dependency, follow its state changes
+                self.task_dependencies.add(dependency, task.qualified_name)
                 task.update_dependency_state(dependency, self.scheduled_tasks_dict[dependency].state)
+            elif dependency in self.task_dependencies:
+                # Future dependency that is not scheduled yet
+                self.task_dependencies.add(dependency, task.qualified_name)
             else:
                 routine, instance = dependency.split('.')
                 instance = datetime.strptime(instance, config.dt_format_str)
                 # Check for some record of the dependency
-                task_records = self.state_manager.task_result(routine, instance)
-                last_result = task_records.fetchone()
-                if last_result is not None:
-                    _, _, last_state, _ = last_result
+                last_state = self.state_manager.last_result(routine, instance)
+                if last_state is not None:
                     task.update_dependency_state(dependency, last_state)
                 else:
                     # Assume that if the dependency is meant to run in the future that it
                     # will be initialized at some point in the future.
                     if instance > reference_time:
-                        self.task_dependencies[dependency] = [task.qualified_name]
+                        self.task_dependencies.add(dependency, task.qualified_name)
                     else:
                         # The predecessor task will never run.  It didn't run in the past. And won't run
                         # in the future.  So what should happen? Should the downstream jobs run anyway or
@@ -93,122 +266,506 @@ class TaskManager:
             task.update_state('Cancelled')
 
     def main_loop(self):
-        overdue = True
-        reference_time = datetime.today()
         while self.keep_running:
-            logger.debug('Start new of loop')
-            while overdue and self.keep_running:
-
-                self.run_pending_jobs(reference_time)
-                self.wait_for_updates()
-
-                reference_time = datetime.today()
-                if self.next_runtime() > reference_time:
-                    logger.info('No tasks until: %s', self.next_runtime().strftime(config.dt_format_str))
-                    overdue = False
-            while not overdue and self.keep_running:
-                # We need to check for updates since user instructions may still be sent at any time.
-                # But that is infrequent so, we don't have to check constantly.
-                # Therefore, we add a little buffer time in between checks. The bigger the buffer,
-                # the lower the cycle usage, but the longer the potential lag when user input is sent.
-                sleep_time = min(5, (self.next_runtime() - reference_time).total_seconds())
-                time.sleep(sleep_time)
-                self.wait_for_updates()
-
-                reference_time = datetime.today()
-                if self.next_runtime() <= reference_time:
-                    logger.info('New tasks need to be run.')
-                    overdue = True
+            reference_time = self.clock.now()
+            self.run_pending_jobs(reference_time)
+
+            # Block until either an event arrives or the next task is due, whichever comes first.
+            next_runtime = self.next_runtime()
+            if next_runtime is None:
+                timeout = MAX_WAIT_SECONDS
+            else:
+                timeout = min(MAX_WAIT_SECONDS, max(0, (next_runtime - self.clock.now()).total_seconds()))
+                if timeout > 0:
+                    logger.debug('No tasks until: %s', next_runtime.strftime(config.dt_format_str))
+            if self.running_tasks:
+                timeout = min(timeout, REAP_INTERVAL_SECONDS)
+            if len(self.deadlines):
+                timeout = min(timeout, max(0, (self.deadlines.peek()[0] - self.clock.now()).total_seconds()))
+            self.wait_for_updates(timeout)
+            self.supervise(self.clock.now())
+
+    def supervise(self, now):
+        """
+        Record as failed, and so free the slots of, tasks whose process died without reporting a result, and kill
+        tasks that have run past their routine's timeout.
+        :param datetime now: The current time
+        """
+        for qualified_name, exitcode in self.executor.reap():
+            if qualified_name in self.running_tasks:
+                self.fail_task(qualified_name,
+                               'process exited with code {} without reporting a result'.format(exitcode))
+        while len(self.deadlines) and self.deadlines.peek()[0] <= now:
+            qualified_name = self.deadlines.pop()[1]
+            task = self.scheduled_tasks_dict.get(qualified_name)
+            if task is None:
+                continue
+            self.executor.cancel(qualified_name)
+            self.fail_task(qualified_name, 'timed out after {:g} seconds, killed'.format(task.timeout))
+
+    def fail_task(self, qualified_name, reason):
+        """
+        Record a running task as failed on its behalf, noting the reason in its log.  A task the scheduler no longer
+        holds only has its running slot freed.
+        """
+        task = self.scheduled_tasks_dict.get(qualified_name)
+        if task is None:
+            logger.warning('Dropped task %s %s', qualified_name, reason)
+            name, instance = qualified_name.split('.')
+            self.process_message(Message(name=name, time=datetime.strptime(instance, config.dt_format_str),
+                                         qualified_name=qualified_name, state='Failure', time_stamp=self.clock.now(),
+                                         reason=reason))
+            return
+        logger.error('Failure: %s %s', qualified_name, reason)
+        line = '{} | {} | ERROR | {}'.format(self.clock.now().strftime(config.dt_format_str), __name__, reason)
+        if self.log_writer is not None:
+            self.log_writer.write(qualified_name, line)
+            self.log_writer.write(qualified_name, None)
+        elif task.log:
+            try:
+                with open(task.log, 'a') as log:
+                    log.write(line + '\n')
+            except OSError:
+                pass
+        task.state = 'Failure'
+        self.process_message(Message(name=task.name, time=task.time, qualified_name=qualified_name, state='Failure',
+                                     time_stamp=self.clock.now(), reason=reason))
 
     def run_pending_jobs(self, reference_time):
-        next_runtime = self.next_runtime()
-        if next_runtime <= reference_time:
-            for task in self.scheduled_tasks_list:
-                if task.time <= reference_time:
-                    if task.state == 'Ready':
-                        self.run_task(task)
-                        self.run_pending_jobs(reference_time)
-                else: # The list is ordered
-                    break
-
-    def run_task(self, task):
+        start = time.perf_counter()
+        task = self.scheduled_tasks_queue.next_due(reference_time)
+        while task is not None:
+            self.dispatch(task)
+            task = self.scheduled_tasks_queue.next_due(reference_time)
+        self.run_pending_seconds.observe(time.perf_counter() - start)
+
+    def at_capacity(self, catchup=False):
+        if self.max_running and len(self.running_tasks) >= self.max_running:
+            return True
+        return catchup and self.catchup_max_running and len(self.running_catchup) >= self.catchup_max_running
+
+    def has_capacity(self, task):
+        if self.at_capacity(task.catchup):
+            return False
+        if task.backfill is not None:
+            backfill = self.backfills.get(task.backfill)
+            if backfill is not None and len(backfill.running) >= backfill.max_running:
+                return False
+        routine = self.registry.routines.get(task.name)
+        routine_limit = routine.max_running if routine else None
+        if routine_limit and self.running_per_routine[task.name] >= routine_limit:
+            return False
+        return True
+
+    def dispatch(self, task):
+        """
+        Run a task if the concurrency limits allow it, otherwise queue it until a running task finishes.
+        """
+        if self.has_capacity(task):
+            self.run_task(task, schedule_next=not (task.catchup or task.backfill))
+        else:
+            logger.info('Queueing: %s', task.qualified_name)
+            task.update_state('Queued')
+            self.scheduled_tasks_queue.update(task)
+            if task.backfill:
+                self.backfill_queue.push(task.qualified_name, (task.time, task.qualified_name))
+            elif task.catchup:
+                self.catchup_queue.push(task.qualified_name, (task.time, task.qualified_name))
+            else:
+                self.dispatch_queue.push(task.qualified_name, (task.time, task.qualified_name))
+                self.schedule_next_instance(task.name, task.time)
+
+    def release_queued_tasks(self):
+        """
+        Run queued tasks, earliest first, for as long as the concurrency limits allow: live tasks, then catch-up tasks,
+        then backfill tasks.  Tasks held back only by their routine (or backfill) limit are skipped so they do not
+        block other routines.
+        """
+        for waiting, catchup in [(self.dispatch_queue, False), (self.catchup_queue, True),
+                                 (self.backfill_queue, False)]:
+            held_back = []
+            while len(waiting) and not self.at_capacity(catchup):
+                priority, qualified_name = waiting.pop()
+                task = self.scheduled_tasks_dict[qualified_name]
+                if self.has_capacity(task):
+                    self.run_task(task, schedule_next=False)
+                else:
+                    held_back.append((qualified_name, priority))
+            for qualified_name, priority in held_back:
+                waiting.push(qualified_name, priority)
+
+    def run_task(self, task, schedule_next=True):
         logger.info('Running: %s', task.qualified_name)
+        self.record_dispatch_lag(task)
         self.running_tasks.append(task.qualified_name)
+        self.running_per_routine[task.name] += 1
+        if task.catchup:
+            self.running_catchup.add(task.qualified_name)
+        if task.backfill in self.backfills:
+            self.backfills[task.backfill].running.add(task.qualified_name)
+        routine = self.registry.routines.get(task.name)
+        task.timeout = routine.timeout if routine else None
+        if task.timeout:
+            self.deadlines.push(task.qualified_name, self.clock.now() + timedelta(seconds=task.timeout))
+        if self.metrics.enabled:
+            self.run_started[task.qualified_name] = time.perf_counter()
         task.update_state('Running')
-        task.start()
-        self.schedule_next_task(self.registry.get_routine(task.name), task.time)
+        self.scheduled_tasks_queue.update(task)
+        self.executor.submit(task)
+        if schedule_next:
+            self.schedule_next_instance(task.name, task.time)
+
+    def wait_for_updates(self, timeout=None):
+        """
+        Block for up to timeout seconds (forever if None) until an event arrives, then process it together with every
+        other event already waiting in the queue.
 
-    def wait_for_updates(self):
-        if not self.event_queue.empty():
-            event = self.event_queue.get()
-            if isinstance(event, Message):
+        Returns: number of events processed
+        """
+        start = time.perf_counter()
+        try:
+            events = [self.event_queue.get(timeout=timeout)]
+        except queue.Empty:
+            self.wait_seconds.observe(time.perf_counter() - start)
+            return 0
+        while True:
+            try:
+                events.append(self.event_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        self.event_batch_size.observe(len(events))
+        for event in events:
+            if isinstance(event, Request):
+                self.process_request(event)
+            elif isinstance(event, Message):
                 self.process_message(event)
             else:
-                self.process_user_input(event)
+                logger.warning('Ignoring unknown event: %r', event)
+        self.wait_seconds.observe(time.perf_counter() - start)
+        return len(events)
 
     def process_message(self, message):
+        if message.qualified_name not in self.scheduled_tasks_dict or \
+                (message.state in ['Success', 'Failure'] and message.qualified_name not in self.running_tasks):
+            # Sent by (or for) a task that has since been cancelled or dropped
+            logger.info('Ignoring late message from %s: %s', message.qualified_name, message.state)
+            if message.state in ['Success', 'Failure'] and message.qualified_name in self.running_tasks:
+                # Dropped while running, its slot is still to be freed
+                self.finish_run(message)
+                self.release_queued_tasks()
+            return
         self.state_manager.update(message.name, message.time, message.state)
-        if message.qualified_name in self.task_dependencies:
-            for down_stream_task_name in self.task_dependencies[message.qualified_name]:
-                self.scheduled_tasks_dict[down_stream_task_name].update_dependency_state(message.qualified_name, message.state)
+        task = self.scheduled_tasks_dict.get(message.qualified_name)
+        for down_stream_task_name in self.task_dependencies.dependants_of(message.qualified_name):
+            down_stream_task = self.scheduled_tasks_dict[down_stream_task_name]
+            down_stream_task.update_dependency_state(message.qualified_name, message.state)
+            if down_stream_task.backfill and down_stream_task.state == 'Waiting' and \
+                    message.state in ['Failure', 'Cancelled']:
+                # A backfill does not wait for reruns of failed instances, cancel (and so free) what depends on them
+                down_stream_task.update_state('Cancelled')
+            self.scheduled_tasks_queue.update(down_stream_task)
         if message.state in ['Success', 'Failure']:
-            self.running_tasks.pop(self.running_tasks.index(message.qualified_name))
+            self.finish_run(message)
         if message.state in ['Success', 'Cancelled']:
-            if message.state == 'Cancelled':
-                self.schedule_next_task(self.registry.get_routine(message.name), message.time)
+            if message.state == 'Cancelled' and not (task and task.backfill):
+                self.schedule_next_instance(message.name, message.time)
             self.remove_task(message.qualified_name)
+        if message.state in ['Success', 'Failure']:
+            self.release_queued_tasks()
+        if task and task.backfill and message.state in ['Success', 'Failure', 'Cancelled']:
+            self.backfill_finished(task, message.state)
 
-    def process_user_input(self, instruction):
-        if instruction == 'stop':
-            self.shutdown()
+    def finish_run(self, message):
+        """
+        Free the running slot of a task that has reported (or been recorded) a Success or Failure.
+        """
+        self.running_tasks.remove(message.qualified_name)
+        self.running_per_routine[message.name] -= 1
+        self.running_catchup.discard(message.qualified_name)
+        self.deadlines.remove(message.qualified_name)
+        self.executor.task_finished(message)
+        self.record_run(message.qualified_name, message.name, message.state)
+
+    def process_request(self, request):
+        """
+        Carry out a control server request and pass the response to the responder.  Requests that fail are answered
+        with the error rather than stopping the scheduler.
+        """
+        handlers = {
+            'status': self.task_status,
+            'execute': self.execute_task,
+            'cancel': self.cancel_task,
+            'backfill': self.backfill_request,
+            'backfill_status': self.backfill_status,
+            'reload': self.reload_registry,
+            'stop': self.shutdown,
+        }
+        try:
+            if request.command not in handlers:
+                raise Exception('Unknown command: {}'.format(request.command))
+            response = {'ok': True, 'result': handlers[request.command](**request.arguments)}
+        except Exception as e:
+            logger.exception('Request failed: %s %s', request.command, request.arguments)
+            response = {'ok': False, 'error': str(e) or type(e).__name__}
+        if self.responder is not None:
+            self.responder(request.request_id, response)
+
+    def task_status(self, routine_name=None):
+        """
+        Returns [routine, instance, state] of every task the scheduler holds, optionally for one routine only.
+        """
+        if routine_name is None:
+            tasks = self.scheduled_tasks_dict.values()
         else:
-            # Assume then, that this is an execute instruction and the argument is a qualified task name.
-            logger.info('* Received Execute Instruction: %s', instruction)
-            # TODO: What if the task doesn't exist here?
-            task = self.scheduled_tasks_dict[instruction]
-            if not task.state in ['Ready', 'Waiting']:
-                # Task has been run and will need to be reset
-                task = self.reset_task(task)
-            self.run_task(task)
+            tasks = [self.scheduled_tasks_dict[k] for k in self.routine_tasks.get(routine_name, ())]
+        return [[task.name, task.time.strftime(config.dt_format_str), task.state]
+                for task in sorted(tasks, key=lambda k: (k.name, k.time))]
+
+    def execute_task(self, task_name):
+        """
+        Run a task now, resetting it first if it has already run.  A task the scheduler no longer holds is re-created
+        from its routine.
+        :param str task_name: Task qualified name
+        :return: The task state
+        """
+        logger.info('* Received Execute Instruction: %s', task_name)
+        task = self.scheduled_tasks_dict.get(task_name)
+        if task is None:
+            routine_name, instance = task_name.split('.')
+            routine = self.registry.routines.get(routine_name)
+            if routine is None:
+                raise Exception('Unknown routine: {}'.format(routine_name))
+            task = routine.task_at(datetime.strptime(instance, config.dt_format_str), self.event_queue)
+            now = self.clock.now()
+            missing = self.missing_dependency(task, now)
+            if missing is not None:
+                # It would only be cancelled (see register_dependencies), so is not created at all
+                raise Exception('Cannot execute {}, upstream task {} has no record'.format(task_name, missing))
+            self.add_task(task, now)
+        elif task.state == 'Running':
+            raise Exception('{} is already running'.format(task_name))
+        elif task.state == 'Cancelled':
+            raise Exception('{} has been cancelled'.format(task_name))
+        elif not task.state in ['Ready', 'Waiting']:
+            # Task has been run (or is queued) and will need to be reset
+            task = self.reset_task(task)
+        self.dispatch(task)
+        return task.state
+
+    def cancel_task(self, task_name):
+        """
+        Cancel a task and every task downstream of it, killing any that are running.  The whole subtree is found in
+        one pass over the dependency graph, recorded Cancelled (and Archived) in a single transaction and dropped
+        without going through the event queue.
+        :param str task_name: Task qualified name
+        :return: Number of tasks cancelled
+        """
+        logger.info('* Received Cancel Instruction: %s', task_name)
+        if task_name not in self.scheduled_tasks_dict:
+            raise Exception('Unknown task: {}'.format(task_name))
+        subtree = [task_name]
+        seen = {task_name}
+        for qualified_name in subtree:
+            for dependant in self.task_dependencies.dependants_of(qualified_name):
+                if dependant not in seen:
+                    seen.add(dependant)
+                    subtree.append(dependant)
+        tasks = [self.scheduled_tasks_dict[k] for k in subtree
+                 if self.scheduled_tasks_dict[k].state in ['Ready', 'Waiting', 'Queued', 'Running', 'Failure']]
+
+        updates = []
+        for task in tasks:
+            if task.state == 'Running':
+                self.executor.cancel(task.qualified_name)
+                self.running_tasks.remove(task.qualified_name)
+                self.running_per_routine[task.name] -= 1
+                self.running_catchup.discard(task.qualified_name)
+                self.deadlines.remove(task.qualified_name)
+                self.record_run(task.qualified_name, task.name, 'Cancelled')
+            for waiting in [self.dispatch_queue, self.catchup_queue, self.backfill_queue]:
+                waiting.remove(task.qualified_name)
+            task.state = 'Cancelled'
+            updates += [(task.name, task.time, 'Cancelled'), (task.name, task.time, 'Archived')]
+        self.state_manager.update_many(updates)
+
+        # Drop them from memory, then replace the next live instance of each routine if it was among them
+        next_instance = {}
+        for task in tasks:
+            self.task_dependencies.remove(task.qualified_name)
+            self.scheduled_tasks_queue.remove(task.qualified_name)
+            self.routine_tasks[task.name].discard(task.qualified_name)
+            del self.scheduled_tasks_dict[task.qualified_name]
+            if not (task.catchup or task.backfill):
+                next_instance[task.name] = max(task.time, next_instance.get(task.name, task.time))
+        updates = []
+        for name in self.registry.topological_order({k for k in next_instance if k in self.registry.routines}):
+            task = self.registry.get_routine(name).next_task(next_instance[name], self.event_queue)
+            if task.qualified_name not in self.scheduled_tasks_dict:
+                self.add_task(task, next_instance[name], updates)
+        self.state_manager.update_many(updates)
+        for task in tasks:
+            if task.backfill:
+                self.backfill_finished(task, 'Cancelled')
+        logger.info('Cancelled %s and %s downstream tasks', task_name, max(0, len(tasks) - 1))
+        self.release_queued_tasks()
+        return len(tasks)
+
+    def backfill_request(self, routine, start, end, max_running=None):
+        """
+        Start a backfill (see start_backfill) from text arguments.
+        :return: The backfill's name and progress
+        """
+        logger.info('* Received Backfill Instruction: %s %s %s', routine, start, end)
+        backfill = self.start_backfill(routine, datetime.strptime(start, config.dt_format_str),
+                                       datetime.strptime(end, config.dt_format_str),
+                                       int(max_running) if max_running else None)
+        return {'name': backfill.name, 'progress': backfill.progress()}
+
+    def backfill_status(self, name=None):
+        """
+        Returns the progress (see Backfill.status) of the running backfills and the most recently finished ones, or of
+        one backfill only.
+        :param str name: Backfill name (optional)
+        :return: list of dicts, finished backfills first
+        """
+        backfills = list(self.finished_backfills) + list(self.backfills.values())
+        if name is not None:
+            backfills = [backfill for backfill in backfills if backfill.name == name]
+            if not backfills:
+                raise Exception('Unknown backfill: {}'.format(name))
+        return [backfill.status() for backfill in backfills]
+
+    def reload_registry(self):
+        """
+        Re-read the registry and apply only the differences.  Pending tasks of removed routines are dropped.  Those of
+        changed routines, and of routines downstream of changed or removed ones (whose task times and dependencies
+        derive from them), are re-created.  Added routines are scheduled.  Running tasks, backfill tasks and unaffected
+        routines are left alone.  If the new registry cannot be loaded, the current one is kept and the error raised.
+        :return: Numbers of routines added, removed and changed
+        """
+        logger.info('* Received Reload Instruction *')
+        try:
+            registry = Registry(self.config.get('DEFAULT', 'registry'),
+                                self.config.get('DEFAULT', 'registry_snapshots', fallback=None))
+        except Exception:
+            logger.error('Registry reload failed, keeping the current registry')
+            raise
+        added, removed, changed = self.registry.diff(registry)
+        logger.info('Registry reload: %s added, %s removed, %s changed', len(added), len(removed), len(changed))
+
+        affected = set(changed)
+        stack = [self.registry.get_routine(name) for name in changed + removed]
+        while stack:
+            for dependant in stack.pop().dependants:
+                if dependant.name not in affected and dependant.name in registry.routines:
+                    affected.add(dependant.name)
+                    stack.append(dependant)
+
+        # Drop pending tasks, remembering where each routine's schedule had got to
+        now = self.clock.now()
+        reference_times = {}
+        for name in removed + sorted(affected):
+            pending = [self.scheduled_tasks_dict[k] for k in self.routine_tasks.get(name, ())
+                       if self.scheduled_tasks_dict[k].state in ['Ready', 'Waiting', 'Queued']
+                       and not self.scheduled_tasks_dict[k].backfill]
+            for task in pending:
+                self.dispatch_queue.remove(task.qualified_name)
+                self.catchup_queue.remove(task.qualified_name)
+                self.remove_task(task.qualified_name)
+            if pending:
+                reference_times[name] = min(now, min(k.time for k in pending) - timedelta(seconds=1))
+
+        # Upstream routines first, so downstream tasks register against their new dependencies
+        self.registry = registry
+        for name in registry.topological_order(affected.union(added)):
+            self.schedule_next_task(registry.get_routine(name), reference_times.get(name, now))
+        return {'added': len(added), 'removed': len(removed), 'changed': len(changed)}
+
+    def register_metrics(self):
+        metrics = self.metrics
+        self.dispatch_lag = metrics.histogram('scheduler_dispatch_lag_seconds',
+                                              'Seconds between a task\'s scheduled time and its start', LAG_BUCKETS)
+        self.run_pending_seconds = metrics.histogram('scheduler_run_pending_jobs_seconds',
+                                                     'Seconds spent dispatching due tasks per main loop pass')
+        self.wait_seconds = metrics.histogram('scheduler_wait_for_updates_seconds',
+                                              'Seconds spent waiting for, then processing, a batch of events')
+        self.event_batch_size = metrics.histogram('scheduler_event_batch_size', 'Events processed per batch',
+                                                  SIZE_BUCKETS)
+        self.run_seconds = metrics.histogram('scheduler_task_run_seconds', 'Seconds from dispatch to a task\'s end',
+                                             DURATION_BUCKETS, labels=('routine', 'state'))
+        metrics.gauge('scheduler_event_queue_depth', 'Events waiting in the event queue', self.event_queue_depth)
+        metrics.gauge('scheduler_tasks', 'Scheduled tasks by state', self.task_counts, labels=('state',))
+
+    def event_queue_depth(self):
+        try:
+            return self.event_queue.qsize()
+        except NotImplementedError:  # multiprocessing queues on macOS
+            return None
+
+    def task_counts(self):
+        counts = Counter(task.state for task in list(self.scheduled_tasks_dict.values()))
+        return {(state,): counts[state] for state in ['Running', 'Queued', 'Waiting', 'Ready', 'Failure']}
+
+    def record_dispatch_lag(self, task):
+        self.dispatch_lag.observe(max(0.0, (self.clock.now() - task.time).total_seconds()))
+
+    def record_run(self, qualified_name, routine_name, state):
+        start = self.run_started.pop(qualified_name, None)
+        if start is not None:
+            self.run_seconds.observe(time.perf_counter() - start, routine_name, state)
+
+    def scheduling_metrics(self):
+        """
+        Returns scheduling lag (seconds between a task's scheduled time and its start) and event batch statistics.
+        """
+        dispatched = self.dispatch_lag.count()
+        batches = self.event_batch_size.count()
+        events = self.event_batch_size.sum()
+        return {
+            'dispatched': dispatched,
+            'mean_lag': self.dispatch_lag.sum() / dispatched if dispatched else 0.0,
+            'max_lag': self.dispatch_lag.max(),
+            'event_batches': batches,
+            'events': int(events),
+            'mean_batch': events / batches if batches else 0.0,
+            'max_batch': int(self.event_batch_size.max()),
+        }
 
     def next_runtime(self):
-        assert len(self.scheduled_tasks_dict) == len(self.scheduled_tasks_list)
-        for task in self.scheduled_tasks_list:
-            if task.state in ['Ready', 'Waiting']:
-                return task.time
+        # A Waiting task past its time (e.g. behind a failed dependency) must not keep the main loop from blocking
+        return self.scheduled_tasks_queue.next_ready_time()
 
     def remove_task(self, qualified_name):
         logger.debug('Removing: %s', qualified_name)
         task = self.scheduled_tasks_dict[qualified_name]
 
-        if qualified_name in self.task_dependencies:
-            logger.debug('Removing %s from dependency map keys', qualified_name)
-            del self.task_dependencies[qualified_name]
-
-        for dependency in task.dependencies:
-            if dependency in self.task_dependencies:
-                if task.qualified_name in self.task_dependencies[dependency]:
-                    logger.debug('Removing %s as dependent on %s', qualified_name, dependency)
-                    self.task_dependencies[dependency].remove(task.qualified_name)
+        logger.debug('Removing from dependency graph: %s', qualified_name)
+        self.task_dependencies.remove(qualified_name)
 
         logger.debug('Removing from both scheduled collections: %s', qualified_name)
         self.state_manager.update(task.name, task.time, 'Archived')
-        self.scheduled_tasks_list.remove(task)
+        self.scheduled_tasks_queue.remove(qualified_name)
+        self.routine_tasks[task.name].discard(qualified_name)
         del self.scheduled_tasks_dict[qualified_name]
 
     def reset_task(self, task):
         logger.info('Resetting: %s', task.qualified_name)
-        new_task = Task(task.name, task.script, task.time, task.dependencies, queue=task.result_queue)
+        self.dispatch_queue.remove(task.qualified_name)
+        self.catchup_queue.remove(task.qualified_name)
+        self.backfill_queue.remove(task.qualified_name)
+        new_task = Task(task.name, task.script, task.time, task.dependencies, queue=task.result_queue,
+                        entry_point=task.entry_point)
+        new_task.catchup, new_task.backfill = task.catchup, task.backfill
         self.scheduled_tasks_dict[task.qualified_name] = new_task
-        self.scheduled_tasks_list.remove(task)
-        bisect.insort(self.scheduled_tasks_list, new_task)
+        self.scheduled_tasks_queue.update(new_task)
         return new_task
 
     def shutdown(self):
         logger.info('* Received shutdown instruction *')
 
         # Record the shutdown time, so jobs can be resumed on launch
-        shutdown_time = datetime.today().strftime(config.dt_format_str)
+        shutdown_time = self.clock.now().strftime(config.dt_format_str)
         self.config.set('DEFAULT', 'Last_Shutdown', shutdown_time)
         with open(self.config.get('DEFAULT', 'config_path'), 'w') as config_file:
             self.config.write(config_file)
@@ -220,10 +777,14 @@ class TaskManager:
             for running_task in self.running_tasks:
                 logger.info(running_task)
         while number_running_tasks != 0:
-            self.wait_for_updates()
+            self.wait_for_updates(REAP_INTERVAL_SECONDS)
+            self.supervise(self.clock.now())
             number_running_tasks = len(self.running_tasks)
             if number_running_tasks == 0:
                 logger.info('Outstanding tasks have finished running.')
+        self.executor.shutdown()
+        self.state_manager.flush()
+        logger.info('Scheduling metrics: %s', self.scheduling_metrics())
         logger.info('* Shutdown completed normally *')
         self.keep_running = False
 
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import config
+from core.task import Task
+from core.dependency_graph import DependencyGraph
+
+
+class TestDependencyGraph(unittest.TestCase):
+
+    def test_graph(self):
+        graph = DependencyGraph()
+        for downstream in ['b', 'c', 'd']:
+            graph.add('a', downstream)
+        graph.add('x', 'd')
+        self.assertIn('a', graph)
+        self.assertEqual(graph.dependants_of('a'), {'b', 'c', 'd'})
+        self.assertEqual(graph.dependants_of('b'), ())
+
+        # Removing a downstream task drops it from its upstream tasks' dependants
+        graph.remove('d')
+        self.assertEqual(graph.dependants_of('a'), {'b', 'c'})
+        self.assertEqual(graph.dependants_of('x'), set())
+
+        # Removing an upstream task drops its edges
+        graph.remove('a')
+        self.assertNotIn('a', graph)
+        self.assertEqual(graph.dependencies['b'], set())
+
+    def test_pending_dependencies(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config_path = os.path.join(directory, 'config.cfg')
+            with open(config_path, 'w') as config_file:
+                config_file.write('[DEFAULT]\nregistry = {}\nlog_directory = {}\n'.format(
+                    config_path, os.path.join(directory, 'logs')))
+            config.load_config_file(config_path)
+
+            dependencies = {'up{}'.format(i): None for i in range(3)}
+            task = Task('down', 'down.py', datetime(2021, 9, 21, 10), dependencies)
+            self.assertEqual((task.state, task.pending_dependencies), ('Waiting', 3))
+
+            task.update_dependency_state('up0', 'Success')
+            task.update_dependency_state('up1', 'Running')
+            task.update_dependency_state('up1', 'Success')
+            self.assertEqual((task.state, task.pending_dependencies), ('Waiting', 1))
+
+            # A dependency that is re-run counts as pending again
+            task.update_dependency_state('up0', 'Running')
+            task.update_dependency_state('up2', 'Success')
+            self.assertEqual((task.state, task.pending_dependencies), ('Waiting', 1))
+            task.update_dependency_state('up0', 'Success')
+            self.assertEqual((task.state, task.pending_dependencies), ('Ready', 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
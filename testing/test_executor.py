@@ -0,0 +1,181 @@
+import os
+import time
+import queue
+import tempfile
+import unittest
+from unittest import mock
+import multiprocessing as mp
+from datetime import datetime, timedelta
+
+import config
+from core.task import Task
+from core import executor
+from core.executor import ProcessExecutor, PoolExecutor
+
+
+class TestExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        config_path = os.path.join(self.directory.name, 'config.cfg')
+        with open(config_path, 'w') as config_file:
+            config_file.write('[DEFAULT]\nregistry = {0}\nlog_directory = {1}\n'.format(
+                config_path, os.path.join(self.directory.name, 'logs')))
+        config.load_config_file(config_path)
+        self.success = os.path.join(config.get_test_directory(), 'task_success.py')
+        self.failure = os.path.join(config.get_test_directory(), 'task_failure.py')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_tasks(self, executor, scripts, result_queue):
+        start = datetime(2021, 9, 21, 10, 0)
+        tasks = [Task('test', script, start + timedelta(minutes=i), queue=result_queue)
+                 for i, script in enumerate(scripts)]
+        for task in tasks:
+            executor.submit(task)
+        results = {}
+        for _ in tasks:
+            message = result_queue.get(timeout=30)
+            executor.task_finished(message)
+            results[message.qualified_name] = message.state
+        self.assertRaises(queue.Empty, result_queue.get, timeout=0.1)
+        return [results[task.qualified_name] for task in tasks]
+
+    def test_process_executor(self):
+        result_queue = mp.Queue()
+        results = self.run_tasks(ProcessExecutor(), [self.success, self.failure], result_queue)
+        self.assertEqual(results, ['Success', 'Failure'])
+
+    def test_pool_executor(self):
+        result_queue = mp.Queue()
+        pool = PoolExecutor(result_queue, size=2, max_tasks=2)
+        first_workers = [worker.process.pid for worker in pool.idle]
+        try:
+            results = self.run_tasks(pool, [self.success] * 4 + [self.failure], result_queue)
+            self.assertEqual(results, ['Success'] * 4 + ['Failure'])
+            # Both original workers reached max_tasks and were replaced
+            self.assertEqual(len(pool.idle), 2)
+            self.assertFalse(set(first_workers) & {worker.process.pid for worker in pool.idle})
+        finally:
+            pool.shutdown()
+
+    def test_pool_task_processes(self):
+        # Tasks run by a pool worker may start processes of their own
+        script_path = os.path.join(self.directory.name, 'task_child.py')
+        with open(script_path, 'w') as script:
+            script.write('import os\nimport multiprocessing as mp\n'
+                         'child = mp.Process(target=os.getpid)\nchild.start()\nchild.join()\n'
+                         'assert child.exitcode == 0\n')
+        result_queue = mp.Queue()
+        pool = PoolExecutor(result_queue, size=1)
+        try:
+            self.assertEqual(self.run_tasks(pool, [script_path], result_queue), ['Success'])
+        finally:
+            pool.shutdown()
+        self.assertFalse(any(worker.process.is_alive() for worker in pool.idle))
+
+    @unittest.skipIf(executor.resource is None, 'Worker memory is not tracked on this platform')
+    def test_max_rss(self):
+        usage = mock.Mock(ru_maxrss=200 * 1024 * 1024)
+        with mock.patch.object(executor.resource, 'getrusage', return_value=usage):
+            with mock.patch.object(executor.sys, 'platform', 'darwin'):
+                self.assertEqual(executor.max_rss(), 200)  # bytes
+            with mock.patch.object(executor.sys, 'platform', 'linux'):
+                self.assertEqual(executor.max_rss(), 200 * 1024)  # kilobytes
+
+    def test_cancel(self):
+        slow = os.path.join(self.directory.name, 'task_slow.py')
+        with open(slow, 'w') as script:
+            script.write('import time\ntime.sleep(60)\n')
+        start = datetime(2021, 9, 21, 10, 0)
+
+        result_queue = mp.Queue()
+        executor = ProcessExecutor()
+        task = Task('test', slow, start, queue=result_queue)
+        executor.submit(task)
+        self.assertTrue(executor.cancel(task.qualified_name))
+        self.assertFalse(task.is_alive())
+        self.assertFalse(executor.cancel(task.qualified_name))
+
+        # The pool replaces the killed worker, which then takes the next job
+        pool = PoolExecutor(result_queue, size=1)
+        try:
+            tasks = [Task('test', script, start + timedelta(minutes=i), queue=result_queue)
+                     for i, script in enumerate([slow, slow, self.success])]
+            for task in tasks:
+                pool.submit(task)
+            self.assertTrue(pool.cancel(tasks[1].qualified_name))
+            self.assertTrue(pool.cancel(tasks[0].qualified_name))
+            message = result_queue.get(timeout=30)
+            self.assertEqual((message.qualified_name, message.state), (tasks[2].qualified_name, 'Success'))
+        finally:
+            pool.shutdown()
+
+    def test_reap(self):
+        crash = os.path.join(self.directory.name, 'task_crash.py')
+        with open(crash, 'w') as script:
+            script.write('import os\nos._exit(3)\n')
+        start = datetime(2021, 9, 21, 10, 0)
+        result_queue = mp.Queue()
+
+        def reap(executor):
+            for _ in range(100):
+                dead = executor.reap()
+                if dead:
+                    return dead
+                time.sleep(0.1)
+
+        executor = ProcessExecutor()
+        task = Task('test', crash, start, queue=result_queue)
+        executor.submit(task)
+        self.assertEqual(reap(executor), [(task.qualified_name, 3)])
+        self.assertEqual(executor.processes, {})
+
+        pool = PoolExecutor(result_queue, size=1)
+        try:
+            tasks = [Task('test', script, start + timedelta(minutes=i), queue=result_queue)
+                     for i, script in enumerate([crash, self.success])]
+            for task in tasks:
+                pool.submit(task)
+            self.assertEqual(reap(pool), [(tasks[0].qualified_name, 3)])
+            # The replacement worker takes the next job
+            message = result_queue.get(timeout=30)
+            self.assertEqual((message.qualified_name, message.state), (tasks[1].qualified_name, 'Success'))
+        finally:
+            pool.shutdown()
+
+    @unittest.skipUnless(os.path.isdir('/proc'), 'Checks processes through /proc')
+    def test_kill_process_tree(self):
+        pid_file = os.path.join(self.directory.name, 'child.pid')
+        script_path = os.path.join(self.directory.name, 'task_tree.py')
+        with open(script_path, 'w') as script:
+            script.write('import sys, time, subprocess\n'
+                         'child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])\n'
+                         'open({!r}, "w").write(str(child.pid))\n'
+                         'time.sleep(60)\n'.format(pid_file))
+        executor = ProcessExecutor()
+        task = Task('test', script_path, datetime(2021, 9, 21, 10, 0), queue=mp.Queue())
+        executor.submit(task)
+        for _ in range(100):
+            if os.path.exists(pid_file) and os.path.getsize(pid_file):
+                break
+            time.sleep(0.1)
+        with open(pid_file) as child_pid:
+            child = int(child_pid.read())
+        self.assertTrue(executor.cancel(task.qualified_name))
+        # The process the script started is killed too (and is gone, or a zombie until init reaps it)
+        for _ in range(50):
+            try:
+                with open('/proc/{}/stat'.format(child)) as stat:
+                    if stat.read().split()[2] == 'Z':
+                        break
+            except FileNotFoundError:
+                break
+            time.sleep(0.1)
+        else:
+            self.fail('Child process survived')
+
+
+if __name__ == '__main__':
+    unittest.main()
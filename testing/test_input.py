@@ -0,0 +1,62 @@
+import queue
+import socket
+import unittest
+import threading
+
+import input
+from core.message import Request
+
+
+class TestControlServer(unittest.TestCase):
+
+    def setUp(self):
+        self.events = queue.Queue()
+        self.server = input.ControlServer(self.events)
+        self.port = self.server.start()
+        # Stands in for the TaskManager: answers each request with its command and arguments
+        self.answering = threading.Thread(target=self.answer, daemon=True)
+        self.answering.start()
+
+    def tearDown(self):
+        self.events.put(None)
+        self.answering.join()
+        self.server.stop()
+
+    def answer(self):
+        while True:
+            request = self.events.get()
+            if request is None:
+                return
+            self.assertIsInstance(request, Request)
+            if request.command == 'fail':
+                self.server.respond(request.request_id, {'ok': False, 'error': 'failed'})
+            else:
+                self.server.respond(request.request_id, {'ok': True, 'result': [request.command, request.arguments]})
+
+    def test_requests(self):
+        with input.ControlClient(self.port, timeout=5) as client:
+            self.assertEqual(client.request('status', routine_name='a'), ['status', {'routine_name': 'a'}])
+            with self.assertRaisesRegex(Exception, 'failed'):
+                client.request('fail')
+
+            # Pipelined and batched requests are answered in order
+            requests = [('execute', {'task_name': 'a.{}'.format(k)}) for k in range(50)]
+            responses = client.pipeline(requests)
+            self.assertEqual([k['id'] for k in responses], list(range(3, 53)))
+            self.assertEqual([k['result'][1]['task_name'] for k in responses], ['a.{}'.format(k) for k in range(50)])
+            responses = client.batch(requests[:3] + [('fail', {})])
+            self.assertEqual([k['ok'] for k in responses], [True, True, True, False])
+
+            client.send({'arguments': {}})
+            self.assertRegex(client.receive()['error'], 'Malformed request')
+        self.assertEqual(input.send_command(self.port, 'reload'), ['reload', {}])
+
+    def test_bad_frame(self):
+        with input.ControlClient(self.port, timeout=5) as client:
+            client.socket.sendall(input.frame_header.pack(5) + b'{bad}')
+            self.assertFalse(client.receive()['ok'])
+            # The server hangs up after a bad frame
+            self.assertEqual(client.socket.recv(1), b'')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import queue
+import unittest
+from urllib.request import urlopen
+from configparser import ConfigParser
+from datetime import datetime, timedelta
+
+from core.metrics import Metrics, MetricsServer, null_metric
+from core.task import Task
+from task_manager import TaskManager
+
+
+class StubStateManager:
+    def update(self, *args):
+        pass
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_render(self):
+        metrics = Metrics()
+        counter = metrics.counter('runs_total', 'Runs', labels=('routine',))
+        counter.inc('a')
+        counter.inc('a', amount=2)
+        counter.inc('b "quoted"')
+        histogram = metrics.histogram('wait_seconds', 'Wait', buckets=(0.1, 1))
+        for value in [0.05, 0.1, 0.5, 3]:
+            histogram.observe(value)
+        metrics.gauge('depth', 'Depth', lambda: 7)
+        metrics.gauge('missing', 'Not reported', lambda: None)
+        self.assertIs(metrics.counter('runs_total', 'Runs', labels=('routine',)), counter)
+
+        lines = metrics.render().splitlines()
+        self.assertIn('# TYPE runs_total counter', lines)
+        self.assertIn('runs_total{routine="a"} 3', lines)
+        self.assertIn('runs_total{routine="b \\"quoted\\""} 1', lines)
+        self.assertIn('# TYPE wait_seconds histogram', lines)
+        self.assertIn('wait_seconds_bucket{le="0.1"} 2', lines)
+        self.assertIn('wait_seconds_bucket{le="1"} 3', lines)
+        self.assertIn('wait_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn('wait_seconds_sum 3.65', lines)
+        self.assertIn('wait_seconds_count 4', lines)
+        self.assertIn('depth 7', lines)
+        self.assertFalse([k for k in lines if k.startswith('missing')])
+        self.assertEqual(histogram.max(), 3)
+
+    def test_disabled(self):
+        metrics = Metrics(enabled=False)
+        self.assertIs(metrics.histogram('wait_seconds', 'Wait'), null_metric)
+        metrics.histogram('wait_seconds', 'Wait').observe(1)
+        metrics.gauge('depth', 'Depth', lambda: 7)
+        self.assertEqual(metrics.render(), '')
+
+    def test_server(self):
+        metrics = Metrics()
+        metrics.counter('runs_total', 'Runs').inc()
+        server = MetricsServer(metrics)
+        port = server.start()
+        try:
+            with urlopen('http://localhost:{}/metrics'.format(port), timeout=5) as response:
+                self.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+                self.assertIn('runs_total 1', response.read().decode('utf-8').splitlines())
+        finally:
+            server.stop()
+
+    def test_task_manager(self):
+        configuration = ConfigParser()
+        task_manager = TaskManager(queue.Queue(), StubStateManager(), {}, configuration, executor=object())
+        now = datetime.today()
+        task = Task('a', 'a.py', now - timedelta(seconds=2))
+        task.state = 'Waiting'
+        task_manager.scheduled_tasks_dict[task.qualified_name] = task
+        task_manager.record_dispatch_lag(task)
+        task_manager.event_queue.put('unknown')
+        task_manager.event_queue.put('unknown')
+        task_manager.wait_for_updates(0)
+
+        lines = task_manager.metrics.render().splitlines()
+        self.assertIn('scheduler_tasks{state="Waiting"} 1', lines)
+        self.assertIn('scheduler_dispatch_lag_seconds_count 1', lines)
+        self.assertIn('scheduler_event_batch_size_sum 2', lines)
+        self.assertIn('scheduler_wait_for_updates_seconds_count 1', lines)
+        summary = task_manager.scheduling_metrics()
+        self.assertEqual((summary['dispatched'], summary['events'], summary['max_batch']), (1, 2, 2))
+        self.assertGreaterEqual(summary['max_lag'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,19 @@
 import os
+import shutil
+import tempfile
 import unittest
+from unittest import mock
 import config
 from core.registry import Registry
 
 
+def write_registry(directory, jobs):
+    path = os.path.join(directory, 'registry.xml')
+    with open(path, 'w') as registry_file:
+        registry_file.write('<registry>\n{}\n</registry>\n'.format('\n'.join(jobs)))
+    return path
+
+
 class TestConfig(unittest.TestCase):
 
     def test_registry_functions(self):
@@ -16,5 +26,52 @@ class TestConfig(unittest.TestCase):
         test_routine = test_registry.get_routine(test_routine_name)
         self.assertEqual(test_routine.name, test_routine_name)
 
+    def test_validation(self):
+        directory = tempfile.mkdtemp()
+        try:
+            duplicate = write_registry(directory, ['<job name="a" schedule="* * * * *"/>',
+                                                   '<job name="a" schedule="* * * * *"/>'])
+            with self.assertRaisesRegex(Exception, 'Name conflict'):
+                Registry(duplicate)
+
+            unknown = write_registry(directory, ['<job name="a"><dependency name="b"/></job>'])
+            with self.assertRaisesRegex(Exception, 'Unknown dependency'):
+                Registry(unknown)
+
+            cycle = write_registry(directory, ['<job name="a" schedule="* * * * *"/>',
+                                               '<job name="b"><dependency name="a"/><dependency name="d"/></job>',
+                                               '<job name="c"><dependency name="b"/></job>',
+                                               '<job name="d"><dependency name="c"/></job>',
+                                               '<job name="e"><dependency name="d"/></job>'])
+            with self.assertRaisesRegex(Exception, 'cycle between routines: b, c, d, e'):
+                Registry(cycle)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_snapshot(self):
+        directory = tempfile.mkdtemp()
+        snapshots = os.path.join(directory, 'snapshots')
+        try:
+            test_registry_xml = os.path.join(config.get_test_directory(), 'registry.xml')
+            parsed = Registry(test_registry_xml, snapshots)
+            self.assertEqual(len(os.listdir(snapshots)), 1)
+
+            # An unchanged registry is restored without parsing
+            with mock.patch.object(Registry, 'parse', side_effect=AssertionError('parsed')):
+                restored = Registry(test_registry_xml, snapshots)
+            self.assertEqual(list(restored.routines), list(parsed.routines))
+            routine = restored.get_routine('testJob2')
+            self.assertEqual({k.name for k in routine.dependencies}, {'testJob0', 'testJob1'})
+            self.assertIs(routine.trigger_cache, restored.trigger_cache)
+            self.assertIn(routine, restored.get_routine('testJob0').dependants)
+            self.assertEqual(routine.schedule.cron_string, '30 * * * *')
+
+            # A changed registry gets a snapshot of its own
+            changed = write_registry(directory, ['<job name="a" schedule="* * * * *"/>'])
+            self.assertEqual(list(Registry(changed, snapshots).routines), ['a'])
+            self.assertEqual(len(os.listdir(snapshots)), 2)
+        finally:
+            shutil.rmtree(directory)
+
 if __name__ == '__main__':
     unittest.main()
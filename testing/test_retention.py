@@ -0,0 +1,139 @@
+import os
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from configparser import ConfigParser
+from datetime import datetime, timedelta
+
+from core.retention import StateArchiver
+from core.state_manager import StateManager
+from core.task import Task
+from task_manager import TaskManager
+import config
+
+
+class TestRetention(unittest.TestCase):
+
+    def test_archive(self):
+        test_directory = config.get_test_directory()
+        database_path = os.path.join(test_directory, 'test_retention.db')
+        archive_directory = os.path.join(test_directory, 'test_archive')
+        sm = StateManager(database_path)
+
+        # Two months of finished tasks, a live task and a failed one that was never archived
+        start = datetime(2021, 8, 20)
+        for day in range(20):
+            instance = start + timedelta(days=day)
+            for state in ['Waiting', 'Ready', 'Running', 'Success', 'Archived']:
+                sm.update('Done', instance, state)
+        sm.update('Live', start, 'Waiting')
+        sm.update('Failed', start, 'Failure')
+
+        archiver = StateArchiver(database_path, archive_directory, retention_days=30, batch_size=8)
+        now = start + timedelta(days=45)
+        moved = [archiver.archive_batch(now) for _ in range(3)]
+        self.assertEqual(moved, [8, 7, 0])  # instances before 2021-09-04 are expired
+
+        # Only the unexpired and unfinished history stays in the hot database
+        count = sm.database.execute('SELECT COUNT(*) FROM state').fetchone()[0]
+        self.assertEqual(count, 5 * 5 + 2)
+        self.assertEqual([os.path.basename(k) for k in archiver.partitions()], ['state_2021_08.db', 'state_2021_09.db'])
+        self.assertEqual(len(sm.get_current_status().fetchall()), 2)
+
+        # History can be read across the archive
+        history = archiver.task_history('Done', start)
+        self.assertEqual([row[2] for row in history], ['Waiting', 'Ready', 'Running', 'Success', 'Archived'])
+        history = archiver.query_history('Done', start + timedelta(days=10), start + timedelta(days=16))
+        self.assertEqual(len(history), 7 * 5)
+        self.assertEqual(len(archiver.query_history()), 20 * 5 + 2)
+
+        # Repeating a copy that was interrupted before the delete does not duplicate rows
+        partition = sqlite3.connect(archiver.partitions()[0])
+        rows = partition.execute('SELECT * FROM state').fetchall()
+        partition.executemany('INSERT OR IGNORE INTO state VALUES (?, ?, ?, ?)', rows)
+        self.assertEqual(partition.execute('SELECT COUNT(*) FROM state').fetchone()[0], len(rows))
+        partition.close()
+
+        sm.close()
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(database_path + suffix):
+                os.remove(database_path + suffix)
+        shutil.rmtree(archive_directory)
+
+    def test_recreated_during_batch(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        database_path = os.path.join(directory.name, 'state.db')
+        archive_directory = os.path.join(directory.name, 'archive')
+        sm = StateManager(database_path)
+        self.addCleanup(sm.close)
+        instance = datetime(2021, 8, 20)
+        for state in ['Ready', 'Running', 'Success', 'Archived']:
+            sm.update('Done', instance, state)
+        fresh = ('Done', instance, 'Ready', datetime(2021, 9, 30))
+
+        def recreate():
+            # The task is executed again, as the scheduler would record it
+            database = sqlite3.connect(database_path, timeout=30)
+            with database as conn:
+                conn.execute('INSERT INTO state VALUES (?, ?, ?, ?)', fresh)
+                conn.execute('INSERT OR REPLACE INTO current_state VALUES (?, ?, ?, ?)', fresh)
+            database.close()
+
+        class InterleavedArchiver(StateArchiver):
+            def copy_to_partitions(self, by_partition):
+                # The task is re-created after it was read for this batch and before it is deleted
+                writer = threading.Thread(target=recreate)
+                writer.start()
+                writer.join(0.2)
+                super().copy_to_partitions(by_partition)
+                self.writer = writer
+
+        archiver = InterleavedArchiver(database_path, archive_directory, retention_days=30)
+        self.assertEqual(archiver.archive_batch(datetime(2021, 10, 1)), 1)
+        archiver.writer.join()
+
+        # The re-created task's row waited for the batch to finish, and was kept
+        rows = sm.database.execute('SELECT routine, instance, state, state_time_stamp FROM state').fetchall()
+        self.assertEqual(rows, [fresh])
+        self.assertEqual(len(archiver.task_history('Done', instance)), 5)
+        self.assertEqual(archiver.archive_batch(datetime(2021, 10, 1)), 0)
+
+    def test_archived_dependency(self):
+        test_directory = config.get_test_directory()
+        database_path = os.path.join(test_directory, 'test_retention_dependency.db')
+        archive_directory = os.path.join(test_directory, 'test_archive_dependency')
+        archiver = StateArchiver(database_path, archive_directory, retention_days=2)
+        sm = StateManager(database_path, result_cache_size=0, archive=archiver)
+
+        # A weekly routine's last run, archived and expired well before the next
+        weekly = datetime(2021, 9, 13)
+        for state in ['Ready', 'Running', 'Success', 'Archived']:
+            sm.update('Weekly', weekly, state)
+        now = datetime(2021, 9, 18)
+        plan = sm.database.execute("""EXPLAIN QUERY PLAN SELECT DISTINCT routine, instance FROM state
+                                      WHERE instance < ? AND state = 'Archived'""", (now,)).fetchall()
+        self.assertIn('state_archived_instance', plan[0][3])
+        self.assertEqual(archiver.archive_batch(now), 1)
+        self.assertEqual(sm.database.execute('SELECT COUNT(*) FROM state').fetchone()[0], 0)
+
+        # Its result is still found, so a task depending on it is not cancelled
+        self.assertEqual(sm.last_result('Weekly', weekly), 'Success')
+        self.assertIsNone(sm.last_result('Weekly', weekly + timedelta(days=7)))
+        task_manager = TaskManager(queue.Queue(), sm, {}, ConfigParser(), executor=object())
+        task = Task('Daily', 'daily.py', now, {'Weekly.2021-09-13T00:00:00': None})
+        task_manager.register_dependencies(task, now)
+        self.assertEqual(task.state, 'Ready')
+
+        sm.close()
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(database_path + suffix):
+                os.remove(database_path + suffix)
+        shutil.rmtree(archive_directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@ import unittest
 from datetime import datetime
 
 from core.routine import Routine
+from core.trigger_cache import TriggerCache
 
 
 class TestConfig(unittest.TestCase):
@@ -24,6 +25,34 @@ class TestConfig(unittest.TestCase):
 
         self.assertEqual(test_routine1.next_trigger(datetime(2021, 9, 21, 10, 15)), datetime(2021, 9, 21, 10, 30))
 
+    def test_trigger_cache(self):
+        # A diamond-shaped chain: every routine depends on both routines of the layer above it.  Without memoization
+        # resolving the bottom layer would visit the root 2**40 times.
+        cache = TriggerCache(max_size=1000)
+        root = Routine('root', 'dummyscript', '10 * * * *')
+        root.trigger_cache = cache
+        layer = [root]
+        for depth in range(40):
+            new_layer = []
+            for side in ['a', 'b']:
+                routine = Routine('layer{}{}'.format(depth, side), 'dummyscript', None)
+                routine.trigger_cache = cache
+                for upstream in layer:
+                    routine.depends_on(upstream)
+                new_layer.append(routine)
+            layer = new_layer
+
+        self.assertEqual(layer[0].next_trigger(datetime(2021, 9, 21, 10, 15)), datetime(2021, 9, 21, 11, 10))
+        self.assertEqual(layer[1].previous_trigger(datetime(2021, 9, 21, 10, 15)), datetime(2021, 9, 21, 10, 10))
+        self.assertLessEqual(len(cache), 1000)
+        self.assertGreater(cache.hits, 0)
+
+        # Changing the dependencies invalidates cached triggers
+        late = Routine('late', 'dummyscript', '30 23 * * *')
+        layer[0].depends_on(late)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(layer[0].next_trigger(datetime(2021, 9, 21, 10, 15)), datetime(2021, 9, 21, 23, 30))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -41,6 +41,52 @@ class TestConfig(unittest.TestCase):
 
         self.assertEqual(test_schedule.previous(datetime(2021,2,25,12,10), inclusive=True), datetime(2020,12,31,23,10))
 
+    def test_extended_syntax(self):
+        test_schedule = Schedule('*/15 9-17 * * mon-fri')
+        self.assertEqual(test_schedule.next(datetime(2021,9,22,12,31)), datetime(2021,9,22,12,45))
+        self.assertEqual(test_schedule.next(datetime(2021,9,22,17,45)), datetime(2021,9,23,9,0))
+        self.assertEqual(test_schedule.next(datetime(2021,9,24,17,50)), datetime(2021,9,27,9,0))
+        self.assertEqual(test_schedule.previous(datetime(2021,9,27,9,0)), datetime(2021,9,24,17,45))
+
+        test_schedule = Schedule('0,30 3 1,15 jan,jul *')
+        self.assertEqual(test_schedule.next(datetime(2021,1,15,3,30)), datetime(2021,7,1,3,0))
+        self.assertEqual(test_schedule.previous(datetime(2021,7,1,3,0)), datetime(2021,1,15,3,30))
+
+        test_schedule = Schedule('0 3 31 * *')
+        self.assertEqual(test_schedule.next(datetime(2021,4,1,0,0)), datetime(2021,5,31,3,0))
+        self.assertEqual(test_schedule.previous(datetime(2021,5,1,0,0)), datetime(2021,3,31,3,0))
+
+        test_schedule = Schedule('0 0 29 2 *')
+        self.assertEqual(test_schedule.next(datetime(2021,3,1,0,0)), datetime(2024,2,29,0,0))
+        self.assertEqual(test_schedule.previous(datetime(2021,3,1,0,0)), datetime(2020,2,29,0,0))
+
+        self.assertRaises(ValueError, Schedule, '0 0 31 2 *')
+        self.assertRaises(ValueError, Schedule, '60 * * * *')
+        self.assertRaises(ValueError, Schedule, '* * * *')
+        self.assertRaises(ValueError, Schedule, '*/0 * * * *')
+
+    def test_occurrences(self):
+        test_schedule = Schedule('*/15 9-17 * * mon-fri')
+        start, end = datetime(2021,9,20,12,10,30), datetime(2021,10,20,9,15)
+
+        expected = []
+        moment = test_schedule.next(start)
+        while moment < end:
+            expected.append(moment)
+            moment = test_schedule.next(moment)
+
+        result = test_schedule.occurrences(start, end)
+        self.assertEqual(result.dtype, 'datetime64[m]')
+        self.assertEqual(result.astype(datetime).tolist(), expected)
+        self.assertEqual(test_schedule.count_between(start, end), len(expected))
+
+        chunks = list(test_schedule.iter_occurrences(start, end, chunk_days=7))
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual([k for chunk in chunks for k in chunk.astype(datetime).tolist()], expected)
+
+        self.assertEqual(len(test_schedule.occurrences(end, start)), 0)
+        self.assertEqual(test_schedule.count_between(end, start), 0)
+
 if __name__ == '__main__':
     unittest.main()
  
\ No newline at end of file
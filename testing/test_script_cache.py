@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+
+import config
+from core.task import run_script
+from core.script_cache import ScriptCache, load_entry_point
+
+
+class TestScriptCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.script = os.path.join(self.directory.name, 'script.py')
+        self.write_script('result = 1\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_script(self, text):
+        with open(self.script, 'w') as script:
+            script.write(text)
+
+    def run_code(self, cache):
+        namespace = {}
+        exec(cache.load(self.script), namespace)
+        return namespace['result']
+
+    def test_script_cache(self):
+        cache_directory = os.path.join(self.directory.name, 'cache')
+        cache = ScriptCache(cache_directory)
+        self.assertEqual(self.run_code(cache), 1)
+        self.assertEqual(self.run_code(cache), 1)
+        self.assertEqual((cache.misses, cache.hits), (1, 1))
+
+        # A new cache (e.g. in another process) picks up the persisted code
+        other_cache = ScriptCache(cache_directory)
+        self.assertEqual(self.run_code(other_cache), 1)
+        self.assertEqual((other_cache.misses, other_cache.disk_hits), (0, 1))
+
+        # Changing the script invalidates both the memory and disk entries
+        self.write_script('result = 22\n')
+        self.assertEqual(self.run_code(cache), 22)
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(self.run_code(ScriptCache(cache_directory)), 22)
+
+    def test_entry_point(self):
+        self.assertIs(load_entry_point('os.path:join'), os.path.join)
+        self.assertRaises(ValueError, load_entry_point, 'os.path')
+
+        log = os.path.join(self.directory.name, 'task.log')
+        self.assertEqual(run_script(None, 'test.2021-09-21T10:00:00', log, entry_point='time:time'), 'Success')
+        self.assertEqual(run_script(None, 'test.2021-09-21T10:00:00', log, entry_point='os:getcwdb.x'), 'Failure')
+
+        failure = os.path.join(config.get_test_directory(), 'task_failure.py')
+        self.assertEqual(run_script(self.script, 'test.2021-09-21T10:00:00', log), 'Success')
+        self.assertEqual(run_script(failure, 'test.2021-09-21T10:00:00', log), 'Failure')
+
+    def test_namespace(self):
+        # Scripts see only what a script run as __main__ would, and nothing from earlier runs or from Task.run
+        self.write_script('\n'.join([
+            'assert __name__ == "__main__", __name__',
+            'assert __file__ == {!r}, __file__'.format(self.script),
+            'for name in ["self", "task_logger", "logging", "config", "leftover"]:',
+            '    assert name not in globals(), name',
+            'leftover = 1',
+            '']))
+        log = os.path.join(self.directory.name, 'task.log')
+        self.assertEqual(run_script(self.script, 'test.2021-09-21T10:00:00', log), 'Success')
+        self.assertEqual(run_script(self.script, 'test.2021-09-21T11:00:00', log), 'Success')
+
+        self.write_script('print(self.qualified_name)\n')
+        self.assertEqual(run_script(self.script, 'test.2021-09-21T12:00:00', log), 'Failure')
+        with open(log) as log_file:
+            self.assertIn("NameError: name 'self' is not defined", log_file.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+import config
+from core.clock import VirtualClock
+from core.registry import Registry
+from core.state_manager import StateManager
+from core.state_reader import StateReader
+from simulation import Simulation, historical_durations
+
+start = datetime(2021, 9, 21)
+
+
+class TestSimulation(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.registry_path = os.path.join(self.directory.name, 'registry.xml')
+        with open(self.registry_path, 'w') as registry_file:
+            registry_file.write('\n'.join([
+                '<registry>',
+                '<job name="extract" script="x.py" schedule="0 2 * * *" duration="1200"/>',
+                '<job name="load" script="x.py"><dependency name="extract"/></job>',
+                '<job name="report" script="x.py" schedule="0 6 * * *" duration="600"><dependency name="load"/></job>',
+                '<job name="poll" script="x.py" schedule="*/30 * * * *" duration="2400"/>',
+                '<job name="slow" script="x.py" schedule="0 3 * * *" duration="7200" timeout="3600"/>',
+                '</registry>']))
+        config_path = os.path.join(self.directory.name, 'config.cfg')
+        with open(config_path, 'w') as config_file:
+            config_file.write('[DEFAULT]\nregistry = {}\nlog_directory = {}\n'.format(
+                self.registry_path, os.path.join(self.directory.name, 'logs')))
+        self.configuration = config.load_config_file(config_path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_clock(self):
+        clock = VirtualClock(start)
+        clock.advance(start + timedelta(hours=1))
+        clock.advance(start)
+        self.assertEqual(clock.now(), start + timedelta(hours=1))
+
+    def test_simulation(self):
+        end = start + timedelta(days=1) - timedelta(minutes=1)
+        report = Simulation(Registry(self.registry_path), self.configuration, start, end, {'load': 1800}).run()
+        runs = {run['task']: run for run in report.runs}
+
+        # Declared and given durations, and the timeout
+        self.assertEqual(runs['load.2021-09-21T02:00:00']['start'], datetime(2021, 9, 21, 2, 20))
+        self.assertEqual(runs['load.2021-09-21T02:00:00']['end'], datetime(2021, 9, 21, 2, 50))
+        self.assertEqual(runs['slow.2021-09-21T03:00:00']['state'], 'Killed')
+        self.assertEqual(runs['slow.2021-09-21T03:00:00']['end'], datetime(2021, 9, 21, 4))
+        # Triggers after the start, up to the end
+        self.assertEqual(len(report.runs), 47 + 4)
+
+        # Polls overlap in pairs, and extract (then slow, then report) runs alongside them
+        self.assertEqual(report.peak(), (3, datetime(2021, 9, 21, 2)))
+        profile = report.profile(timedelta(hours=6))
+        self.assertEqual([k[1] for k in profile], [3, 3, 2, 2, 1])
+        self.assertEqual(sum(k[3] for k in profile), len(report.runs))
+        self.assertAlmostEqual(profile[2][2], 80 / 60)
+
+        (day, path), = report.critical_paths()
+        self.assertEqual(day, start.date())
+        self.assertEqual([run['routine'] for run in path], ['extract', 'load', 'report'])
+
+        # At most max_running at once
+        self.configuration['DEFAULT']['max_running'] = '1'
+        report = Simulation(Registry(self.registry_path), self.configuration, start, start + timedelta(hours=3)).run()
+        self.assertEqual(report.peak()[0], 1)
+
+    def test_historical_durations(self):
+        database_path = os.path.join(self.directory.name, 'state.db')
+        state_manager = StateManager(database_path)
+        rows = []
+        for day, seconds in enumerate([100, 300, 200]):
+            instance = start + timedelta(days=day)
+            rows += [('load', instance, 'Running', instance),
+                     ('load', instance, 'Success', instance + timedelta(seconds=seconds))]
+        # A rerun is measured from its own start
+        rows += [('load', start, 'Running', start + timedelta(hours=1)),
+                 ('load', start, 'Failure', start + timedelta(hours=1, seconds=50))]
+        with state_manager.write_lock:
+            state_manager.write_rows(rows)
+        state_manager.close()
+
+        reader = StateReader(database_path)
+        self.assertEqual(sorted(round(k) for k in reader.run_durations()['load']), [50, 100, 200, 300])
+        durations = historical_durations(reader)
+        reader.close()
+        self.assertAlmostEqual(durations['load'], 150, places=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 import os
+import time
+import sqlite3
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from core import state_manager
 import config
@@ -33,5 +35,115 @@ class TestConfig(unittest.TestCase):
         sm.close()
         os.remove(database_path)
 
+    def test_write_behind(self):
+        test_db_path = config.get_test_directory()
+        database_path = os.path.join(test_db_path, 'test_write_behind.db')
+        sm = state_manager.StateManager(database_path, write_behind=True, flush_interval_ms=60000, flush_rows=100)
+
+        def rows_on_disk():
+            conn = sqlite3.connect(database_path)
+            count = conn.execute('SELECT COUNT(*) FROM state').fetchone()[0]
+            conn.close()
+            return count
+
+        # Updates wait in the buffer until a flush is triggered
+        for minute in range(3):
+            sm.update('TestRoutine', datetime(2021,9,23,12,minute), 'Ready')
+        self.assertEqual(rows_on_disk(), 0)
+
+        # Reads flush first
+        result = sm.get_current_status('TestRoutine')
+        self.assertEqual(len(result.fetchall()), 3)
+        self.assertEqual(rows_on_disk(), 3)
+
+        # Reaching flush_rows wakes the writer thread
+        for minute in range(100):
+            sm.update('OtherRoutine', datetime(2021,9,23,13) + timedelta(minutes=minute), 'Ready')
+        deadline = time.time() + 5
+        while rows_on_disk() < 103 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(rows_on_disk(), 103)
+
+        # Closing flushes whatever is left
+        sm.update('TestRoutine', datetime(2021,9,23,12,0), 'Running')
+        sm.close()
+        self.assertEqual(rows_on_disk(), 104)
+        os.remove(database_path)
+
+    def test_current_state(self):
+        test_db_path = config.get_test_directory()
+        database_path = os.path.join(test_db_path, 'test_current_state.db')
+
+        # A database in the original layout: only the 'state' table
+        conn = sqlite3.connect(database_path)
+        conn.execute('CREATE TABLE state (routine VARCHAR(250), instance TIMESTAMP, state VARCHAR(250), '
+                     'state_time_stamp TIMESTAMP)')
+        conn.executemany('INSERT INTO state VALUES (?, ?, ?, ?)', [
+            ('Done', datetime(2021,9,23,12,0), 'Running', datetime(2021,9,23,12,0,1)),
+            ('Done', datetime(2021,9,23,12,0), 'Success', datetime(2021,9,23,12,0,2)),
+            ('Done', datetime(2021,9,23,12,0), 'Archived', datetime(2021,9,23,12,0,3)),
+            ('Live', datetime(2021,9,23,12,0), 'Waiting', datetime(2021,9,23,12,0,1)),
+            ('Live', datetime(2021,9,23,12,0), 'Ready', datetime(2021,9,23,12,0,2)),
+        ])
+        conn.commit()
+        conn.close()
+
+        # Connecting migrates it
+        sm = state_manager.StateManager(database_path)
+        self.assertEqual(sm.database.execute('PRAGMA user_version').fetchone()[0], state_manager.schema_version)
+        result = sm.get_current_status()
+        self.assertEqual([row[:3] for row in result], [('Live', datetime(2021,9,23,12,0), 'Ready')])
+
+        # current_state follows each update, and Archived tasks leave it
+        sm.update('Live', datetime(2021,9,23,12,0), 'Running')
+        sm.update('Other', datetime(2021,9,23,13,0), 'Waiting')
+        result = sm.get_current_status()
+        self.assertEqual([row[2] for row in result], ['Running', 'Waiting'])
+        result = sm.get_current_status('Other')
+        self.assertEqual(len(result.fetchall()), 1)
+
+        sm.update('Live', datetime(2021,9,23,12,0), 'Success')
+        sm.update('Live', datetime(2021,9,23,12,0), 'Archived')
+        result = sm.get_current_status()
+        self.assertEqual([row[0] for row in result], ['Other'])
+        self.assertEqual(sm.database.execute('SELECT COUNT(*) FROM current_state').fetchone()[0], 1)
+
+        sm.close()
+        os.remove(database_path)
+
+    def test_last_result(self):
+        test_db_path = config.get_test_directory()
+        database_path = os.path.join(test_db_path, 'test_last_result.db')
+        sm = state_manager.StateManager(database_path)
+        for hour in range(5):
+            for state in ['Ready', 'Running', 'Success', 'Archived']:
+                sm.update('Done', datetime(2021,9,23,hour), state)
+        sm.update('Live', datetime(2021,9,23,12), 'Waiting')
+        sm.close()
+
+        # The cache is warmed with the most recent tasks on connection
+        sm = state_manager.StateManager(database_path, result_cache_size=3)
+        self.assertEqual(len(sm.results), 3)
+        self.assertEqual(sm.last_result('Live', datetime(2021,9,23,12)), 'Waiting')
+        self.assertEqual(sm.last_result('Done', datetime(2021,9,23,4)), 'Success')
+        self.assertEqual((sm.result_hits, sm.result_misses), (2, 0))
+
+        # Misses fall back to the database, and unknown tasks are cached too
+        self.assertEqual(sm.last_result('Done', datetime(2021,9,23,0)), 'Success')
+        self.assertIsNone(sm.last_result('Unknown', datetime(2021,9,23,0)))
+        self.assertIsNone(sm.last_result('Unknown', datetime(2021,9,23,0)))
+        self.assertEqual((sm.result_hits, sm.result_misses), (3, 2))
+        self.assertEqual(len(sm.results), 3)
+
+        # Updates keep the cache current, Archived keeps the last result
+        sm.update('Unknown', datetime(2021,9,23,0), 'Running')
+        self.assertEqual(sm.last_result('Unknown', datetime(2021,9,23,0)), 'Running')
+        sm.update('Unknown', datetime(2021,9,23,0), 'Failure')
+        sm.update('Unknown', datetime(2021,9,23,0), 'Archived')
+        self.assertEqual(sm.last_result('Unknown', datetime(2021,9,23,0)), 'Failure')
+
+        sm.close()
+        os.remove(database_path)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,52 @@
+import os
+import sqlite3
+import unittest
+from datetime import datetime
+
+from core.state_manager import StateManager
+from core.state_reader import StateReader
+import config
+
+
+class TestStateReader(unittest.TestCase):
+
+    def test_state_reader(self):
+        database_path = os.path.join(config.get_test_directory(), 'test_state_reader.db')
+        with self.assertRaises(Exception):
+            StateReader(database_path)
+        self.assertFalse(os.path.exists(database_path))
+
+        sm = StateManager(database_path)
+        sm.update('TestRoutine', datetime(2021,9,23,12), 'Ready')
+        sm.update('TestRoutine', datetime(2021,9,23,12), 'Running')
+        sm.update('OtherRoutine', datetime(2021,9,23,13), 'Waiting')
+
+        reader = StateReader(database_path, pool_size=2)
+        self.assertEqual(len(reader.get_current_status()), 2)
+        self.assertEqual([row[2] for row in reader.get_current_status('TestRoutine')], ['Running'])
+        self.assertEqual(reader.last_result('TestRoutine', datetime(2021,9,23,12)), 'Running')
+        self.assertIsNone(reader.last_result('TestRoutine', datetime(2021,9,23,13)))
+
+        # Connections are read only
+        with self.assertRaises(sqlite3.OperationalError):
+            reader.query('DELETE FROM state')
+
+        # Reads see the last committed snapshot while a write transaction is open
+        sm.database.execute('BEGIN IMMEDIATE')
+        sm.database.execute("INSERT INTO current_state VALUES ('New', '2021-09-23 14:00:00', 'Ready', NULL)")
+        self.assertEqual(len(reader.get_current_status()), 2)
+        sm.database.commit()
+        self.assertEqual(len(reader.get_current_status()), 3)
+
+        # Idle connections are pooled up to pool_size
+        with reader.connection() as first, reader.connection() as second, reader.connection() as third:
+            pass
+        self.assertEqual(reader.pool.qsize(), 2)
+
+        reader.close()
+        sm.close()
+        os.remove(database_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import gzip
+import tempfile
+import unittest
+import multiprocessing as mp
+from datetime import datetime, timedelta
+
+import config
+from core.task import Task
+from core.executor import ProcessExecutor, PoolExecutor
+from core.task_logs import LogStore, LogWriter
+
+
+class TestTaskLogs(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log_directory = os.path.join(self.directory.name, 'logs')
+        config_path = os.path.join(self.directory.name, 'config.cfg')
+        with open(config_path, 'w') as config_file:
+            config_file.write('[DEFAULT]\nregistry = {0}\nlog_directory = {1}\n'.format(config_path,
+                                                                                      self.log_directory))
+        config.load_config_file(config_path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_segments(self):
+        writer = LogWriter(self.log_directory, segment_bytes=100)
+        writer.start()
+        # Interleaved runs, each written as one chunk when it ends
+        for i in range(200):
+            for run in range(3):
+                writer.write('a.run{}'.format(run), 'line {} of run {}'.format(i, run))
+        for run in range(3):
+            writer.write('a.run{}'.format(run), None)
+        writer.write('b.unfinished', 'never ended')
+        writer.stop()
+
+        store = LogStore(self.log_directory)
+        for run in range(3):
+            self.assertEqual(store.read('a.run{}'.format(run)),
+                             ''.join('line {} of run {}\n'.format(i, run) for i in range(200)))
+        self.assertEqual(store.read('b.unfinished'), 'never ended\n')
+        self.assertIsNone(store.read('c.missing'))
+
+        # Segments were rotated, and each is a plain multi-member gzip file
+        segments = sorted(os.listdir(os.path.join(self.log_directory, 'a')))
+        self.assertEqual(segments, ['segment_000001.log.gz', 'segment_000002.log.gz', 'segment_000003.log.gz'])
+        with gzip.open(os.path.join(self.log_directory, 'a', segments[0]), 'rt') as segment:
+            self.assertTrue(segment.read().startswith('line 0 of run 0\n'))
+
+        # A new writer appends to the latest segment, and reruns add to a task's log
+        writer = LogWriter(self.log_directory, segment_bytes=10000)
+        writer.start()
+        writer.write('a.run0', 'rerun')
+        writer.stop()
+        self.assertEqual(len(os.listdir(os.path.join(self.log_directory, 'a'))), 3)
+        self.assertTrue(store.read('a.run0').endswith('line 199 of run 0\nrerun\n'))
+
+    def test_directory_name(self):
+        # Characters with a meaning in URIs, and a relative path
+        log_directory = os.path.join(self.directory.name, 'logs ?#%20')
+        writer = LogWriter(log_directory)
+        writer.start()
+        writer.write('a.run0', 'line')
+        writer.write('a.run0', None)
+        writer.stop()
+        self.assertEqual(LogStore(log_directory).read('a.run0'), 'line\n')
+        self.assertEqual(LogStore(os.path.relpath(log_directory)).read('a.run0'), 'line\n')
+
+    def test_executors(self):
+        success = os.path.join(config.get_test_directory(), 'task_success.py')
+        failure = os.path.join(config.get_test_directory(), 'task_failure.py')
+        writer = LogWriter(self.log_directory)
+        writer.start()
+        result_queue = mp.Queue()
+        start = datetime(2021, 9, 21, 10, 0)
+        pool = PoolExecutor(result_queue, size=2, log_queue=writer.queue)
+        executors = [ProcessExecutor(log_queue=writer.queue), pool]
+        tasks = []
+        try:
+            for i, script in enumerate([success, failure] * 2):
+                task = Task('test', script, start + timedelta(minutes=i), queue=result_queue)
+                tasks.append(task)
+                executors[i // 2].submit(task)
+            states = {}
+            while len(states) < len(tasks):
+                message = result_queue.get(timeout=30)
+                if message.state in ['Success', 'Failure']:
+                    states[message.qualified_name] = message.state
+        finally:
+            pool.shutdown()
+        writer.stop()
+
+        store = LogStore(self.log_directory)
+        for task in tasks:
+            log = store.read(task.qualified_name)
+            self.assertIn('Running {}'.format(task.qualified_name), log)
+            self.assertIn('Exception: Test Exception' if states[task.qualified_name] == 'Failure' else 'Success', log)
+        # No file per task
+        self.assertEqual(os.listdir(os.path.join(self.log_directory, 'test')), ['segment_000001.log.gz'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,493 @@
+import os
+import queue
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+import config
+from core.message import Message, Request
+from core.clock import VirtualClock
+from core.registry import Registry
+from core.state_manager import StateManager
+from core.task import Task
+from core.task_logs import LogStore, LogWriter
+from task_manager import TaskManager
+
+now = datetime(2021, 9, 21, 10, 5)
+
+
+class RecordingExecutor:
+    """Stands in for an executor: records submitted tasks without running them"""
+    def __init__(self):
+        self.submitted = []
+        self.cancelled = []
+        self.dead = []
+
+    def submit(self, task):
+        self.submitted.append(task.qualified_name)
+
+    def cancel(self, qualified_name):
+        self.cancelled.append(qualified_name)
+        return True
+
+    def task_finished(self, message):
+        pass
+
+    def reap(self):
+        dead, self.dead = self.dead, []
+        return dead
+
+    def shutdown(self):
+        pass
+
+
+class ScriptedQueue(queue.Queue):
+    """
+    An event queue whose blocking waits are recorded and pass on the clock, instead of taking real time.  A wait on
+    an empty queue runs the next step of the script (which may put events on the queue) and, if it is still empty,
+    times out.
+    """
+    def __init__(self, clock, script):
+        super().__init__()
+        self.clock = clock
+        self.script = list(script)
+        self.waits = []
+
+    def get(self, block=True, timeout=None):
+        if not block:
+            return super().get(block=False)
+        self.waits.append(timeout)
+        if self.empty() and self.script:
+            self.script.pop(0)()
+        if self.empty():
+            self.clock.advance(self.clock.now() + timedelta(seconds=timeout))
+            raise queue.Empty
+        return super().get(block=False)
+
+
+class TestTaskManager(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.registry_path = os.path.join(self.directory.name, 'registry.xml')
+        config_path = os.path.join(self.directory.name, 'config.cfg')
+        with open(config_path, 'w') as config_file:
+            config_file.write('[DEFAULT]\nregistry = {}\nlog_directory = {}\ncatchup_max_running = 2\n'.format(
+                self.registry_path, os.path.join(self.directory.name, 'logs')))
+        self.write_registry(['<job name="a" script="a.py" schedule="0 * * * *"/>',
+                             '<job name="b" script="b.py"><dependency name="a"/></job>',
+                             '<job name="c" script="c.py" schedule="30 * * * *"/>',
+                             '<job name="d" script="d.py" schedule="15 * * * *"/>'])
+        self.configuration = config.load_config_file(config_path)
+        self.state_manager = StateManager(os.path.join(self.directory.name, 'state.db'))
+
+    def tearDown(self):
+        self.state_manager.close()
+        self.directory.cleanup()
+
+    def write_registry(self, jobs):
+        with open(self.registry_path, 'w') as registry_file:
+            registry_file.write('<registry>\n{}\n</registry>\n'.format('\n'.join(jobs)))
+
+    def tasks(self, task_manager, routine_name):
+        return sorted((task_manager.scheduled_tasks_dict[k] for k in task_manager.routine_tasks.get(routine_name, ())),
+                      key=lambda task: task.time)
+
+    def test_main_loop(self):
+        clock = VirtualClock(datetime(2021, 9, 21, 10, 14, 30))
+        executor = RecordingExecutor()
+        burst = 500
+        task_manager = None
+
+        def finish_burst():
+            # d's result and a burst of requests arrive together
+            task_manager.event_queue.put(Message(name='d', time=datetime(2021, 9, 21, 10, 15), state='Success',
+                                                 qualified_name='d.2021-09-21T10:15:00', time_stamp=clock.now()))
+            for i in range(burst - 1):
+                task_manager.event_queue.put(Request(request_id=i, command='status', arguments={}))
+
+        def stop():
+            task_manager.keep_running = False
+
+        events = ScriptedQueue(clock, [lambda: None, finish_burst, stop])
+        task_manager = TaskManager(events, self.state_manager, Registry(self.registry_path), self.configuration,
+                                   executor=executor, clock=clock)
+        for name, routine in task_manager.registry:
+            task_manager.schedule_next_task(routine, clock.now())
+        # An overdue Waiting task, behind an upstream still running, must not make the loop spin
+        self.state_manager.update('a', datetime(2021, 9, 21, 10), 'Running')
+        overdue = Task('b', 'b.py', datetime(2021, 9, 21, 10), {'a.2021-09-21T10:00:00': None}, queue=events)
+        task_manager.add_task(overdue, clock.now())
+        self.assertEqual(overdue.state, 'Waiting')
+        task_manager.main_loop()
+
+        # Blocked until d was due (not for 0 seconds, though b is overdue).  Then, with d running, for at most the reap
+        # interval but woken at once, by d's Running message and then by the burst, which was processed in a single
+        # pass.  Then until the stop.
+        self.assertEqual(events.waits, [30, 1, 1, 60])
+        self.assertEqual(clock.now(), datetime(2021, 9, 21, 10, 16))
+        self.assertEqual(executor.submitted, ['d.2021-09-21T10:15:00'])
+        self.assertEqual(task_manager.running_tasks, [])
+        summary = task_manager.scheduling_metrics()
+        self.assertEqual((summary['event_batches'], summary['max_batch']), (2, burst))
+        self.assertEqual((summary['dispatched'], summary['max_lag']), (1, 0))
+
+    def test_concurrency_limits(self):
+        self.write_registry(['<job name="a" script="a.py" schedule="*/5 * * * *" max_running="1"/>',
+                             '<job name="c" script="c.py" schedule="*/5 * * * *"/>',
+                             '<job name="d" script="d.py" schedule="*/5 * * * *"/>'])
+        self.configuration['DEFAULT']['max_running'] = '3'
+        executor = RecordingExecutor()
+        events = queue.Queue()
+        task_manager = TaskManager(events, self.state_manager, Registry(self.registry_path), self.configuration,
+                                   executor=executor, clock=VirtualClock(now))
+        for name, routine in task_manager.registry:
+            task_manager.schedule_next_task(routine, now)
+
+        def run_pending(reference_time):
+            task_manager.run_pending_jobs(reference_time)
+            while task_manager.wait_for_updates(0):
+                pass
+
+        def finish(qualified_name, state):
+            name, instance = qualified_name.split('.')
+            task_manager.process_message(Message(name=name, time=datetime.strptime(instance, config.dt_format_str),
+                                                 qualified_name=qualified_name, state=state, time_stamp=now))
+            while task_manager.wait_for_updates(0):
+                pass
+
+        # The global cap: once three are running, the next instances are queued
+        run_pending(datetime(2021, 9, 21, 10, 10))
+        self.assertEqual(executor.submitted, ['a.2021-09-21T10:10:00', 'c.2021-09-21T10:10:00',
+                                              'd.2021-09-21T10:10:00'])
+        run_pending(datetime(2021, 9, 21, 10, 15))
+        self.assertEqual(len(executor.submitted), 3)
+        self.assertEqual(sorted(task_manager.dispatch_queue.position), ['a.2021-09-21T10:15:00',
+                                                                        'c.2021-09-21T10:15:00',
+                                                                        'd.2021-09-21T10:15:00'])
+
+        # Queued is recorded, and shown by status
+        self.assertEqual(self.state_manager.last_result('c', datetime(2021, 9, 21, 10, 15)), 'Queued')
+        self.assertEqual(task_manager.task_status('c'), [['c', '2021-09-21T10:10:00', 'Running'],
+                                                         ['c', '2021-09-21T10:15:00', 'Queued'],
+                                                         ['c', '2021-09-21T10:20:00', 'Ready']])
+
+        # A Success frees a slot for the earliest queued task its routine's cap allows: a is held back by its own
+        # running instance, so c goes first, then d on a Failure, then a once its first instance has finished
+        finish('d.2021-09-21T10:10:00', 'Success')
+        self.assertEqual(executor.submitted[3:], ['c.2021-09-21T10:15:00'])
+        finish('c.2021-09-21T10:10:00', 'Failure')
+        self.assertEqual(executor.submitted[4:], ['d.2021-09-21T10:15:00'])
+        self.assertEqual(task_manager.task_status('a')[1], ['a', '2021-09-21T10:15:00', 'Queued'])
+        finish('a.2021-09-21T10:10:00', 'Success')
+        self.assertEqual(executor.submitted[5:], ['a.2021-09-21T10:15:00'])
+        self.assertEqual(len(task_manager.dispatch_queue), 0)
+        self.assertEqual(sorted(task_manager.running_tasks), ['a.2021-09-21T10:15:00', 'c.2021-09-21T10:15:00',
+                                                              'd.2021-09-21T10:15:00'])
+        self.assertEqual(self.state_manager.last_result('a', datetime(2021, 9, 21, 10, 15)), 'Running')
+
+    def test_dispatch_lag(self):
+        self.configuration['DEFAULT']['max_running'] = '1'
+        clock = VirtualClock(datetime(2021, 9, 21, 10, 15))
+        task_manager = TaskManager(queue.Queue(), self.state_manager, Registry(self.registry_path), self.configuration,
+                                   executor=RecordingExecutor(), clock=clock)
+        task_manager.catch_up(datetime(2021, 9, 21, 9, 59), clock.now())
+        task_manager.run_pending_jobs(clock.now())
+        # Only the task that started is measured, not the one queued behind it
+        self.assertEqual(task_manager.running_tasks, ['a.2021-09-21T10:00:00'])
+        self.assertEqual((task_manager.dispatch_lag.count(), task_manager.dispatch_lag.max()), (1, 15 * 60))
+
+        # The queued task is measured when it starts, and a forced run too
+        clock.advance(datetime(2021, 9, 21, 10, 25))
+        task_manager.process_message(Message(name='a', time=datetime(2021, 9, 21, 10), state='Success',
+                                             qualified_name='a.2021-09-21T10:00:00', time_stamp=clock.now()))
+        self.assertEqual(task_manager.running_tasks, ['d.2021-09-21T10:15:00'])
+        self.assertEqual((task_manager.dispatch_lag.count(), task_manager.dispatch_lag.max()), (2, 15 * 60))
+        self.assertEqual(task_manager.dispatch_lag.sum(), 25 * 60)
+        task_manager.process_message(Message(name='d', time=datetime(2021, 9, 21, 10, 15), state='Success',
+                                             qualified_name='d.2021-09-21T10:15:00', time_stamp=clock.now()))
+        self.assertEqual(task_manager.execute_task('c.2021-09-21T10:30:00'), 'Running')
+        self.assertEqual(task_manager.dispatch_lag.count(), 3)
+
+    def test_reload(self):
+        task_manager = TaskManager(queue.Queue(), self.state_manager, Registry(self.registry_path),
+                                   self.configuration, executor=RecordingExecutor(), clock=VirtualClock(now))
+        for name, routine in task_manager.registry:
+            task_manager.schedule_next_task(routine, now)
+        running = self.tasks(task_manager, 'c')[0]
+        task_manager.run_task(running)
+        unaffected = self.tasks(task_manager, 'b')[0]
+        self.assertEqual([k.time.minute for k in self.tasks(task_manager, 'c')], [30, 30])
+
+        # Change c, remove d and add e downstream of c
+        self.write_registry(['<job name="a" script="a.py" schedule="0 * * * *"/>',
+                             '<job name="b" script="b.py"><dependency name="a"/></job>',
+                             '<job name="c" script="c.py" schedule="45 * * * *"/>',
+                             '<job name="e" script="e.py" schedule="50 * * * *"><dependency name="c"/></job>'])
+        task_manager.process_request(Request(request_id=0, command='reload', arguments={}))
+
+        self.assertEqual(list(task_manager.registry.routines), ['a', 'b', 'c', 'e'])
+        c_tasks = self.tasks(task_manager, 'c')
+        self.assertIs(c_tasks[0], running)
+        self.assertEqual(running.state, 'Running')
+        self.assertEqual([(k.time.hour, k.time.minute, k.state) for k in c_tasks[1:]], [(10, 45, 'Ready')])
+        self.assertEqual(self.tasks(task_manager, 'd'), [])
+        self.assertIs(self.tasks(task_manager, 'b')[0], unaffected)
+
+        e_task = self.tasks(task_manager, 'e')[0]
+        self.assertEqual(e_task.state, 'Waiting')
+        self.assertEqual(task_manager.task_dependencies.dependants_of(c_tasks[1].qualified_name),
+                         {e_task.qualified_name})
+        status = {row[0]: row[2] for row in self.state_manager.get_current_status()}
+        self.assertNotIn('d', status)
+
+        # An invalid registry is not applied
+        self.write_registry(['<job name="a" schedule="0 * * * *"><dependency name="a"/></job>'])
+        task_manager.process_request(Request(request_id=0, command='reload', arguments={}))
+        self.assertEqual(list(task_manager.registry.routines), ['a', 'b', 'c', 'e'])
+
+    def test_catch_up(self):
+        self.write_registry(['<job name="a" script="a.py" schedule="0 * * * *"/>',
+                             '<job name="b" script="b.py"><dependency name="a"/></job>',
+                             '<job name="c" script="c.py" schedule="*/15 * * * *" catchup="latest"/>',
+                             '<job name="d" script="d.py" schedule="30 * * * *" catchup="none"/>'])
+        # Left pending when the scheduler was stopped at 07:05
+        self.state_manager.update('c', datetime(2021, 9, 21, 7, 15), 'Ready')
+        self.state_manager.update('d', datetime(2021, 9, 21, 7, 30), 'Ready')
+        self.state_manager.update('gone', datetime(2021, 9, 21, 7, 30), 'Ready')
+
+        executor = RecordingExecutor()
+        task_manager = TaskManager(queue.Queue(), self.state_manager, Registry(self.registry_path),
+                                   self.configuration, executor=executor, clock=VirtualClock(now))
+        task_manager.catch_up(datetime(2021, 9, 21, 7, 5), now)
+        for name, routine in task_manager.registry:
+            task_manager.schedule_next_task(routine, now)
+
+        def times(name):
+            return [(k.time.hour, k.time.minute, k.catchup) for k in self.tasks(task_manager, name)]
+        self.assertEqual(times('a'), [(8, 0, True), (9, 0, True), (10, 0, True), (11, 0, False)])
+        self.assertEqual(times('b'), [(8, 0, True), (9, 0, True), (10, 0, True), (11, 0, False)])
+        self.assertEqual(times('c'), [(10, 0, True), (10, 15, False)])
+        self.assertEqual(times('d'), [(10, 30, False)])
+        self.assertEqual([k.state for k in self.tasks(task_manager, 'b')], ['Waiting'] * 4)
+        status = {(row[0], row[1].hour, row[1].minute) for row in self.state_manager.get_current_status()}
+        self.assertNotIn(('c', 7, 15), status)
+        self.assertNotIn(('d', 7, 30), status)
+        self.assertNotIn(('gone', 7, 30), status)
+        self.assertEqual(len(status), 11)
+
+        # At most catchup_max_running catch-up tasks run at once, earliest first
+        task_manager.run_pending_jobs(now)
+        self.assertEqual(executor.submitted, ['a.2021-09-21T08:00:00', 'a.2021-09-21T09:00:00'])
+        self.assertEqual(len(task_manager.catchup_queue), 2)
+        first = self.tasks(task_manager, 'a')[0]
+        task_manager.process_message(Message(name='a', time=first.time, qualified_name=first.qualified_name,
+                                             state='Success', time_stamp=now))
+        self.assertEqual(executor.submitted[2:], ['a.2021-09-21T10:00:00'])
+        self.assertEqual(self.tasks(task_manager, 'b')[0].state, 'Ready')
+
+    def test_requests(self):
+        responses = {}
+        task_manager = TaskManager(queue.Queue(), self.state_manager, Registry(self.registry_path),
+                                   self.configuration, executor=RecordingExecutor(),
+                                   responder=lambda request_id, response: responses.update({request_id: response}),
+                                   clock=VirtualClock(now))
+        for name, routine in task_manager.registry:
+            task_manager.schedule_next_task(routine, now)
+
+        def request(command, **arguments):
+            task_manager.process_request(Request(request_id=len(responses), command=command, arguments=arguments))
+            return responses[len(responses) - 1]
+
+        # Status is served from memory
+        self.assertEqual(request('status', routine_name='a'),
+                         {'ok': True, 'result': [['a', '2021-09-21T11:00:00', 'Ready']]})
+        self.assertEqual(len(request('status')['result']), 4)
+        self.assertEqual(request('cancel', task_name='d.2021-09-21T10:15:00')['result'], 1)
+        self.assertEqual(request('execute', task_name='c.2021-09-21T10:30:00')['result'], 'Running')
+        # A task no longer held is re-created from its routine
+        self.assertEqual(request('execute', task_name='a.2021-09-21T09:00:00')['result'], 'Running')
+
+        self.assertEqual(request('execute', task_name='c.2021-09-21T10:30:00'),
+                         {'ok': False, 'error': 'c.2021-09-21T10:30:00 is already running'})
+        self.assertEqual(request('cancel', task_name='x.2021-09-21T10:30:00'),
+                         {'ok': False, 'error': 'Unknown task: x.2021-09-21T10:30:00'})
+        self.assertEqual(request('launch'), {'ok': False, 'error': 'Unknown command: launch'})
+
+    def test_execute_missing_upstream(self):
+        executor = RecordingExecutor()
+        events = queue.Queue()
+        task_manager = TaskManager(events, self.state_manager, Registry(self.registry_path), self.configuration,
+                                   executor=executor, clock=VirtualClock(now))
+        for name, routine in task_manager.registry:
+            task_manager.schedule_next_task(routine, now)
+
+        # A past instance whose upstream never ran is refused, not run and then cancelled under its feet
+        with self.assertRaisesRegex(Exception, 'upstream task a.2021-09-21T09:00:00 has no record'):
+            task_manager.execute_task('b.2021-09-21T09:00:00')
+        self.assertNotIn('b.2021-09-21T09:00:00', task_manager.scheduled_tasks_dict)
+        self.assertEqual(executor.submitted, [])
+        self.assertTrue(events.empty())
+        self.assertIsNone(self.state_manager.last_result('b', datetime(2021, 9, 21, 9)))
+
+        # Once the upstream has run, it can be
+        self.state_manager.update('a', datetime(2021, 9, 21, 9), 'Success')
+        self.assertEqual(task_manager.execute_task('b.2021-09-21T09:00:00'), 'Running')
+
+        # A running task dropped from the scheduler is ignored by the supervisor, apart from freeing its slot
+        task_manager.remove_task('b.2021-09-21T09:00:00')
+        task_manager.deadlines.push('b.2021-09-21T09:00:00', now)
+        task_manager.supervise(now)
+        self.assertEqual(task_manager.running_tasks, ['b.2021-09-21T09:00:00'])
+        executor.dead = [('b.2021-09-21T09:00:00', -9)]
+        task_manager.supervise(now)
+        self.assertEqual(task_manager.running_tasks, [])
+        self.assertEqual(task_manager.running_per_routine['b'], 0)
+
+    def test_cancel(self):
+        self.write_registry(['<job name="a" script="a.py" schedule="0 * * * *"/>',
+                             '<job name="b" script="b.py"><dependency name="a"/></job>',
+                             '<job name="c" script="c.py" schedule="30 * * * *"><dependency name="b"/></job>'])
+        self.configuration['DEFAULT']['max_running'] = '1'
+        executor = RecordingExecutor()
+        task_manager = TaskManager(queue.Queue(), self.state_manager, Registry(self.registry_path),
+                                   self.configuration, executor=executor, clock=VirtualClock(now))
+        task_manager.catch_up(datetime(2021, 9, 21, 7, 5), now)
+        task_manager.run_pending_jobs(now)
+        running = task_manager.running_tasks[0]
+        self.assertEqual(running, 'a.2021-09-21T08:00:00')
+        self.assertEqual(len(task_manager.catchup_queue), 2)
+
+        # a at 08:00 and everything downstream of it: b at 08:00 and c at 08:30
+        task_manager.process_request(Request(request_id=0, command='cancel', arguments={'task_name': running}))
+        self.assertEqual(executor.cancelled, [running])
+        self.assertEqual([k.qualified_name for k in self.tasks(task_manager, 'a')],
+                         ['a.2021-09-21T09:00:00', 'a.2021-09-21T10:00:00'])
+        self.assertEqual([k.time.hour for k in self.tasks(task_manager, 'b')], [9, 10])
+        self.assertNotIn('c.2021-09-21T08:30:00', task_manager.scheduled_tasks_dict)
+        self.assertIn('c.2021-09-21T09:30:00', task_manager.scheduled_tasks_dict)
+        status = {(row[0], row[1].hour) for row in self.state_manager.get_current_status()}
+        self.assertNotIn(('a', 8), status)
+        self.assertNotIn(('b', 8), status)
+
+        # The slot is freed for the next queued task, and a late result of the killed task is ignored
+        self.assertEqual(task_manager.running_tasks, ['a.2021-09-21T09:00:00'])
+        task_manager.process_message(Message(name='a', time=datetime(2021, 9, 21, 8), qualified_name=running,
+                                             state='Success', time_stamp=now))
+        self.assertEqual(task_manager.running_tasks, ['a.2021-09-21T09:00:00'])
+        self.assertNotIn(('a', 8), {(row[0], row[1].hour) for row in self.state_manager.get_current_status()})
+
+    def test_supervise(self):
+        self.write_registry(['<job name="a" script="a.py" schedule="0 * * * *" timeout="30"/>',
+                             '<job name="b" script="b.py" schedule="0 * * * *"/>'])
+        self.configuration['DEFAULT']['max_running'] = '1'
+        executor = RecordingExecutor()
+        log_directory = self.configuration.get('DEFAULT', 'log_directory')
+        log_writer = LogWriter(log_directory)
+        log_writer.start()
+        task_manager = TaskManager(queue.Queue(), self.state_manager, Registry(self.registry_path),
+                                   self.configuration, executor=executor, log_writer=log_writer,
+                                   clock=VirtualClock(now))
+        for name, routine in task_manager.registry:
+            task_manager.schedule_next_task(routine, now)
+        task_manager.run_pending_jobs(datetime(2021, 9, 21, 11))
+        self.assertEqual(task_manager.running_tasks, ['a.2021-09-21T11:00:00'])
+
+        # Killed once past its routine's timeout, and the slot goes to the queued task
+        task_manager.supervise(now + timedelta(seconds=29))
+        self.assertEqual(executor.cancelled, [])
+        task_manager.supervise(now + timedelta(seconds=31))
+        self.assertEqual(executor.cancelled, ['a.2021-09-21T11:00:00'])
+        self.assertEqual(task_manager.scheduled_tasks_dict['a.2021-09-21T11:00:00'].state, 'Failure')
+        self.assertEqual(task_manager.running_tasks, ['b.2021-09-21T11:00:00'])
+
+        # A task whose process died without reporting is recorded as failed
+        executor.dead = [('b.2021-09-21T11:00:00', -9)]
+        task_manager.supervise(now)
+        self.assertEqual(task_manager.running_tasks, [])
+        self.assertEqual(self.state_manager.last_result('b', datetime(2021, 9, 21, 11)), 'Failure')
+        log_writer.stop()
+        self.assertIn('process exited with code -9 without reporting a result',
+                      LogStore(log_directory).read('b.2021-09-21T11:00:00'))
+
+    def test_backfill(self):
+        self.configuration['DEFAULT']['backfill_window'] = '4'
+        executor = RecordingExecutor()
+        events = queue.Queue()
+        task_manager = TaskManager(events, self.state_manager, Registry(self.registry_path), self.configuration,
+                                   executor=executor, clock=VirtualClock(now))
+        task_manager.process_request(Request(request_id=0, command='backfill', arguments={
+            'routine': 'a', 'start': '2021-09-20T00:00:00', 'end': '2021-09-20T05:00:00'}))
+        backfill = task_manager.backfills['backfill-1']
+        self.assertEqual(backfill.routines, ['a', 'b'])
+
+        def pending():
+            return sorted((k.time.hour, k.name, k.state) for k in task_manager.scheduled_tasks_dict.values())
+        # Generated lazily, upstream instances first
+        self.assertEqual(pending(), [(0, 'a', 'Ready'), (0, 'b', 'Waiting'), (1, 'a', 'Ready'), (1, 'b', 'Waiting')])
+
+        def finish(qualified_name, state):
+            task = task_manager.scheduled_tasks_dict[qualified_name]
+            task_manager.process_message(Message(name=task.name, time=task.time, qualified_name=qualified_name,
+                                                 state=state, time_stamp=now))
+            while task_manager.wait_for_updates(0):
+                pass
+            task_manager.run_pending_jobs(now)
+
+        # At most backfill_max_running backfill tasks run at once
+        task_manager.run_pending_jobs(now)
+        self.assertEqual(executor.submitted, ['a.2021-09-20T00:00:00', 'a.2021-09-20T01:00:00'])
+        finish('a.2021-09-20T00:00:00', 'Success')
+        self.assertEqual(executor.submitted[2:], ['b.2021-09-20T00:00:00'])
+        self.assertEqual(len(task_manager.backfill_queue), 1)
+
+        # Instances downstream of a failure are cancelled rather than left waiting
+        finish('a.2021-09-20T01:00:00', 'Failure')
+        self.assertNotIn('b.2021-09-20T01:00:00', task_manager.scheduled_tasks_dict)
+        self.assertEqual(backfill.counts['Cancelled'], 1)
+
+        # Progress is reported by the backfill_status request
+        responses = []
+        task_manager.responder = lambda request_id, response: responses.append(response)
+        task_manager.process_request(Request(request_id=1, command='backfill_status', arguments={}))
+        self.assertEqual(responses[-1], {'ok': True, 'result': [{
+            'name': 'backfill-1', 'routine': 'a', 'start': '2021-09-20T00:00:00', 'end': '2021-09-20T05:00:00',
+            'total': 12, 'generated': 7, 'skipped': 0, 'done': 1, 'failed': 1, 'cancelled': 1, 'running': 2,
+            'remaining': 9, 'finished': False}]})
+
+        while task_manager.running_tasks:
+            finish(task_manager.running_tasks[0], 'Success')
+        self.assertNotIn('backfill-1', task_manager.backfills)
+        self.assertEqual(backfill.counts, {'created': 12, 'skipped': 0, 'Success': 10, 'Failure': 1, 'Cancelled': 1})
+        # Finished backfills are still reported
+        status = task_manager.backfill_status('backfill-1')[0]
+        self.assertEqual((status['generated'], status['done'], status['running'], status['remaining'],
+                          status['finished']), (12, 10, 0, 0, True))
+        task_manager.process_request(Request(request_id=2, command='backfill_status', arguments={'name': 'backfill-2'}))
+        self.assertEqual(responses[-1], {'ok': False, 'error': 'Unknown backfill: backfill-2'})
+        # Backfill tasks do not schedule live instances
+        self.assertEqual(sorted(task_manager.scheduled_tasks_dict), ['a.2021-09-20T01:00:00'])
+
+    def test_backfill_priority(self):
+        self.configuration['DEFAULT']['max_running'] = '1'
+        executor = RecordingExecutor()
+        task_manager = TaskManager(queue.Queue(), self.state_manager, Registry(self.registry_path),
+                                   self.configuration, executor=executor, clock=VirtualClock(now))
+        task_manager.schedule_next_task(task_manager.registry.get_routine('d'), now)
+        task_manager.start_backfill('c', datetime(2021, 9, 20), datetime(2021, 9, 20, 1))
+
+        # Both are ready when the live task falls due: the live task takes the only slot, though the backfill
+        # task's time is earlier
+        live_time = datetime(2021, 9, 21, 10, 15)
+        task_manager.run_pending_jobs(live_time)
+        self.assertEqual(executor.submitted, ['d.2021-09-21T10:15:00'])
+        self.assertEqual(list(task_manager.backfill_queue.position), ['c.2021-09-20T00:30:00'])
+        self.assertEqual(len(task_manager.dispatch_queue), 0)
+
+        task_manager.process_message(Message(name='d', time=live_time, qualified_name='d.2021-09-21T10:15:00',
+                                             state='Success', time_stamp=live_time))
+        self.assertEqual(executor.submitted[1:], ['c.2021-09-20T00:30:00'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import random
+import unittest
+from datetime import datetime, timedelta
+
+from core.message import Message
+from core.task_queue import IndexedHeap, TaskQueue
+
+
+class TestTaskQueue(unittest.TestCase):
+
+    def test_indexed_heap(self):
+        rng = random.Random(0)
+        heap = IndexedHeap()
+        expected = {}
+        for i in range(2000):
+            key = rng.randint(0, 300)
+            if rng.random() < 0.3:
+                heap.remove(key)
+                expected.pop(key, None)
+            else:
+                priority = rng.randint(0, 1000)
+                heap.push(key, priority)
+                expected[key] = priority
+            self.assertEqual(len(heap), len(expected))
+            if expected:
+                self.assertEqual(heap.peek()[0], min(expected.values()))
+
+        popped = [heap.pop()[0] for _ in range(len(heap))]
+        self.assertEqual(popped, sorted(expected.values()))
+        self.assertIsNone(heap.peek())
+
+    def test_task_queue(self):
+        start = datetime(2021, 9, 21, 10, 0)
+        tasks = [Message(qualified_name='task{}'.format(i), time=start + timedelta(minutes=i), state='Waiting',
+                         backfill=None) for i in range(5)]
+        queue = TaskQueue()
+        for task in reversed(tasks):
+            queue.update(task)
+
+        self.assertEqual(len(queue), 5)
+        self.assertIsNone(queue.next_ready_time())
+        self.assertIsNone(queue.next_due(start + timedelta(minutes=10)))
+
+        tasks[3].state = 'Ready'
+        queue.update(tasks[3])
+        self.assertEqual(queue.next_ready_time(), start + timedelta(minutes=3))
+        self.assertIsNone(queue.next_due(start + timedelta(minutes=2)))
+        self.assertIs(queue.next_due(start + timedelta(minutes=3)), tasks[3])
+
+        tasks[3].state = 'Running'
+        queue.update(tasks[3])
+        self.assertIsNone(queue.next_due(start + timedelta(minutes=10)))
+        self.assertNotIn('task3', queue)
+
+        tasks[0].state = 'Cancelled'
+        queue.update(tasks[0])
+        self.assertNotIn('task0', queue)
+
+        queue.remove('task1')
+        queue.remove('task2')
+        queue.remove('task4')
+        self.assertEqual(len(queue), 0)
+
+        # A due backfill task comes after every due live task, however far in the past it is
+        live = Message(qualified_name='live', time=start, state='Ready', backfill=None)
+        backfill = Message(qualified_name='old', time=start - timedelta(days=30), state='Ready', backfill='backfill-1')
+        queue.update(backfill)
+        queue.update(live)
+        self.assertEqual(queue.next_ready_time(), backfill.time)
+        self.assertIsNone(queue.next_due(start - timedelta(days=31)))
+        self.assertIs(queue.next_due(start - timedelta(days=1)), backfill)
+        self.assertIs(queue.next_due(start), live)
+        live.state = 'Running'
+        queue.update(live)
+        self.assertIs(queue.next_due(start), backfill)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,25 @@
-from flask import Flask, render_template, request
+from urllib.request import urlopen
 
-from config import get_live_instances
+from flask import Flask, redirect, render_template, request, url_for
+
+from config import get_live_instances, get_instance_config_location, load_config_file
+from core.state_reader import StateReader
+from core.task_logs import LogStore
+from input import send_command
 
 app = Flask(__name__)
 
+# Read-only state database readers, by scheduler instance name, shared across requests
+state_readers = {}
+
+
+def get_state_reader(instance_name):
+    if instance_name not in state_readers:
+        configuration = load_config_file(get_instance_config_location(instance_name))
+        state_readers[instance_name] = StateReader(configuration.get('DEFAULT', 'database'))
+    return state_readers[instance_name]
+
+
 @app.route("/", methods=['POST', 'GET'])
 def hello_world():
 
@@ -18,6 +34,40 @@ def hello_world():
     if len(instances) == 0:
         selected = 'None'
     else:
-        pass
+        selected = instances[0][0]
+
+    return render_template('base.html', selected=selected, live=live)
+
+
+@app.route("/status/<instance_name>")
+def status(instance_name):
+    rows = get_state_reader(instance_name).get_current_status(request.args.get('routine'))
+    live = [(i, k[1]) for i, k in enumerate(get_live_instances())]
+    return render_template('status.html', selected=instance_name, live=live, rows=rows)
+
+
+@app.route("/cancel/<instance_name>", methods=['POST'])
+def cancel(instance_name):
+    configuration = load_config_file(get_instance_config_location(instance_name))
+    send_command(configuration.getint('SESSION', 'port'), 'cancel', task_name=request.form['task_name'])
+    return redirect(url_for('status', instance_name=instance_name))
+
+
+@app.route("/log/<instance_name>/<task_name>")
+def task_log(instance_name, task_name):
+    configuration = load_config_file(get_instance_config_location(instance_name))
+    log = LogStore(configuration.get('DEFAULT', 'log_directory')).read(task_name)
+    if log is None:
+        return 'No log found for {}'.format(task_name), 404
+    return log, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
 
-    return render_template('base.html', selected=selected, live=live)
\ No newline at end of file
+@app.route("/metrics/<instance_name>")
+def metrics(instance_name):
+    configuration = load_config_file(get_instance_config_location(instance_name))
+    port = configuration.get('SESSION', 'metrics_port', fallback='')
+    if not port:
+        return 'Metrics are not served by {}'.format(instance_name), 404
+    host = configuration.get('DEFAULT', 'metrics_host', fallback='localhost')
+    with urlopen('http://{}:{}/metrics'.format(host, port), timeout=5) as response:
+        return response.read(), 200, {'Content-Type': response.headers['Content-Type']}